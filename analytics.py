@@ -0,0 +1,194 @@
+import logging
+import os
+
+from psycopg2.extras import RealDictCursor
+
+from cache import MARKET_STATS, invalidate, market_stats_cache, publish_invalidation
+from metrics import instrument_module
+
+"""
+Market price statistics per city, zip code and property type.
+
+- The statistics are computed in batch by Postgres and stored in the market_stats
+  table (migration 4), GET /market/stats/{city} only reads that table, through
+  market_stats_cache, so a dashboard never aggregates the listings on request
+- New, changed or deleted listings, prices, locations (city, zip code), sizes and
+  property types mark the property's city in market_stats_dirty (triggers, see
+  migrations 4 and 18), a location that moved marks both cities.
+  refresh_market_stats() recomputes only those cities, plus the ones older than
+  MARKET_STATS_MAX_AGE, because the 30 day trend moves with time even when nothing
+  is written
+- Every group covers the active listings: the price of a property is its latest
+  price_history price, or the listing's start price when it has none. Each city also
+  gets rollup rows over all zip codes and / or all property types, stored with ''
+  and returned as null
+- price_changes_30d counts the price_history records of the last 30 days,
+  median_price_change_30d_pct compares the price with the price 30 days ago (capped
+  to what its NUMERIC(8, 2) column holds)
+- Every city is refreshed in a savepoint of its own: a city that fails is logged and
+  keeps its previous statistics, the others are still refreshed
+"""
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which a city is recomputed even if nothing changed, 0 turns that off
+MARKET_STATS_MAX_AGE = float(os.getenv("MARKET_STATS_MAX_AGE", "86400"))
+
+# Any constant works, it only has to be the same in every worker
+MARKET_STATS_REFRESH_LOCK = 7_001_003
+
+# One sort per group for all the percentiles: percentile_cont over an array of fractions
+MARKET_STATS_REFRESH_SQL = """
+            WITH prices AS (
+                SELECT loc.city, loc.zip_code, p.property_type,
+                    cur.price,
+                    cur.price::float8 / f.size_sqm AS price_per_sqm,
+                    (cur.price::float8 / NULLIF(old.price, 0) - 1) * 100 AS change_30d_pct,
+                    (SELECT COUNT(*) FROM price_history ph
+                        WHERE ph.property_id = p.id
+                        AND ph.record_at > CURRENT_TIMESTAMP - INTERVAL '30 days') AS price_changes_30d
+                FROM location loc
+                JOIN properties p ON p.id = loc.property_id
+                JOIN features f ON f.property_id = p.id
+                JOIN LATERAL (
+                    SELECT l.start_price, l.created_at
+                    FROM listing_property l
+                    WHERE l.property_id = p.id AND l.listing_status = 'Active'
+                    ORDER BY l.created_at DESC, l.id DESC
+                    LIMIT 1
+                ) al ON TRUE
+                LEFT JOIN LATERAL (
+                    SELECT ph.end_price
+                    FROM price_history ph
+                    WHERE ph.property_id = p.id
+                    ORDER BY ph.record_at DESC, ph.id DESC
+                    LIMIT 1
+                ) latest ON TRUE
+                LEFT JOIN LATERAL (
+                    SELECT ph.end_price
+                    FROM price_history ph
+                    WHERE ph.property_id = p.id
+                    AND ph.record_at <= CURRENT_TIMESTAMP - INTERVAL '30 days'
+                    ORDER BY ph.record_at DESC, ph.id DESC
+                    LIMIT 1
+                ) before ON TRUE
+                CROSS JOIN LATERAL (
+                    SELECT COALESCE(latest.end_price, al.start_price) AS price
+                ) cur
+                CROSS JOIN LATERAL (
+                    SELECT CASE WHEN al.created_at <= CURRENT_TIMESTAMP - INTERVAL '30 days'
+                        THEN COALESCE(before.end_price, al.start_price) END AS price
+                ) old
+                WHERE loc.city = ANY(%s) AND f.size_sqm > 0
+            ),
+            groups AS (
+                SELECT city,
+                    COALESCE(zip_code, '') AS zip_code,
+                    COALESCE(property_type, '') AS property_type,
+                    COUNT(*) AS listings,
+                    percentile_cont(0.5) WITHIN GROUP (ORDER BY price) AS median_price,
+                    AVG(price_per_sqm) AS avg_price_per_sqm,
+                    MIN(price_per_sqm) AS min_price_per_sqm,
+                    MAX(price_per_sqm) AS max_price_per_sqm,
+                    percentile_cont(ARRAY[0.1, 0.25, 0.5, 0.75, 0.9])
+                        WITHIN GROUP (ORDER BY price_per_sqm) AS price_per_sqm_percentiles,
+                    SUM(price_changes_30d) AS price_changes_30d,
+                    percentile_cont(0.5) WITHIN GROUP (ORDER BY change_30d_pct) AS median_price_change_30d_pct
+                FROM prices
+                GROUP BY GROUPING SETS ((city), (city, zip_code), (city, property_type), (city, zip_code, property_type))
+            )
+            INSERT INTO market_stats (
+                city, zip_code, property_type, listings, median_price,
+                avg_price_per_sqm, min_price_per_sqm, p10_price_per_sqm, p25_price_per_sqm,
+                median_price_per_sqm, p75_price_per_sqm, p90_price_per_sqm, max_price_per_sqm,
+                price_changes_30d, median_price_change_30d_pct)
+            SELECT city, zip_code, property_type, listings, ROUND(median_price),
+                avg_price_per_sqm, min_price_per_sqm,
+                price_per_sqm_percentiles[1], price_per_sqm_percentiles[2], price_per_sqm_percentiles[3],
+                price_per_sqm_percentiles[4], price_per_sqm_percentiles[5], max_price_per_sqm,
+                price_changes_30d,
+                LEAST(GREATEST(median_price_change_30d_pct, -999999.99), 999999.99)
+            FROM groups;
+            """
+
+def refresh_market_stats(conn, max_age=MARKET_STATS_MAX_AGE, full=False):
+    """
+    Recomputes the statistics of the dirty (and outdated) cities, or of every city with
+    full=True. Only one worker refreshes at a time, the others skip and get None.
+    Returns the refreshed cities, without the ones that failed.
+    """
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s);", (MARKET_STATS_REFRESH_LOCK,))
+            if not cursor.fetchone()[0]:
+                return None
+            # A write committed after this DELETE marks its city again for the next refresh
+            cursor.execute("DELETE FROM market_stats_dirty RETURNING city;")
+            cities = {row[0] for row in cursor.fetchall()}
+            if full:
+                cursor.execute("SELECT city FROM location UNION SELECT city FROM market_stats;")
+                cities.update(row[0] for row in cursor.fetchall())
+            elif max_age:
+                cursor.execute(
+                    """SELECT DISTINCT city FROM market_stats
+                    WHERE refreshed_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second';
+                    """,
+                    (max_age,)
+                )
+                cities.update(row[0] for row in cursor.fetchall())
+            if not cities:
+                return []
+            refreshed = []
+            for city in sorted(cities):
+                cursor.execute("SAVEPOINT market_stats_city;")
+                try:
+                    # Cities without active listings anymore simply end up without rows
+                    cursor.execute("DELETE FROM market_stats WHERE city = %s;", (city,))
+                    cursor.execute(MARKET_STATS_REFRESH_SQL, ([city],))
+                except Exception:
+                    # Not marked dirty again: it is retried after its next change, or on
+                    # every run once its statistics are older than max_age
+                    cursor.execute("ROLLBACK TO SAVEPOINT market_stats_city;")
+                    logger.exception("Refreshing the market stats of %r failed", city)
+                    continue
+                finally:
+                    cursor.execute("RELEASE SAVEPOINT market_stats_city;")
+                refreshed.append(city)
+            if refreshed:
+                publish_invalidation(cursor, MARKET_STATS)
+    if refreshed:
+        invalidate(MARKET_STATS)
+    return refreshed
+
+MARKET_STATS_SQL = """SELECT
+                city, NULLIF(zip_code, '') AS zip_code, NULLIF(property_type, '') AS property_type,
+                listings, median_price,
+                avg_price_per_sqm, min_price_per_sqm, p10_price_per_sqm, p25_price_per_sqm,
+                median_price_per_sqm, p75_price_per_sqm, p90_price_per_sqm, max_price_per_sqm,
+                price_changes_30d, median_price_change_30d_pct, refreshed_at
+                FROM market_stats
+                WHERE city = %s
+                AND (%s::text IS NULL OR zip_code = %s)
+                AND (%s::text IS NULL OR property_type = %s)
+                ORDER BY market_stats.zip_code, market_stats.property_type;
+                """
+
+def _load_market_stats(conn, city, zip_code, property_type):
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(MARKET_STATS_SQL, (city, zip_code, zip_code, property_type, property_type))
+            return cursor.fetchall()
+
+def get_market_stats(conn, city, zip_code=None, property_type=None):
+    """
+    The stored statistics of a city, narrowed down to a zip code and / or property type.
+    Rows with a null zip_code or property_type are the rollups over all of them.
+    """
+    return market_stats_cache.get_or_load(
+        (city, zip_code, property_type),
+        lambda: _load_market_stats(conn, city, zip_code, property_type),
+    )
+
+
+# Call counts, latency, rows and errors of the query functions above, see metrics.py
+instrument_module(globals(), __name__)
@@ -1,6 +1,13 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Annotated, Literal
 
 import psycopg2
+from analytics import get_market_stats, refresh_market_stats
+from bulk_import import detect_format, import_properties, text_lines
+from cache import cache_stats, start_cross_worker_invalidation
 from db import (
     add_agency,
     add_broker,
@@ -9,11 +16,13 @@ from db import (
     add_user,
     bid_on_property,
     compare_properties,
+    count_unread_notifications,
     create_comparison_list,
     delete_agency_by_id,
     delete_broker_by_id,
     delete_comparison_list,
     delete_notification,
+    delete_notifications,
     delete_property,
     delete_user,
     edit_agency,
@@ -28,28 +37,59 @@ from db import (
     get_brokers,
     get_comparison_list_by_id,
     get_comparison_list_items,
+    get_comparison_matrix,
     get_favorite_properties,
+    get_favorites_feed,
     get_listings,
+    get_listings_in_box,
+    get_listings_nearby,
+    get_nearest_listings,
     get_notifications,
     get_offers_for_property,
     get_price_history,
     get_properties,
+    get_properties_by_ids,
     get_property_by_id,
+    get_property_view_stats,
     get_property_views,
+    get_top_bid,
     get_user,
     get_users,
     listing_property,
+    LISTING_SORTS,
+    MAX_BATCH_PROPERTIES,
     make_offer,
     mark_notification_as_read,
+    mark_notifications_as_read,
     record_price_history,
     record_property_view,
+    refresh_property_view_stats,
     remove_from_comparison,
+    search_listings,
+    search_listings_text,
     unfavorite_property,
     unlist_property,
     update_listing_status,
 )
-from db_setup import get_connection
-from fastapi import FastAPI, HTTPException, status
+from db_setup import (
+    DATABASE_BACKEND,
+    close_async_pool,
+    close_pool,
+    get_async_pool,
+    get_db,
+    get_pool,
+    open_async_pool,
+)
+from export import export_response
+from fastapi import Depends, FastAPI, File, HTTPException, Query, UploadFile, status
+from fastapi.responses import PlainTextResponse
+from live import event_stream_response, live_hub
+from metrics import RequestMetricsMiddleware, render
+from notification_fanout import notification_fanout
+from pagination import next_cursor
+from pg_listener import get_listener
+from prepared import stats as prepared_stats
+from scheduler import start_periodic, stop_periodic
 from schemas import (
     AddToComparisonList,
     AgencyCreate,
@@ -63,6 +103,8 @@ from schemas import (
     CreatePriceHistory,
     CreatOffer,
     ListingCreate,
+    ListingSearch,
+    NotificationIds,
     PropertyFullCreate,
     PropertyUpdate,
     RecordView,
@@ -70,8 +112,59 @@ from schemas import (
     UserCreate,
     UserUpdate,
 )
-
-app = FastAPI()
+from view_buffer import VIEW_BUFFER_ENABLED, view_buffer
+
+# Seconds between refreshes of the property view rollups, 0 turns the refresh off
+VIEW_STATS_REFRESH_INTERVAL = float(os.getenv("VIEW_STATS_REFRESH_INTERVAL", "300"))
+# Seconds between refreshes of the market statistics of changed cities, 0 turns it off
+MARKET_STATS_REFRESH_INTERVAL = float(os.getenv("MARKET_STATS_REFRESH_INTERVAL", "60"))
+
+
+def local_time(value):
+    """The timestamps in the database are naive local time, convert aware query parameters to that."""
+    return value.astimezone().replace(tzinfo=None) if value and value.tzinfo else value
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the pool (and its min_size connections) up front instead of on the first request
+    get_pool()
+    if DATABASE_BACKEND == "async":
+        await open_async_pool()
+    start_cross_worker_invalidation()
+    live_hub.start(asyncio.get_running_loop())
+    notification_fanout.start()
+    if VIEW_BUFFER_ENABLED:
+        view_buffer.start()
+    start_periodic("refresh-view-stats", VIEW_STATS_REFRESH_INTERVAL, refresh_property_view_stats)
+    start_periodic("refresh-market-stats", MARKET_STATS_REFRESH_INTERVAL, refresh_market_stats)
+    yield
+    stop_periodic()
+    # Flush buffered views while the pool is still open
+    view_buffer.stop()
+    notification_fanout.stop()
+    live_hub.stop()
+    get_listener().stop()
+    await close_async_pool()
+    close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestMetricsMiddleware)
+
+if VIEW_BUFFER_ENABLED:
+    # Registered first so it replaces the sync and async /property/view/ endpoints.
+    # It doesn't touch the database at all, the view_buffer thread writes the views in batches.
+    @app.post("/property/view/", status_code=status.HTTP_202_ACCEPTED)
+    async def record_view_buffered(data: RecordView):
+        if not view_buffer.add(data.user_id, data.property_id):
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="View buffer is full, view was dropped")
+        return {"message": f"Property id {data.property_id} view has been queued."}
+
+if DATABASE_BACKEND == "async":
+    # Registered before the sync endpoints below so the async routes win for the same paths
+    from async_routes import router as async_router
+    app.include_router(async_router)
 
 """
 ADD ENDPOINTS FOR FASTAPI HERE
@@ -89,41 +182,36 @@ but will have different HTTP-verbs.
 
 # implementing user endpoints
 @app.get("/users/")
-def users(limit: int = 20,
-    offset: int = 0):
-    conn = get_connection()
-    users = get_users(conn, limit, offset)
+def users(limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None, conn=Depends(get_db)):
+    users = get_users(conn, limit, cursor)
     if not users:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No users found")
-    return {"users": users}
+    return {"users": users, "next_cursor": next_cursor(users, limit)}
 
 @app.get("/user/{user_id}")
-def user(user_id: int):
-    conn = get_connection()
+def user(user_id: int, conn=Depends(get_db)):
     user = get_user(conn, user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return {"user": user}
 
 @app.post("/user/")
-def create_user(user: UserCreate):
-    conn = get_connection()
+def create_user(user: UserCreate, conn=Depends(get_db)):
     user = add_user(conn, user)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not added")
     return {"user": user}
 
 @app.put("/user/{user_id}")
-def update_user_by_id(user_id : int, user : UserUpdate):
-    conn = get_connection()
+def update_user_by_id(user_id : int, user : UserUpdate, conn=Depends(get_db)):
     updated = edit_user(conn, user_id, user)
     if not updated:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="user not found or nothing to update")
     return {"message": f"User with id {user_id} has been updated."}
 
 @app.delete("/user/{user_id}")
-def delete_user_by_id(user_id: int):
-    conn = get_connection()
+def delete_user_by_id(user_id: int, conn=Depends(get_db)):
     deleted = delete_user(conn, user_id)
     if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
@@ -132,39 +220,48 @@ def delete_user_by_id(user_id: int):
 
 # implementing property endpoints
 @app.get("/properties/")
-def properties(limit: int = 20,
-    offset: int = 0):
-    properties = get_properties(get_connection(), limit, offset)
+def properties(limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None, conn=Depends(get_db)):
+    properties = get_properties(conn, limit, cursor)
     if not properties:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No properties found")
-    return {"properties": properties}
+    return {"properties": properties, "next_cursor": next_cursor(properties, limit)}
+
+@app.get("/properties/batch")
+def properties_batch(ids: list[int] = Query(min_length=1, max_length=MAX_BATCH_PROPERTIES), conn=Depends(get_db)):
+    properties, missing = get_properties_by_ids(conn, ids)
+    return {"properties": properties, "missing": missing}
 
 @app.get("/property/{property_id}")
-def property(property_id: int):
-    property = get_property_by_id(get_connection(), property_id)
+def property(property_id: int, conn=Depends(get_db)):
+    property = get_property_by_id(conn, property_id)
     if not property:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Property not found")
     return {"property": property}
 
 @app.post("/property/")
-def create_property(data: PropertyFullCreate):
-    conn = get_connection()
+def create_property(data: PropertyFullCreate, conn=Depends(get_db)):
     property_data = add_property(conn, data.property, data.features, data.location, data.images, data.videos)
     if not property_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Property not added")
     return {"property": property_data}
 
+@app.post("/properties/bulk/")
+def bulk_create_properties(file: UploadFile = File(...),
+    format: str | None = Query(None, pattern="^(ndjson|csv)$"),
+    chunk_size: int = Query(1000, ge=1, le=10000), conn=Depends(get_db)):
+    report = import_properties(conn, text_lines(file.file), format or detect_format(file.filename), chunk_size)
+    return {"import": report}
+
 @app.put("/property/{property_id}")
-def update_property_by_id(property_id : int, property_type : PropertyUpdate):
-    conn = get_connection()
+def update_property_by_id(property_id : int, property_type : PropertyUpdate, conn=Depends(get_db)):
     updated = edit_property(conn, property_id, property_type)
     if not updated:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="property not found or nothing to update")
     return {"message": f"Property with id {property_id} has been updated."}
 
 @app.delete("/property/{property_id}")
-def delete_property_by_id(property_id : int):
-    conn = get_connection()
+def delete_property_by_id(property_id : int, conn=Depends(get_db)):
     deleted = delete_property(conn, property_id)
     if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
@@ -173,38 +270,33 @@ def delete_property_by_id(property_id : int):
 #implementing agencies
 
 @app.get("/agencies/")
-def agencies():
-    conn = get_connection()
+def agencies(conn=Depends(get_db)):
     agencies = get_agencies(conn)
     if not agencies:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No agencies found")
     return {"agencies" : agencies}
 
 @app.get("/agency/{agency_id}")
-def agency_by_id(agency_id : int):
-    conn = get_connection()
+def agency_by_id(agency_id : int, conn=Depends(get_db)):
     agency = get_agency(conn, agency_id)
     return {"agency" : agency}
 
 @app.post("/agency/")
-def create_agency(data : AgencyCreate):
-    conn = get_connection()
+def create_agency(data : AgencyCreate, conn=Depends(get_db)):
     agency = add_agency(conn, data)
     if not agency:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="agency is not added")
     return {"agency" : agency}
 
 @app.put("/agency/{agency_id}")
-def update_agency(agency_id : int, data : AgencyUpdate):
-    conn = get_connection()
+def update_agency(agency_id : int, data : AgencyUpdate, conn=Depends(get_db)):
     updated = edit_agency(conn, agency_id, data)
     if not updated:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agency not found or nothing to update")
     return {"message": f"Agency with id {agency_id} has been updated."}
 
 @app.delete("/agency/{agency_id}")
-def delete_agency(agency_id : int):
-    conn = get_connection()
+def delete_agency(agency_id : int, conn=Depends(get_db)):
     deleted = delete_agency_by_id(conn, agency_id)
     if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agency not found")
@@ -213,232 +305,372 @@ def delete_agency(agency_id : int):
 # implementing brokers endpoints
 
 @app.get("/brokers/")
-def brokers():
-    conn = get_connection()
+def brokers(conn=Depends(get_db)):
     brokers = get_brokers(conn)
     if not brokers:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No brokers found")
     return {"brokers" : brokers}
 
 @app.get("/broker/{broker_id}")
-def broker_by_id(broker_id : int):
-    conn = get_connection()
+def broker_by_id(broker_id : int, conn=Depends(get_db)):
     broker = get_broker(conn, broker_id)
     if not broker:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Broker not found")
     return {"broker" : broker}
 
 @app.post("/broker/")
-def create_broker(broker: BrokerCreate):
-    conn = get_connection()
+def create_broker(broker: BrokerCreate, conn=Depends(get_db)):
     broker = add_broker(conn, broker)
     if not broker:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Broker not added")
     return {"broker" : broker}
 
 @app.put("/broker/{broker_id}")
-def update_broker(broker_id : int, broker : BrokerUpdate):
-    conn = get_connection()
+def update_broker(broker_id : int, broker : BrokerUpdate, conn=Depends(get_db)):
     updated = edit_broker(conn, broker_id, broker)
     if not updated:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Broker not found or nothing to update")
     return {"message": f"Broker with id {broker_id} has been updated."}
 
 @app.delete("/broker/{broker_id}")
-def delete_broker(broker_id : int):
-    conn = get_connection()
+def delete_broker(broker_id : int, conn=Depends(get_db)):
     deleted = delete_broker_by_id(conn, broker_id)
     if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Broker not found")
     return {"message": f"Broker with id {broker_id} has been deleted."}
 
 @app.get("/property/listings/")
-def property_listings(limit: int = 20,
-    offset: int = 0):
-    conn = get_connection()
-    listings = get_listings(conn, limit, offset)
+def property_listings(limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None, conn=Depends(get_db)):
+    listings = get_listings(conn, limit, cursor)
+    if not listings:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No listings found")
+    return {"listings": listings, "next_cursor": next_cursor(listings, limit, ("listed_at", "listing_id"))}
+
+@app.get("/property/listings/search/")
+def property_listings_search(filters: Annotated[ListingSearch, Query()], conn=Depends(get_db)):
+    listings = search_listings(conn, filters)
+    if not listings:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No listings found")
+    cursor_keys = LISTING_SORTS[filters.sort]["cursor_keys"]
+    return {"listings": listings, "next_cursor": next_cursor(listings, filters.limit, cursor_keys)}
+
+@app.get("/property/listings/text_search/")
+def property_listings_text_search(q: str = Query(min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100), conn=Depends(get_db)):
+    listings = search_listings_text(conn, q, limit)
+    if not listings:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No listings found")
+    return {"listings": listings}
+
+@app.get("/property/listings/nearby/")
+def property_listings_nearby(lat: float = Query(ge=-90, le=90),
+    lon: float = Query(ge=-180, le=180),
+    radius_km: float = Query(5, gt=0, le=200),
+    limit: int = Query(20, ge=1, le=100), conn=Depends(get_db)):
+    listings = get_listings_nearby(conn, lat, lon, radius_km * 1000, limit)
+    if not listings:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No listings found")
+    return {"listings": listings}
+
+@app.get("/property/listings/within/")
+def property_listings_within(min_lat: float = Query(ge=-90, le=90),
+    min_lon: float = Query(ge=-180, le=180),
+    max_lat: float = Query(ge=-90, le=90),
+    max_lon: float = Query(ge=-180, le=180),
+    limit: int = Query(100, ge=1, le=500), conn=Depends(get_db)):
+    # min_lon > max_lon is a box crossing the antimeridian
+    if min_lat > max_lat:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="min_lat must be smaller than max_lat")
+    listings = get_listings_in_box(conn, min_lat, min_lon, max_lat, max_lon, limit)
+    if not listings:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No listings found")
+    return {"listings": listings}
+
+@app.get("/property/listings/nearest/")
+def property_listings_nearest(lat: float = Query(ge=-90, le=90),
+    lon: float = Query(ge=-180, le=180),
+    k: int = Query(10, ge=1, le=100), conn=Depends(get_db)):
+    listings = get_nearest_listings(conn, lat, lon, k)
     if not listings:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No listings found")
     return {"listings": listings}
 
 @app.post("/property/listing/")
-def list_property(listing: ListingCreate):
-    conn = get_connection()
+def list_property(listing: ListingCreate, conn=Depends(get_db)):
     result = listing_property(conn, listing)
     if not result:
         raise HTTPException(status_code=400, detail="Listing creation failed")
     return {"listing": result}
 
 @app.delete("/property/unlisting/{listing_id}")
-def unlisting_property(listing_id: int):
-    conn = get_connection()
+def unlisting_property(listing_id: int, conn=Depends(get_db)):
     deleted = unlist_property(conn, listing_id)
     if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="property not found")
     return {"message": f"Listing with id {listing_id} has been removed."}
 
 @app.put("/property/edit_listing/{listing_id}")
-def edit_listing_property(listing_id: int, update: UpdateStatus):
-    conn = get_connection()
+def edit_listing_property(listing_id: int, update: UpdateStatus, conn=Depends(get_db)):
     updated = update_listing_status(conn, listing_id, update)
     if not updated:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="property not found or nothing to update")
+    if updated["listing_status"] != updated["previous_status"]:
+        notification_fanout.submit("status_change", updated["property_id"], f" is now {updated['listing_status']}")
     return {"message": f"Listing with id {listing_id} has been updated."}
 
 @app.get("/property/bids/{property_id}")
-def property_bids(property_id: int):
-    conn = get_connection()
+def property_bids(property_id: int, conn=Depends(get_db)):
     bids = get_bids_for_property(conn, property_id)
     if not bids:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No bids found for this property")
     return {"bids": bids}
 
+@app.get("/property/bids/{property_id}/top")
+def property_top_bid(property_id: int, conn=Depends(get_db)):
+    top_bid = get_top_bid(conn, property_id)
+    if not top_bid:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No active listing for this property")
+    return {"top_bid": top_bid}
+
 @app.post("/property/bid/")
-def put_a_bid(data: CreateBid):
-    conn = get_connection()
+def put_a_bid(data: CreateBid, conn=Depends(get_db)):
+    # Rejected bids raise 404 (no active listing) or 409 (too low / ended) from bid_on_property
     bid = bid_on_property(conn, data)
-    if not bid:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Property not found")
     return {"bid": bid}
 
 @app.get("/property/offers/{property_id}")
-def property_offers(property_id: int):
-    conn = get_connection()
+def property_offers(property_id: int, conn=Depends(get_db)):
     offers = get_offers_for_property(conn, property_id)
     if not offers:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No offers found for this property")
     return {"offers": offers}
 
 @app.post("/property/offer/")
-def make_an_offer(data: CreatOffer):
-    conn = get_connection()
+def make_an_offer(data: CreatOffer, conn=Depends(get_db)):
     offer = make_offer(conn, data)
     if not offer:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Property not found")
     return {"offer": offer}
 
 @app.get("/favorites/{user_id}")
-def favorites(user_id: int):
-    conn = get_connection()
+def favorites(user_id: int, conn=Depends(get_db)):
     favorites = get_favorite_properties(conn, user_id)
     return {"favorites": favorites}
 
+@app.get("/favorites/{user_id}/feed")
+def favorites_feed(user_id: int, limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None, conn=Depends(get_db)):
+    favorites = get_favorites_feed(conn, user_id, limit, cursor)
+    return {"favorites": favorites, "next_cursor": next_cursor(favorites, limit)}
+
 @app.post("/favorite/")
-def add_favorite(data : CreateFavorite):
-    conn = get_connection()
+def add_favorite(data : CreateFavorite, conn=Depends(get_db)):
     favorite = add_favorite_property(conn, data)
     if not favorite:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Could not add favorite")
     return {"favorite" : favorite}
 
 @app.delete("/favorite/{favorite_id}")
-def delete_favorite(favorite_id : int):
-    conn = get_connection()
+def delete_favorite(favorite_id : int, conn=Depends(get_db)):
     deleted = unfavorite_property(conn, favorite_id)
     if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Favorite not found")
     return {"message": f"Favorite with id {favorite_id} has been deleted."}
 
 @app.get("/properties/price_history/{property_id}")
-def price_history(property_id: int):
-    conn = get_connection()
-    price_history = get_price_history(conn, property_id)
+def price_history(property_id: int,
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    bucket: Literal["day", "week", "month"] | None = None, conn=Depends(get_db)):
+    start, end = local_time(start), local_time(end)
+    if start and end and start >= end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'from' must be before 'to'")
+    price_history = get_price_history(conn, property_id, start, end, bucket)
     return {"price_history": price_history}
 
 @app.post("/properties/price_history/")
-def add_price_history(data: CreatePriceHistory):
-    conn = get_connection()
+def add_price_history(data: CreatePriceHistory, conn=Depends(get_db)):
     price_record = record_price_history(conn, data)
     if not price_record:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Could not record price history")
-    return {"message": f"Property id {price_record["property_id"]} price has been recorded."}
+    notification_fanout.submit("price_change", price_record["property_id"], f" is now priced at {price_record['end_price']}")
+    return {"message": f"Property id {price_record['property_id']} price has been recorded."}
 
 @app.get("/notifications/{user_id}")
-def notifications(user_id: int):
-    conn = get_connection()
-    notifications = get_notifications(conn, user_id)
-    return {"notifications": notifications}
+def notifications(user_id: int, limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None, unread_only: bool = False, conn=Depends(get_db)):
+    notifications = get_notifications(conn, user_id, limit, cursor, unread_only)
+    return {"notifications": notifications, "next_cursor": next_cursor(notifications, limit)}
+
+@app.get("/notifications/{user_id}/unread_count")
+def unread_notifications_count(user_id: int, conn=Depends(get_db)):
+    return {"unread_count": count_unread_notifications(conn, user_id)}
+
+@app.patch("/notifications/{user_id}/read")
+def read_notifications(user_id: int, data: NotificationIds, conn=Depends(get_db)):
+    # Without notification_ids every unread notification of the user is marked as read
+    updated = mark_notifications_as_read(conn, user_id, data.notification_ids)
+    return {"message": f"{updated} notifications have been marked as read.", "updated": updated}
+
+@app.delete("/notifications/{user_id}")
+def delete_notifications_by_ids(user_id: int, ids: list[int] = Query(min_length=1, max_length=1000), conn=Depends(get_db)):
+    deleted = delete_notifications(conn, user_id, ids)
+    if not deleted:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Notifications not found")
+    return {"message": f"{deleted} notifications have been deleted.", "deleted": deleted}
 
 @app.patch("/notification/read/{notification_id}")
-def read_notification(notification_id: int):
-    conn = get_connection()
+def read_notification(notification_id: int, conn=Depends(get_db)):
     updated = mark_notification_as_read(conn, notification_id)
     if not updated:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Notification not found or already read")
     return {"message": f"Notification with id {notification_id} has been marked as read."}
 
 @app.delete("/notification/{notification_id}")
-def delete_notification_by_id(notification_id: int):
-    conn = get_connection()
+def delete_notification_by_id(notification_id: int, conn=Depends(get_db)):
     deleted = delete_notification(conn, notification_id)
     if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Notification not found")
     return {"message": f"Notification with id {notification_id} has been deleted."}
 
 @app.get("/properties/views/{property_id}")
-def property_views(property_id: int):
-    conn = get_connection()
+def property_views(property_id: int, conn=Depends(get_db)):
     views = get_property_views(conn, property_id)
     return {"views": views}
 
+@app.get("/properties/views/{property_id}/stats")
+def property_view_stats(property_id: int,
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    bucket: Literal["hour", "day"] = "day", conn=Depends(get_db)):
+    end = local_time(end) or datetime.now()
+    start = local_time(start) or end - timedelta(days=30)
+    if start >= end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'from' must be before 'to'")
+    stats = get_property_view_stats(conn, property_id, start, end, bucket)
+    return {"stats": stats}
+
 @app.post("/property/view/")
-def record_view(data: RecordView):
-    conn = get_connection()
+def record_view(data: RecordView, conn=Depends(get_db)):
     view_record = record_property_view(conn, data)
     if not view_record:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Could not record property view")
     return {"message": f"Property id {view_record['property_id']} view has been recorded."}
 
 @app.get("/comparison_list/{user_id}")
-def comparison_list(user_id: int):
-    conn = get_connection()
+def comparison_list(user_id: int, conn=Depends(get_db)):
     comparison_list = get_comparison_list_by_id(conn, user_id)
     return {"comparison_list": comparison_list}
 
 @app.post("/comparison_list/")
-def add_comparison_list(data: CreateComparisonList):
-    conn = get_connection()
+def add_comparison_list(data: CreateComparisonList, conn=Depends(get_db)):
     comparison_list = create_comparison_list(conn, data)
     if not comparison_list:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Could not create comparison list")
     return {"comparison_list" : comparison_list}
 
 @app.patch("/comparison_list/{list_id}")
-def update_comparison_list(list_id : int, data: ComparisonListUpdate):
-    conn = get_connection()
+def update_comparison_list(list_id : int, data: ComparisonListUpdate, conn=Depends(get_db)):
     updated = edit_comparison_list(conn, list_id, data)
     if not updated:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comparison list not found or nothing to update")
     return {"message": f"Comparison list with id {list_id} has been updated."}
 
 @app.delete("/comparison_list/{list_id}")
-def delete_comparison_list_by_id(list_id : int):
-    conn = get_connection()
+def delete_comparison_list_by_id(list_id : int, conn=Depends(get_db)):
     deleted = delete_comparison_list(conn, list_id)
     if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comparison list not found")
     return {"message": f"Comparison list with id {list_id} has been deleted."}
 
 @app.get("/comparison_list/items/{list_id}")
-def comparison_list_items(list_id: int):
-    conn = get_connection()
+def comparison_list_items(list_id: int, conn=Depends(get_db)):
     items = get_comparison_list_items(conn, list_id)
     if not items:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No items found in this comparison list")
     return {"items": items}
 
+@app.get("/comparison_list/matrix/{list_id}")
+def comparison_list_matrix(list_id: int, conn=Depends(get_db)):
+    properties = get_comparison_matrix(conn, list_id)
+    if not properties:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No items found in this comparison list")
+    return {"properties": properties}
+
 @app.post("/comparison_list/compare/")
-def compare_list_properties(data:AddToComparisonList):
-    conn = get_connection()
+def compare_list_properties(data:AddToComparisonList, conn=Depends(get_db)):
     comparison = compare_properties(conn, data)
     if not comparison:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Could not compare properties")
     return {"comparison": comparison}
 
 @app.delete("/comparison_list/remove/{list_id}/{property_id}")
-def remove_comparison_list_item(list_id : int, property_id : int):
-    conn = get_connection()
+def remove_comparison_list_item(list_id : int, property_id : int, conn=Depends(get_db)):
     removed = remove_from_comparison(conn, list_id, property_id)
     if not removed:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comparison list item not found")
-    return {"message": f"Property with id {property_id} has been removed from comparison list {list_id}."}
\ No newline at end of file
+    return {"message": f"Property with id {property_id} has been removed from comparison list {list_id}."}
+
+@app.get("/market/stats/{city}")
+def market_stats(city: str, zip_code: str | None = None,
+    property_type: str | None = None, conn=Depends(get_db)):
+    stats = get_market_stats(conn, city, zip_code, property_type)
+    if not stats:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No market statistics found")
+    return {"market_stats": stats}
+
+@app.get("/export/listings/")
+def export_listings(format: Literal["ndjson", "csv"] = "ndjson"):
+    return export_response("listings", format)
+
+@app.get("/export/bids/")
+def export_bids(property_id: int | None = None, format: Literal["ndjson", "csv"] = "ndjson"):
+    return export_response("bids", format, property_id)
+
+@app.get("/export/offers/")
+def export_offers(property_id: int | None = None, format: Literal["ndjson", "csv"] = "ndjson"):
+    return export_response("offers", format, property_id)
+
+@app.get("/export/views/")
+def export_views(property_id: int | None = None, format: Literal["ndjson", "csv"] = "ndjson"):
+    return export_response("views", format, property_id)
+
+# Server-Sent Events, new bids and offers on a property / new notifications for a user.
+# async so the streams stay on the event loop instead of holding a threadpool thread each.
+@app.get("/live/property/{property_id}")
+async def live_property(property_id: int):
+    return event_stream_response("property", property_id)
+
+@app.get("/live/user/{user_id}")
+async def live_user(user_id: int):
+    return event_stream_response("user", user_id)
+
+@app.get("/pool/stats")
+def pool_stats():
+    stats = {"pool": get_pool().stats(), "prepared_statements": prepared_stats()}
+    async_pool = get_async_pool()
+    if async_pool is not None:
+        stats["async_pool"] = async_pool.get_stats()
+    return stats
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    return {"cache": cache_stats()}
+
+@app.get("/views/buffer/stats")
+def view_buffer_stats():
+    return {"view_buffer": view_buffer.stats()}
+
+@app.get("/notifications/fanout/stats")
+def notification_fanout_stats():
+    return {"notification_fanout": notification_fanout.stats()}
+
+@app.get("/live/stats")
+async def live_stats():
+    return {"live": live_hub.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus text format
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,123 @@
+from psycopg.rows import dict_row
+
+from cache import listings_cache, property_cache
+from metrics import instrument_module
+from pagination import decode_cursor
+
+from db import (
+    BIDS_FOR_PROPERTY_SQL,
+    INSERT_BID_SQL,
+    INSERT_OFFER_SQL,
+    INSERT_PROPERTY_VIEW_SQL,
+    LISTINGS_SQL,
+    OFFERS_FOR_PROPERTY_SQL,
+    PROPERTIES_SQL,
+    PROPERTY_BY_ID_SQL,
+    TOP_BID_SQL,
+    USER_SQL,
+    USERS_SQL,
+    bid_rejection,
+)
+
+"""
+Async versions of the hot query functions in db.py, used when DATABASE_BACKEND=async.
+
+- They run on psycopg 3 AsyncConnections handed out by db_setup.get_async_db
+- The SQL is imported from db.py, so both backends always run the same statements
+- Connections are in autocommit mode, so writes wrap themselves in conn.transaction()
+- Return values have the same shape as their sync counterparts (dicts / lists of dicts)
+"""
+
+
+# USERS
+async def get_users(conn, limit, page_cursor=None):
+    created_at, user_id = decode_cursor(page_cursor)
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(USERS_SQL, (created_at, user_id, limit))
+        return await cursor.fetchall()
+
+async def get_user(conn, user_id):
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(USER_SQL, (user_id,))
+        return await cursor.fetchone()
+
+# PROPERTIES
+async def get_properties(conn, limit, page_cursor=None):
+    created_at, property_id = decode_cursor(page_cursor)
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(PROPERTIES_SQL, (created_at, property_id, limit))
+        return await cursor.fetchall()
+
+async def get_property_by_id(conn, property_id):
+    # Same cache as db.get_property_by_id, so sync writes invalidate it too
+    hit, property = property_cache.lookup(property_id)
+    if hit:
+        return property
+    generation = property_cache.generation
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(PROPERTY_BY_ID_SQL, (property_id,))
+        property = await cursor.fetchone()
+    property_cache.store(property_id, property, generation)
+    return property
+
+# LISTINGS
+async def get_listings(conn, limit, page_cursor=None):
+    hit, listings = listings_cache.lookup((limit, page_cursor))
+    if hit:
+        return listings
+    generation = listings_cache.generation
+    listed_at, listing_id = decode_cursor(page_cursor)
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(LISTINGS_SQL, (listed_at, listing_id, limit))
+        listings = await cursor.fetchall()
+    listings_cache.store((limit, page_cursor), listings, generation)
+    return listings
+
+# BIDS AND OFFERS
+async def get_bids_for_property(conn, property_id):
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(BIDS_FOR_PROPERTY_SQL, (property_id,))
+        return await cursor.fetchall()
+
+async def get_top_bid(conn, property_id):
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(TOP_BID_SQL, (property_id,))
+        return await cursor.fetchone()
+
+async def bid_on_property(conn, data):
+    async with conn.transaction():
+        async with conn.cursor(row_factory=dict_row) as cursor:
+            await cursor.execute(
+                INSERT_BID_SQL,
+                {"user_id": data.user_id, "property_id": data.property_id, "bid_amount": data.bid_amount}
+            )
+            bid = await cursor.fetchone()
+            if not bid:
+                await cursor.execute(TOP_BID_SQL, (data.property_id,))
+                raise bid_rejection(await cursor.fetchone())
+            return bid
+
+async def get_offers_for_property(conn, property_id):
+    async with conn.cursor(row_factory=dict_row) as cursor:
+        await cursor.execute(OFFERS_FOR_PROPERTY_SQL, (property_id,))
+        return await cursor.fetchall()
+
+async def make_offer(conn, data):
+    async with conn.transaction():
+        async with conn.cursor(row_factory=dict_row) as cursor:
+            await cursor.execute(
+                INSERT_OFFER_SQL,
+                (data.user_id, data.property_id, data.offer_amount, data.message, data.status)
+            )
+            return await cursor.fetchone()
+
+# VIEWS
+async def record_property_view(conn, data):
+    async with conn.transaction():
+        async with conn.cursor(row_factory=dict_row) as cursor:
+            await cursor.execute(INSERT_PROPERTY_VIEW_SQL, (data.user_id, data.property_id))
+            return await cursor.fetchone()
+
+
+# Call counts, latency, rows and errors of every query function above, see metrics.py
+instrument_module(globals(), __name__)
@@ -0,0 +1,96 @@
+import async_db
+from db_setup import get_async_db
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from pagination import next_cursor
+from schemas import CreateBid, CreatOffer, RecordView
+
+"""
+async def versions of the busiest endpoints in app.py.
+
+app.py only includes this router when DATABASE_BACKEND=async. It is included before
+the sync endpoints, so these routes take precedence for the same paths and the
+remaining endpoints keep running on the sync pool. Responses and error handling
+mirror the sync endpoints so both backends can be compared under the same load.
+"""
+
+router = APIRouter()
+
+
+@router.get("/users/")
+async def users(limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None, conn=Depends(get_async_db)):
+    users = await async_db.get_users(conn, limit, cursor)
+    if not users:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No users found")
+    return {"users": users, "next_cursor": next_cursor(users, limit)}
+
+@router.get("/user/{user_id}")
+async def user(user_id: int, conn=Depends(get_async_db)):
+    user = await async_db.get_user(conn, user_id)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return {"user": user}
+
+@router.get("/properties/")
+async def properties(limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None, conn=Depends(get_async_db)):
+    properties = await async_db.get_properties(conn, limit, cursor)
+    if not properties:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No properties found")
+    return {"properties": properties, "next_cursor": next_cursor(properties, limit)}
+
+@router.get("/property/listings/")
+async def property_listings(limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None, conn=Depends(get_async_db)):
+    listings = await async_db.get_listings(conn, limit, cursor)
+    if not listings:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No listings found")
+    return {"listings": listings, "next_cursor": next_cursor(listings, limit, ("listed_at", "listing_id"))}
+
+@router.get("/property/{property_id}")
+async def property(property_id: int, conn=Depends(get_async_db)):
+    property = await async_db.get_property_by_id(conn, property_id)
+    if not property:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Property not found")
+    return {"property": property}
+
+@router.get("/property/bids/{property_id}")
+async def property_bids(property_id: int, conn=Depends(get_async_db)):
+    bids = await async_db.get_bids_for_property(conn, property_id)
+    if not bids:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No bids found for this property")
+    return {"bids": bids}
+
+@router.get("/property/bids/{property_id}/top")
+async def property_top_bid(property_id: int, conn=Depends(get_async_db)):
+    top_bid = await async_db.get_top_bid(conn, property_id)
+    if not top_bid:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No active listing for this property")
+    return {"top_bid": top_bid}
+
+@router.post("/property/bid/")
+async def put_a_bid(data: CreateBid, conn=Depends(get_async_db)):
+    # Rejected bids raise 404 / 409 from async_db.bid_on_property
+    bid = await async_db.bid_on_property(conn, data)
+    return {"bid": bid}
+
+@router.get("/property/offers/{property_id}")
+async def property_offers(property_id: int, conn=Depends(get_async_db)):
+    offers = await async_db.get_offers_for_property(conn, property_id)
+    if not offers:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No offers found for this property")
+    return {"offers": offers}
+
+@router.post("/property/offer/")
+async def make_an_offer(data: CreatOffer, conn=Depends(get_async_db)):
+    offer = await async_db.make_offer(conn, data)
+    if not offer:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Property not found")
+    return {"offer": offer}
+
+@router.post("/property/view/")
+async def record_view(data: RecordView, conn=Depends(get_async_db)):
+    view_record = await async_db.record_property_view(conn, data)
+    if not view_record:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Could not record property view")
+    return {"message": f"Property id {view_record['property_id']} view has been recorded."}
@@ -0,0 +1,145 @@
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+
+from db import bid_on_property, get_top_bid
+from db_setup import get_connection
+from schemas import CreateBid
+
+"""
+Concurrent bidders hammering one property, to check db.bid_on_property under contention.
+
+    python benchmarks/bid_load_test.py --property-id 1 --bidders 50 --bids 40
+
+Every bidder has its own connection and keeps bidding a random amount just above the
+top bid it last saw, so most bids race each other. Afterwards it checks that:
+
+- the listing's top bid is the highest accepted bid, by the last bidder to place it
+- accepted bids are strictly increasing in insert order, by at least min_bid_increment
+- bid_count matches the number of accepted bids
+
+and prints accepted / rejected counts and throughput. Bids are really inserted, so run
+it against a seeded development database. The users must exist (ids 1..--users).
+"""
+
+
+class Bidder(threading.Thread):
+    def __init__(self, property_id, bids, users, start_barrier):
+        super().__init__(daemon=True)
+        self.property_id = property_id
+        self.bids = bids
+        self.users = users
+        self.start_barrier = start_barrier
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = 0
+        self.latencies = []
+
+    def run(self):
+        conn = get_connection()
+        try:
+            top_bid = get_top_bid(conn, self.property_id)
+            self.start_barrier.wait()
+            for _ in range(self.bids):
+                amount = top_bid["min_next_bid"] + random.randint(0, 3) * top_bid["min_bid_increment"]
+                bid = CreateBid(user_id=random.randint(1, self.users), property_id=self.property_id, bid_amount=amount)
+                started = time.perf_counter()
+                try:
+                    bid_on_property(conn, bid)
+                    self.accepted += 1
+                except HTTPException as e:
+                    if e.status_code != 409:
+                        raise
+                    self.rejected += 1
+                except Exception:
+                    self.errors += 1
+                self.latencies.append(time.perf_counter() - started)
+                top_bid = get_top_bid(conn, self.property_id)
+        finally:
+            conn.close()
+
+
+def verify(conn, property_id, started_after_id, accepted):
+    top_bid = get_top_bid(conn, property_id)
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """SELECT id, user_id, bid_amount FROM bids
+                WHERE property_id = %s AND id > %s
+                ORDER BY id;
+                """,
+                (property_id, started_after_id)
+            )
+            bids = cursor.fetchall()
+    problems = []
+    if len(bids) != accepted:
+        problems.append(f"{len(bids)} bid rows but {accepted} bids were accepted")
+    for previous, current in zip(bids, bids[1:]):
+        if current[2] < previous[2] + top_bid["min_bid_increment"]:
+            problems.append(f"bid {current[0]} ({current[2]}) doesn't beat bid {previous[0]} ({previous[2]})")
+    if bids and (top_bid["top_bid_amount"], top_bid["top_bidder_id"]) != (bids[-1][2], bids[-1][1]):
+        problems.append(f"top bid {top_bid['top_bid_amount']} by {top_bid['top_bidder_id']} isn't the last accepted bid {bids[-1]}")
+    return top_bid, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent bidding load test")
+    parser.add_argument("--property-id", type=int, default=1)
+    parser.add_argument("--bidders", type=int, default=20)
+    parser.add_argument("--bids", type=int, default=50, help="bids per bidder")
+    parser.add_argument("--users", type=int, default=5, help="bid as random user ids 1..USERS")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    top_bid = get_top_bid(conn, args.property_id)
+    if top_bid is None:
+        sys.exit(f"Property {args.property_id} has no active listing")
+    start_count = top_bid["bid_count"]
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM bids;")
+            started_after_id = cursor.fetchone()[0]
+
+    start_barrier = threading.Barrier(args.bidders + 1)
+    bidders = [Bidder(args.property_id, args.bids, args.users, start_barrier) for _ in range(args.bidders)]
+    for bidder in bidders:
+        bidder.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for bidder in bidders:
+        bidder.join()
+    elapsed = time.perf_counter() - started
+
+    accepted = sum(b.accepted for b in bidders)
+    rejected = sum(b.rejected for b in bidders)
+    errors = sum(b.errors for b in bidders)
+    latencies = sorted(latency for b in bidders for latency in b.latencies)
+    top_bid, problems = verify(conn, args.property_id, started_after_id, accepted)
+    if top_bid["bid_count"] - start_count != accepted:
+        problems.append(f"bid_count went up by {top_bid['bid_count'] - start_count}, {accepted} bids were accepted")
+    conn.close()
+
+    total = accepted + rejected + errors
+    print(f"{args.bidders} bidders, {total} bids in {elapsed:.2f}s ({total / elapsed:.0f} bids/s)")
+    print(f"accepted {accepted}, rejected {rejected}, errors {errors}")
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"latency p50 {p50 * 1000:.1f}ms, p99 {p99 * 1000:.1f}ms")
+    print(f"top bid {top_bid['top_bid_amount']} by user {top_bid['top_bidder_id']}")
+    if problems or errors:
+        for problem in problems:
+            print("FAIL:", problem)
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
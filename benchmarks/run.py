@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import httpx
+
+"""
+Drives a running API with a mixed read/write workload at fixed concurrency.
+
+    uvicorn app:app --workers 4 --log-level warning      # in another terminal
+    python benchmarks/run.py --concurrency 32 --duration 60
+    python benchmarks/run.py --baseline benchmarks/results/<earlier run>.json
+
+- Ids are picked from the data set benchmarks/seed.py wrote (results/dataset.json)
+- --concurrency workers each send one request at a time, for --duration seconds after
+  a --warmup that isn't measured. Every request picks an endpoint from WORKLOAD by weight
+- Per endpoint it reports throughput, error count and p50 / p95 / p99 latency, and saves
+  everything as JSON in benchmarks/results/ together with the git commit, so runs on
+  different commits can be compared with --baseline
+- Expected "no" answers (a 409 for an outbid bid, a 404 for an unlisted property or for a
+  search that matched nothing) count as successful requests, only other 4xx / 5xx and
+  connection errors count as errors
+"""
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DATASET_FILE = os.path.join(RESULTS_DIR, "dataset.json")
+
+SEARCH_WORDS = ["balcony", "sea view", "garden", "fireplace", "garage", "renovated", "spacious"]
+
+
+def _property(dataset):
+    return random.randint(1, dataset["properties"])
+
+
+def _user(dataset):
+    return random.randint(1, dataset["users"])
+
+
+def _city(dataset):
+    return random.randrange(len(dataset["cities"]))
+
+
+# name, weight, expected statuses, request(dataset) -> (method, path, params, json body)
+WORKLOAD = [
+    ("GET /property/{id}", 20, (200, 404),
+     lambda d: ("GET", f"/property/{_property(d)}", None, None)),
+    ("GET /properties/batch", 4, (200,),
+     lambda d: ("GET", "/properties/batch", {"ids": [_property(d) for _ in range(50)]}, None)),
+    ("GET /properties/", 5, (200, 404),
+     lambda d: ("GET", "/properties/", {"limit": 20}, None)),
+    ("GET /property/listings/", 10, (200, 404),
+     lambda d: ("GET", "/property/listings/", {"limit": 20}, None)),
+    ("GET /property/listings/search/", 12, (200, 404),
+     lambda d: ("GET", "/property/listings/search/", {
+         "city": d["cities"][_city(d)],
+         "min_rooms": random.randint(1, 4),
+         "max_price": random.choice([2_000_000, 4_000_000, 8_000_000]),
+         "sort": random.choice(["newest", "price_asc"]),
+     }, None)),
+    ("GET /property/listings/text_search/", 5, (200, 404),
+     lambda d: ("GET", "/property/listings/text_search/", {"q": random.choice(SEARCH_WORDS)}, None)),
+    ("GET /property/listings/nearby/", 8, (200, 404),
+     lambda d: ("GET", "/property/listings/nearby/", dict(zip(
+         ("lat", "lon"), d["city_coordinates"][_city(d)]), radius_km=random.choice([1, 3, 5])), None)),
+    ("GET /property/bids/{id}/top", 8, (200, 404),
+     lambda d: ("GET", f"/property/bids/{_property(d)}/top", None, None)),
+    ("GET /notifications/{user_id}", 8, (200,),
+     lambda d: ("GET", f"/notifications/{_user(d)}", {"limit": 20}, None)),
+    ("GET /notifications/{user_id}/unread_count", 8, (200,),
+     lambda d: ("GET", f"/notifications/{_user(d)}/unread_count", None, None)),
+    ("POST /property/view/", 10, (200, 202),
+     lambda d: ("POST", "/property/view/", None, {"user_id": _user(d), "property_id": _property(d)})),
+    ("POST /property/bid/", 6, (200, 404, 409),
+     lambda d: ("POST", "/property/bid/", None, {
+         "user_id": _user(d), "property_id": _property(d), "bid_amount": random.randint(1, 15_000) * 1000,
+     })),
+]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {name: [] for name, *_ in WORKLOAD}
+        self.errors = {name: 0 for name, *_ in WORKLOAD}
+        self.statuses = {name: {} for name, *_ in WORKLOAD}
+
+    def record(self, name, status, latency, ok):
+        self.latencies[name].append(latency)
+        self.statuses[name][str(status)] = self.statuses[name].get(str(status), 0) + 1
+        if not ok:
+            self.errors[name] += 1
+
+
+async def worker(client, dataset, deadline, recorder, names, weights, requests_by_name):
+    while time.perf_counter() < deadline:
+        name = random.choices(names, weights)[0]
+        expected, build = requests_by_name[name]
+        method, path, params, body = build(dataset)
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, params=params, json=body)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        latency = time.perf_counter() - started
+        if recorder is not None:
+            recorder.record(name, status, latency, status in expected)
+
+
+async def run_phase(url, dataset, concurrency, duration, recorder):
+    names = [name for name, *_ in WORKLOAD]
+    weights = [weight for _name, weight, *_ in WORKLOAD]
+    requests_by_name = {name: (expected, build) for name, _weight, expected, build in WORKLOAD}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            worker(client, dataset, deadline, recorder, names, weights, requests_by_name)
+            for _ in range(concurrency)
+        ))
+
+
+def summarize(recorder, duration):
+    endpoints = {}
+    for name, latencies in recorder.latencies.items():
+        latencies.sort()
+        endpoints[name] = {
+            "requests": len(latencies),
+            "errors": recorder.errors[name],
+            "throughput": round(len(latencies) / duration, 1),
+            "p50_ms": _ms(percentile(latencies, 50)),
+            "p95_ms": _ms(percentile(latencies, 95)),
+            "p99_ms": _ms(percentile(latencies, 99)),
+            "mean_ms": _ms(sum(latencies) / len(latencies)) if latencies else None,
+            "statuses": recorder.statuses[name],
+        }
+    everything = sorted(latency for latencies in recorder.latencies.values() for latency in latencies)
+    total = {
+        "requests": len(everything),
+        "errors": sum(recorder.errors.values()),
+        "throughput": round(len(everything) / duration, 1),
+        "p50_ms": _ms(percentile(everything, 50)),
+        "p95_ms": _ms(percentile(everything, 95)),
+        "p99_ms": _ms(percentile(everything, 99)),
+    }
+    return endpoints, total
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(endpoints, total, baseline=None):
+    header = f"{'endpoint':<44} {'req/s':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    print(header)
+    print("-" * len(header))
+    rows = list(endpoints.items()) + [("TOTAL", total)]
+    for name, stats in rows:
+        line = f"{name:<44} {stats['throughput']:>8} {stats['errors']:>7} " + " ".join(
+            f"{_fmt(stats[key]):>8}" for key in ("p50_ms", "p95_ms", "p99_ms"))
+        print(line)
+        if baseline is not None:
+            before = baseline["total"] if name == "TOTAL" else baseline["endpoints"].get(name)
+            if before:
+                print(f"{'  vs baseline':<44} {_delta(before['throughput'], stats['throughput']):>8} {'':>7} " + " ".join(
+                    f"{_delta(before[key], stats[key]):>8}" for key in ("p50_ms", "p95_ms", "p99_ms")))
+
+
+def _fmt(value):
+    return "-" if value is None else value
+
+
+def _delta(before, after):
+    if not before or after is None:
+        return "-"
+    return f"{(after - before) / before * 100:+.0f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed workload benchmark against a running API")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=60, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=10, help="unmeasured seconds before the run")
+    parser.add_argument("--dataset", default=DATASET_FILE)
+    parser.add_argument("--output", help="result file, default results/<timestamp>_<commit>.json")
+    parser.add_argument("--baseline", help="earlier result file to compare against")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the request mix")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.dataset):
+        sys.exit(f"{args.dataset} not found, seed the database with benchmarks/seed.py first")
+    with open(args.dataset) as f:
+        dataset = json.load(f)
+    random.seed(args.seed)
+
+    if args.warmup > 0:
+        print(f"warming up for {args.warmup}s")
+        asyncio.run(run_phase(args.url, dataset, args.concurrency, args.warmup, None))
+    print(f"running {args.concurrency} workers for {args.duration}s against {args.url}")
+    recorder = Recorder()
+    asyncio.run(run_phase(args.url, dataset, args.concurrency, args.duration, recorder))
+    endpoints, total = summarize(recorder, args.duration)
+
+    commit = _git_commit()
+    result = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "seed": args.seed,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "dataset": {key: dataset[key] for key in ("properties", "users", "listings") if key in dataset},
+        "total": total,
+        "endpoints": endpoints,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"baseline: commit {baseline.get('commit')} at {baseline.get('started_at')}")
+    print_table(endpoints, total, baseline)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now():%Y%m%d_%H%M%S}_{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"saved {output}")
+
+
+if __name__ == "__main__":
+    main()
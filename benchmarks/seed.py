@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_setup import get_connection
+from migrations import migrate
+
+"""
+Seeds a local Postgres with a realistic, reproducible data set for benchmarks/run.py.
+
+    python benchmarks/seed.py --reset --properties 1000000
+
+- --reset drops and recreates the public schema (all data!) and runs the migrations,
+  without it the tables must be empty
+- Everything is generated in Postgres with INSERT ... SELECT generate_series, in chunks
+  of --chunk-size properties with one transaction per chunk, so 1M properties take
+  minutes, not hours. setseed() makes the same arguments produce the same data
+- The live NOTIFY triggers on bids and notifications are disabled while seeding
+- Writes benchmarks/results/dataset.json with the sizes, run.py picks its ids from it
+"""
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DATASET_FILE = os.path.join(RESULTS_DIR, "dataset.json")
+
+CITIES = [
+    ("Stockholm", 59.3293, 18.0686), ("Göteborg", 57.7089, 11.9746), ("Malmö", 55.6050, 13.0038),
+    ("Uppsala", 59.8586, 17.6389), ("Västerås", 59.6099, 16.5448), ("Örebro", 59.2753, 15.2134),
+    ("Linköping", 58.4108, 15.6214), ("Helsingborg", 56.0465, 12.6945), ("Jönköping", 57.7826, 14.1618),
+    ("Norrköping", 58.5877, 16.1924), ("Lund", 55.7047, 13.1910), ("Umeå", 63.8258, 20.2630),
+]
+
+LIVE_TRIGGERS = [("bids", "bids_live_event"), ("offers", "offers_live_event"), ("notifications", "notifications_live_event")]
+
+
+def _cities_sql():
+    values = ", ".join(f"({i}, '{name}', {lat}, {lon})" for i, (name, lat, lon) in enumerate(CITIES))
+    return f"(VALUES {values}) AS c(n, name, lat, lon)"
+
+
+def seed_people(cursor, users, brokers, agencies):
+    cursor.execute(
+        """INSERT INTO users (id, full_name, email, phone_number, password, role, created_at)
+        SELECT g, 'Bench User ' || g, 'bench' || g || '@example.com', '070-' || g, 'x',
+        CASE WHEN g <= %(brokers)s THEN 'broker' WHEN g <= %(brokers)s + %(agencies)s THEN 'agency' ELSE 'user' END,
+        now() - random() * interval '730 days'
+        FROM generate_series(1, %(users)s) g;
+        """,
+        {"users": users, "brokers": brokers, "agencies": agencies}
+    )
+    cursor.execute(
+        """INSERT INTO agencies (id, user_id, organization_number, history)
+        SELECT g, %(brokers)s + g, 'ORG-' || g, 'Benchmark agency ' || g
+        FROM generate_series(1, %(agencies)s) g;
+        """,
+        {"brokers": brokers, "agencies": agencies}
+    )
+    cursor.execute(
+        """INSERT INTO brokers (user_id, agency_id, license_number, years_of_experience, bio)
+        SELECT g, 1 + g %% %(agencies)s, 'LIC-' || g, (random() * 30)::int, 'Benchmark broker ' || g
+        FROM generate_series(1, %(brokers)s) g;
+        """,
+        {"brokers": brokers, "agencies": agencies}
+    )
+
+
+def seed_properties(cursor, first, last, args):
+    params = {"first": first, "last": last, **vars(args)}
+    cursor.execute(
+        """INSERT INTO properties (id, property_type, created_at)
+        SELECT g, (ARRAY['Apartment', 'Villa', 'Townhouse', 'Cottage'])[1 + (random() * 3)::int],
+        now() - random() * interval '730 days'
+        FROM generate_series(%(first)s, %(last)s) g;
+        """,
+        params
+    )
+    cursor.execute(
+        """INSERT INTO features (property_id, rooms, bathrooms, size_sqm, floor, year_built, year_renovated,
+        monthly_rent, total_floors, has_garden, garden_size_sqm, has_elevator, has_garage, has_parking,
+        has_pool, has_balcony, energy_class)
+        SELECT g, r.rooms, 1 + r.rooms / 3, 20 + r.rooms * 18 + (random() * 30)::int, (random() * 8)::int,
+        1900 + (random() * 124)::int, NULL, 2000 + (random() * 8000)::int, 1 + (random() * 10)::int,
+        random() < 0.3, NULL, random() < 0.5, random() < 0.2, random() < 0.5,
+        random() < 0.05, random() < 0.6, (ARRAY['A', 'B', 'C', 'D', 'E', 'F', 'G'])[1 + (random() * 6)::int]
+        FROM generate_series(%(first)s, %(last)s) g,
+        LATERAL (SELECT 1 + (random() * 5)::int + g * 0 AS rooms) r;
+        """,
+        params
+    )
+    cursor.execute(
+        f"""INSERT INTO location (property_id, address, city, zip_code, county, country, latitude, longitude, map_url)
+        SELECT g, 'Benchgatan ' || g, c.name, lpad(((random() * 99999)::int)::text, 5, '0'), c.name, 'Sweden',
+        c.lat + (random() - 0.5) * 0.2, c.lon + (random() - 0.5) * 0.4, NULL
+        FROM generate_series(%(first)s, %(last)s) g
+        JOIN {_cities_sql()} ON c.n = g %% {len(CITIES)};
+        """,
+        params
+    )
+    cursor.execute(
+        """INSERT INTO property_images (property_id, image_url, image_order)
+        SELECT g, 'https://img.example.com/' || g || '/' || k || '.jpg', k
+        FROM generate_series(%(first)s, %(last)s) g, generate_series(1, %(images)s) k;
+        """,
+        params
+    )
+    cursor.execute(
+        """INSERT INTO property_videos (property_id, video_url, video_order)
+        SELECT g, 'https://video.example.com/' || g || '.mp4', 1
+        FROM generate_series(%(first)s, %(last)s) g
+        WHERE g %% 4 = 0;
+        """,
+        params
+    )
+    # Every listing_ratio-th property is listed, by a broker (an owner can only have one active listing)
+    cursor.execute(
+        """INSERT INTO listing_property (property_id, broker_id, title, description, start_date, end_date,
+        listing_status, listing_type, start_price, min_bid_increment, created_at)
+        SELECT g, 1 + g %% %(brokers)s,
+        (ARRAY['Bright', 'Spacious', 'Renovated', 'Charming', 'Modern'])[1 + g %% 5] || ' home with '
+            || (ARRAY['balcony', 'sea view', 'garden', 'fireplace', 'garage'])[1 + (g / 5) %% 5],
+        'A well kept home in a calm area, close to schools, shops and public transport.',
+        now() - interval '30 days', now() + (30 + random() * 60) * interval '1 day',
+        'Active', CASE WHEN g %% 3 = 0 THEN 'Rent' ELSE 'Sale' END,
+        ((500 + random() * 9500)::int) * 1000, 5000, now() - random() * interval '365 days'
+        FROM generate_series(%(first)s, %(last)s) g
+        WHERE random() < %(listing_ratio)s;
+        """,
+        params
+    )
+    cursor.execute(
+        """INSERT INTO bids (property_id, user_id, bid_amount, created_at)
+        SELECT l.property_id, 1 + (random() * (%(users)s - 1))::int, l.start_price + k * l.min_bid_increment,
+        l.created_at + k * interval '1 hour'
+        FROM listing_property l, generate_series(0, %(bids)s - 1) k
+        WHERE l.property_id BETWEEN %(first)s AND %(last)s AND l.listing_type = 'Sale';
+        """,
+        params
+    )
+    cursor.execute(
+        """INSERT INTO price_history (property_id, end_price, record_at)
+        SELECT g, ((500 + random() * 9500)::int) * 1000, now() - random() * interval '730 days'
+        FROM generate_series(%(first)s, %(last)s) g, generate_series(1, %(price_history)s) k;
+        """,
+        params
+    )
+    cursor.execute(
+        """INSERT INTO property_views (property_id, user_id, created_at)
+        SELECT g, 1 + (random() * (%(users)s - 1))::int, now() - random() * interval '90 days'
+        FROM generate_series(%(first)s, %(last)s) g, generate_series(1, %(views)s) k;
+        """,
+        params
+    )
+
+
+def seed_user_activity(cursor, args):
+    params = vars(args)
+    cursor.execute(
+        """INSERT INTO favorites (property_id, user_id, is_contacted, notify_price_change,
+        notify_status_change, notify_new_message, created_at)
+        SELECT 1 + (random() * (%(properties)s - 1))::int, u, false, random() < 0.7, random() < 0.5, false,
+        now() - random() * interval '365 days'
+        FROM generate_series(1, %(users)s) u, generate_series(1, %(favorites)s) k;
+        """,
+        params
+    )
+    cursor.execute(
+        """INSERT INTO notifications (user_id, property_id, favorite_id, title, message, type, is_read, created_at)
+        SELECT f.user_id, f.property_id, f.id, 'Price changed', 'Benchgatan ' || f.property_id || ' has a new price',
+        'price_change', random() < 0.6, now() - random() * interval '90 days'
+        FROM favorites f
+        WHERE f.notify_price_change;
+        """
+    )
+    # Same as the baseline migration's backfill of the top bid columns
+    cursor.execute(
+        """UPDATE listing_property l
+        SET top_bid_amount = b.bid_amount, top_bidder_id = b.user_id,
+            top_bid_at = b.created_at, bid_count = b.bid_count
+        FROM (
+            SELECT DISTINCT ON (property_id)
+            property_id, bid_amount, user_id, created_at,
+            COUNT(*) OVER (PARTITION BY property_id) AS bid_count
+            FROM bids
+            ORDER BY property_id, bid_amount DESC, id
+        ) b
+        WHERE l.property_id = b.property_id AND l.listing_status = 'Active';
+        """
+    )
+
+
+def reset_sequences(cursor):
+    for table in ("users", "agencies", "properties", "listing_property", "bids", "price_history",
+                  "property_views", "property_images", "property_videos", "favorites", "notifications"):
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false);"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a benchmark data set")
+    parser.add_argument("--reset", action="store_true", help="drop and recreate the public schema first")
+    parser.add_argument("--properties", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--brokers", type=int, default=500)
+    parser.add_argument("--agencies", type=int, default=50)
+    parser.add_argument("--listing-ratio", type=float, default=0.3, help="share of properties with an active listing")
+    parser.add_argument("--images", type=int, default=5, help="images per property")
+    parser.add_argument("--bids", type=int, default=4, help="bids per sale listing")
+    parser.add_argument("--views", type=int, default=20, help="views per property")
+    parser.add_argument("--price-history", type=int, default=3, help="price records per property")
+    parser.add_argument("--favorites", type=int, default=5, help="favorites per user")
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--seed", type=float, default=0.42, help="setseed() value, between -1 and 1")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    conn = get_connection()
+    try:
+        if args.reset:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+            conn.autocommit = False
+            migrate()
+        with conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT EXISTS (SELECT 1 FROM properties) OR EXISTS (SELECT 1 FROM users);")
+                if cursor.fetchone()[0]:
+                    sys.exit("The database isn't empty, use --reset to start over")
+                cursor.execute("SELECT setseed(%s);", (args.seed,))
+                for table, trigger in LIVE_TRIGGERS:
+                    cursor.execute(f"ALTER TABLE {table} DISABLE TRIGGER {trigger};")
+                seed_people(cursor, args.users, args.brokers, args.agencies)
+        try:
+            for first in range(1, args.properties + 1, args.chunk_size):
+                last = min(first + args.chunk_size - 1, args.properties)
+                with conn:
+                    with conn.cursor() as cursor:
+                        seed_properties(cursor, first, last, args)
+                print(f"properties {last}/{args.properties} ({time.perf_counter() - started:.0f}s)")
+            with conn:
+                with conn.cursor() as cursor:
+                    seed_user_activity(cursor, args)
+                    reset_sequences(cursor)
+        finally:
+            with conn:
+                with conn.cursor() as cursor:
+                    for table, trigger in LIVE_TRIGGERS:
+                        cursor.execute(f"ALTER TABLE {table} ENABLE TRIGGER {trigger};")
+
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            print("analyzing and refreshing rollups")
+            cursor.execute("ANALYZE;")
+            cursor.execute("REFRESH MATERIALIZED VIEW property_view_stats_hourly;")
+            cursor.execute("REFRESH MATERIALIZED VIEW property_view_stats_daily;")
+            cursor.execute("SELECT COUNT(*) FROM listing_property;")
+            listings = cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+    dataset = {
+        **vars(args),
+        "listings": listings,
+        "cities": [name for name, _lat, _lon in CITIES],
+        "city_coordinates": [[lat, lon] for _name, lat, lon in CITIES],
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(DATASET_FILE, "w") as f:
+        json.dump(dataset, f, indent=2)
+    print(f"Seeded {args.properties} properties and {listings} listings in {dataset['seconds']}s, wrote {DATASET_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import csv
+import io
+import json
+
+from pydantic import ValidationError
+
+from db import add_properties_bulk
+from db_setup import get_connection
+from schemas import PropertyFullCreate
+
+"""
+Bulk property import for agency feeds, used by POST /properties/bulk/ and as a script:
+
+    python bulk_import.py feed.ndjson
+    python bulk_import.py feed.csv --chunk-size 5000
+
+- The file is read as a stream, one record at a time, so its size doesn't matter
+- NDJSON: one PropertyFullCreate shaped JSON object per line
+- CSV: dotted column names for the nested fields (property.property_type, features.rooms,
+  location.city, ...), and the images / videos columns hold a JSON array
+- Records are validated and inserted in chunks, one transaction per chunk
+  (db.add_properties_bulk). If a chunk fails in the database, its records are retried
+  one by one so only the broken ones are rejected
+- The returned report lists every rejected record with its line number and the reason
+"""
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+
+def _ndjson_records(lines):
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, e
+
+
+def _csv_records(lines):
+    reader = csv.DictReader(lines)
+    # Line 1 is the header
+    for line_number, row in enumerate(reader, start=2):
+        record = {}
+        try:
+            for column, value in row.items():
+                if value is None or value == "":
+                    continue
+                if column in ("images", "videos"):
+                    record[column] = json.loads(value)
+                    continue
+                target = record
+                *parents, field = column.split(".")
+                for parent in parents:
+                    target = target.setdefault(parent, {})
+                target[field] = value
+        except json.JSONDecodeError as e:
+            yield line_number, e
+            continue
+        yield line_number, record
+
+
+def _parse(lines, file_format):
+    if file_format == "ndjson":
+        return _ndjson_records(lines)
+    if file_format == "csv":
+        return _csv_records(lines)
+    raise ValueError(f"Unsupported format: {file_format}")
+
+
+def _error_message(error):
+    if isinstance(error, ValidationError):
+        return "; ".join(f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors())
+    return str(error).strip()
+
+
+def _insert_chunk(conn, chunk, report):
+    """chunk is a list of (line_number, PropertyFullCreate)."""
+    try:
+        add_properties_bulk(conn, [record for _, record in chunk])
+        report["inserted"] += len(chunk)
+        return
+    except Exception as e:
+        if len(chunk) == 1:
+            _reject(report, chunk[0][0], e)
+            return
+    # Something in the chunk was rejected by the database, find out which records
+    for line_number, record in chunk:
+        try:
+            add_properties_bulk(conn, [record])
+            report["inserted"] += 1
+        except Exception as e:
+            _reject(report, line_number, e)
+
+
+def _reject(report, line_number, error):
+    report["failed"] += 1
+    if len(report["errors"]) < MAX_REPORTED_ERRORS:
+        report["errors"].append({"line": line_number, "error": _error_message(error)})
+
+
+def import_properties(conn, lines, file_format="ndjson", chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Imports properties from an iterable of text lines. Returns a report like
+    {"received": 10, "inserted": 9, "failed": 1, "errors": [{"line": 4, "error": "..."}]}
+    """
+    report = {"received": 0, "inserted": 0, "failed": 0, "errors": []}
+    chunk = []
+    for line_number, data in _parse(lines, file_format):
+        report["received"] += 1
+        if isinstance(data, Exception):
+            _reject(report, line_number, data)
+            continue
+        try:
+            chunk.append((line_number, PropertyFullCreate.model_validate(data)))
+        except ValidationError as e:
+            _reject(report, line_number, e)
+            continue
+        if len(chunk) >= chunk_size:
+            _insert_chunk(conn, chunk, report)
+            chunk = []
+    if chunk:
+        _insert_chunk(conn, chunk, report)
+    return report
+
+
+def detect_format(filename, default="ndjson"):
+    if filename and filename.lower().endswith(".csv"):
+        return "csv"
+    if filename and filename.lower().endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    return default
+
+
+def text_lines(binary_file):
+    """Decodes an uploaded (binary) file into lines without reading it all into memory."""
+    return io.TextIOWrapper(binary_file, encoding="utf-8", newline="")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import properties from an NDJSON or CSV file")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default=None)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    connection = get_connection()
+    try:
+        with open(args.path, encoding="utf-8", newline="") as f:
+            result = import_properties(connection, f, args.format or detect_format(args.path), args.chunk_size)
+    finally:
+        connection.close()
+    print(json.dumps(result, indent=2))
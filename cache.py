@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from pg_listener import get_listener
+
+"""
+In-process read-through cache for the heavy property and listing reads.
+
+- TTLCache is a bounded LRU where every entry also expires after `ttl` seconds
+- db.py reads go through lookup()/store() and writes call invalidate() after they commit
+- Every invalidate() bumps the cache generation, and store() refuses values that were
+  loaded under an older generation, so a read that raced with a write can't put the
+  old row back into the cache
+- With CACHE_NOTIFY=1, writes also send a NOTIFY on the cache_invalidation channel and
+  every worker's listener drops the same keys, so multiple uvicorn workers stay in sync
+"""
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") == "1"
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "1024"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))
+CACHE_NOTIFY = os.getenv("CACHE_NOTIFY", "0") == "1"
+# The market statistics only change when analytics.refresh_market_stats runs
+MARKET_STATS_CACHE_TTL = float(os.getenv("MARKET_STATS_CACHE_TTL", "300"))
+
+INVALIDATION_CHANNEL = "cache_invalidation"
+
+# Invalidation keys
+LISTINGS = "listings"
+MARKET_STATS = "market_stats"
+
+
+def property_key(property_id):
+    return f"property:{property_id}"
+
+
+class TTLCache:
+    def __init__(self, name, maxsize, ttl, enabled=True):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def lookup(self, key):
+        """Returns (True, value) on a hit and (False, None) on a miss."""
+        if not self.enabled:
+            return False, None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def store(self, key, value, generation):
+        """Caches value unless something was invalidated since `generation` was read."""
+        if not self.enabled or value is None:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        hit, value = self.lookup(key)
+        if hit:
+            return value
+        generation = self.generation
+        value = loader()
+        self.store(key, value, generation)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+property_cache = TTLCache("property", CACHE_MAXSIZE, CACHE_TTL, CACHE_ENABLED)
+# Listing pages overlap, so any listing write clears the whole listings cache
+listings_cache = TTLCache("listings", CACHE_MAXSIZE, CACHE_TTL, CACHE_ENABLED)
+# Cleared whenever the statistics are refreshed
+market_stats_cache = TTLCache("market_stats", CACHE_MAXSIZE, MARKET_STATS_CACHE_TTL, CACHE_ENABLED)
+
+
+def invalidate(*keys):
+    """Drops the given keys (property_key(...), LISTINGS or MARKET_STATS) from this worker's caches."""
+    for key in keys:
+        if key == LISTINGS:
+            listings_cache.clear()
+        elif key == MARKET_STATS:
+            market_stats_cache.clear()
+        elif key.startswith("property:"):
+            property_cache.invalidate(int(key.split(":", 1)[1]))
+
+
+def publish_invalidation(cursor, *keys):
+    """
+    Tells the other workers to drop keys. Call it inside the write's transaction:
+    Postgres only delivers the NOTIFY if that transaction commits.
+    """
+    if not CACHE_NOTIFY:
+        return
+    for key in keys:
+        cursor.execute("SELECT pg_notify(%s, %s);", (INVALIDATION_CHANNEL, key))
+
+
+def _clear_all():
+    property_cache.clear()
+    listings_cache.clear()
+    market_stats_cache.clear()
+
+
+def start_cross_worker_invalidation():
+    if not (CACHE_ENABLED and CACHE_NOTIFY):
+        return
+    listener = get_listener()
+    listener.subscribe(INVALIDATION_CHANNEL, invalidate)
+    # Invalidations sent while the listener was disconnected are lost, start over
+    listener.on_reconnect(_clear_all)
+    listener.start()
+
+
+def cache_stats():
+    return {cache.name: cache.stats() for cache in (property_cache, listings_cache, market_stats_cache)}
@@ -1,8 +1,24 @@
 
 
+import math
+from datetime import timedelta
+
 import psycopg2
 from fastapi import HTTPException
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+
+from cache import (
+    LISTINGS,
+    invalidate,
+    listings_cache,
+    property_cache,
+    property_key,
+    publish_invalidation,
+)
+from metrics import instrument_module
+from pagination import FIRST_PAGE, MAX_INT, decode_cursor
+from prepared import execute as execute_prepared
+from prepared import register
 
 """
 This file is responsible for making database queries, which your fastapi endpoints/routes can use.
@@ -23,23 +39,35 @@ start with a connnection parameter.
 
 ### THIS IS JUST AN EXAMPLE OF A FUNCTION FOR INSPIRATION FOR A LIST-OPERATION (FETCHING MANY ENTRIES)
 
+# The SQL for the hot read/write paths lives in module level constants so the
+# async backend (async_db.py) runs exactly the same statements.
+
 # USERS
-def get_users(conn, limit, offset):
+USERS_SQL = """SELECT 
+            id, full_name, email, phone_number, profile_picture, role, created_at
+            FROM users
+            WHERE (created_at, id) < (%s::timestamp, %s)
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s;"""
+
+def get_users(conn, limit, page_cursor=None):
+    created_at, user_id = decode_cursor(page_cursor)
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("""SELECT 
-                        id, full_name, email, phone_number, profile_picture, role, created_at
-                        FROM users LIMIT %s OFFSET %s;""", (limit, offset))
+            cursor.execute(USERS_SQL, (created_at, user_id, limit))
             users = cursor.fetchall()
     return users
 
+USER_SQL = """SELECT 
+            id, full_name, email, phone_number, profile_picture, role, created_at
+            FROM users 
+            WHERE id = %s;"""
+register("user_by_id", USER_SQL)
+
 def get_user(conn, user_id):
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("""SELECT 
-                        id, full_name, email, phone_number, profile_picture, role, created_at
-                        FROM users 
-                        WHERE id = %s;""", (user_id,))
+            execute_prepared(cursor, "user_by_id", (user_id,))
             user = cursor.fetchone()
     return user
 
@@ -103,54 +131,96 @@ def delete_user(conn, user_id):
             return cursor.fetchone()
 
 # PROPERTIES
-def get_properties(conn, limit, offset):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(""" 
-            SELECT 
+# One row per property: images and videos are collected into arrays ordered by
+# image_order / video_order instead of LEFT JOINing both media tables, which
+# multiplied the rows (images x videos) and made LIMIT count joined rows.
+PROPERTY_COLUMNS = """
                 p.id, p.property_type, p.created_at,
                 f.rooms, f.bathrooms, f.size_sqm, f.floor, f.year_built, 
                 f.monthly_rent, f.total_floors, f.has_garden, f.has_parking, 
                 f.has_pool, f.has_balcony, f.energy_class,
                 loc.city, loc.address, loc.zip_code, loc.country, 
-                loc.latitude, loc.longitude, loc.map_url, 
-                img.image_url, vid.video_url
+                loc.latitude, loc.longitude, loc.map_url,
+                COALESCE((SELECT array_agg(img.image_url ORDER BY img.image_order)
+                    FROM property_images img WHERE img.property_id = p.id), '{}') AS images,
+                COALESCE((SELECT array_agg(vid.video_url ORDER BY vid.video_order)
+                    FROM property_videos vid WHERE vid.property_id = p.id), '{}') AS videos
+"""
 
+PROPERTIES_SQL = f""" 
+            SELECT {PROPERTY_COLUMNS}
             FROM properties p
             JOIN features f ON p.id = f.property_id
             JOIN location loc ON p.id = loc.property_id
-            LEFT JOIN property_images img ON p.id = img.property_id
-            LEFT JOIN property_videos vid ON p.id = vid.property_id 
-            LIMIT %s OFFSET %s
-        """, (limit, offset))
-            properties = cursor.fetchall()
-            return properties
+            WHERE (p.created_at, p.id) < (%s::timestamp, %s)
+            ORDER BY p.created_at DESC, p.id DESC
+            LIMIT %s
+        """
 
-def get_property_by_id(conn, property_id):
+def get_properties(conn, limit, page_cursor=None):
+    created_at, property_id = decode_cursor(page_cursor)
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """
-            SELECT
-                p.id, p.property_type, p.created_at,
-                f.rooms, f.bathrooms, f.size_sqm, f.floor, f.year_built, 
-                f.monthly_rent, f.total_floors, f.has_garden, f.has_parking, 
-                f.has_pool, f.has_balcony, f.energy_class,
-                loc.city, loc.address, loc.zip_code, loc.country, 
-                loc.latitude, loc.longitude, loc.map_url, img.image_url, vid.video_url
-                        
+            cursor.execute(PROPERTIES_SQL, (created_at, property_id, limit))
+            properties = cursor.fetchall()
+            return properties
+
+PROPERTY_BY_ID_SQL = f"""
+            SELECT {PROPERTY_COLUMNS}
             FROM properties p
             JOIN features f ON p.id = f.property_id
             JOIN location loc ON p.id = loc.property_id
-            LEFT JOIN property_images img ON p.id = img.property_id
-            LEFT JOIN property_videos vid ON p.id = vid.property_id
             WHERE p.id = %s
-            """,
-            (property_id,),
-            )
+            """
+register("property_by_id", PROPERTY_BY_ID_SQL)
+
+def _load_property_by_id(conn, property_id):
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            execute_prepared(cursor, "property_by_id", (property_id,))
             property = cursor.fetchone()
         return property
 
+def get_property_by_id(conn, property_id):
+    # Read-through cache, invalidated by the property and listing write functions below
+    return property_cache.get_or_load(property_id, lambda: _load_property_by_id(conn, property_id))
+
+MAX_BATCH_PROPERTIES = 500
+
+PROPERTIES_BY_IDS_SQL = f"""
+            SELECT {PROPERTY_COLUMNS}
+            FROM properties p
+            JOIN features f ON p.id = f.property_id
+            JOIN location loc ON p.id = loc.property_id
+            WHERE p.id = ANY(%s::int[])
+            """
+
+def get_properties_by_ids(conn, property_ids):
+    """
+    Same rows as get_property_by_id for many ids: cached ones come from the property cache,
+    the rest are loaded in one query. Returns (properties in the requested order, missing ids).
+    """
+    property_ids = list(dict.fromkeys(property_ids))
+    found = {}
+    to_load = []
+    for property_id in property_ids:
+        hit, property = property_cache.lookup(property_id)
+        if hit:
+            found[property_id] = property
+        else:
+            to_load.append(property_id)
+    if to_load:
+        generation = property_cache.generation
+        with conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(PROPERTIES_BY_IDS_SQL, (to_load,))
+                for property in cursor.fetchall():
+                    found[property["id"]] = property
+                    property_cache.store(property["id"], property, generation)
+    properties = [found[property_id] for property_id in property_ids if property_id in found]
+    missing = [property_id for property_id in property_ids if property_id not in found]
+    return properties, missing
+
 def add_property(conn, property, features, location, images, videos):
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
@@ -208,32 +278,102 @@ def add_property(conn, property, features, location, images, videos):
                     location.map_url
                 ))
             
-            for image in images:
-                cursor.execute(
+            if images:
+                execute_values(
+                    cursor,
                     """
                     INSERT INTO property_images (property_id, image_url, image_order) 
-                    VALUES (%s, %s, %s)
+                    VALUES %s
                     """,
-                    (
-                        property_id,
-                        image.image_url,
-                        image.image_order
-                    ))
+                    [(property_id, image.image_url, image.image_order) for image in images])
             
-            for video in videos:
-                cursor.execute(
+            if videos:
+                execute_values(
+                    cursor,
                     """
                     INSERT INTO property_videos (property_id, video_url, video_order) 
-                    VALUES (%s, %s, %s)
+                    VALUES %s
                     """,
-                    (
-                        property_id,
-                        video.video_url,
-                        video.video_order,
-                    ))
+                    [(property_id, video.video_url, video.video_order) for video in videos])
             
     return get_property_by_id(conn, property_id)
 
+def add_properties_bulk(conn, records):
+    """
+    Inserts a chunk of PropertyFullCreate records in one transaction, with one
+    multi-row INSERT per table instead of one INSERT per row. The property ids are
+    taken from the sequence up front, so the child rows can be built without
+    reading ids back. Returns the new ids in the same order as `records`.
+    Raises if any row fails, in which case nothing from the chunk is inserted.
+    """
+    if not records:
+        return []
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence('properties', 'id')) FROM generate_series(1, %s);",
+                (len(records),))
+            property_ids = [row[0] for row in cursor.fetchall()]
+
+            execute_values(
+                cursor,
+                "INSERT INTO properties (id, property_type) VALUES %s",
+                [(property_id, record.property.property_type) for property_id, record in zip(property_ids, records)],
+                page_size=len(records))
+
+            execute_values(
+                cursor,
+                """INSERT INTO features (property_id, rooms, bathrooms, size_sqm, floor, year_built, year_renovated,
+                monthly_rent, total_floors, has_garden, garden_size_sqm, has_elevator, has_garage, has_parking, has_pool, has_balcony, energy_class)
+                VALUES %s""",
+                [
+                    (
+                        property_id, f.rooms, f.bathrooms, f.size_sqm, f.floor, f.year_built, f.year_renovated,
+                        f.monthly_rent, f.total_floors, f.has_garden, f.garden_size_sqm, f.has_elevator,
+                        f.has_garage, f.has_parking, f.has_pool, f.has_balcony, f.energy_class,
+                    )
+                    for property_id, f in zip(property_ids, (record.features for record in records))
+                ],
+                page_size=len(records))
+
+            execute_values(
+                cursor,
+                """INSERT INTO location (property_id, address, city, zip_code, county, state, country, latitude, longitude, map_url)
+                VALUES %s""",
+                [
+                    (
+                        property_id, loc.address, loc.city, loc.zip_code, loc.county, loc.state,
+                        loc.country, loc.latitude, loc.longitude, loc.map_url,
+                    )
+                    for property_id, loc in zip(property_ids, (record.location for record in records))
+                ],
+                page_size=len(records))
+
+            images = [
+                (property_id, image.image_url, image.image_order)
+                for property_id, record in zip(property_ids, records)
+                for image in record.images
+            ]
+            if images:
+                execute_values(
+                    cursor,
+                    "INSERT INTO property_images (property_id, image_url, image_order) VALUES %s",
+                    images,
+                    page_size=1000)
+
+            videos = [
+                (property_id, video.video_url, video.video_order)
+                for property_id, record in zip(property_ids, records)
+                for video in record.videos
+            ]
+            if videos:
+                execute_values(
+                    cursor,
+                    "INSERT INTO property_videos (property_id, video_url, video_order) VALUES %s",
+                    videos,
+                    page_size=1000)
+    return property_ids
+
 def edit_property(conn, property_id, property_type):
     with conn:
         with conn.cursor(cursor_factory = RealDictCursor) as cursor:
@@ -243,13 +383,23 @@ def edit_property(conn, property_id, property_type):
                         WHERE id = %s 
                         RETURNING id """, 
                         (property_type.property_type, property_id))
-            return cursor.fetchone()
+            updated = cursor.fetchone()
+            if updated:
+                publish_invalidation(cursor, property_key(property_id), LISTINGS)
+    if updated:
+        invalidate(property_key(property_id), LISTINGS)
+    return updated
 
 def delete_property(conn, property_id):
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
             cursor.execute("""DELETE FROM properties WHERE id = %s RETURNING id""", (property_id,))
-            return cursor.fetchone()
+            deleted = cursor.fetchone()
+            if deleted:
+                publish_invalidation(cursor, property_key(property_id), LISTINGS)
+    if deleted:
+        invalidate(property_key(property_id), LISTINGS)
+    return deleted
 
 # Agencies
 def get_agencies(conn):
@@ -439,11 +589,10 @@ def delete_broker_by_id(conn, broker_id):
 
 # Add more functions as needed for other database operations
 
-def get_listings(conn, limit, offset):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute("""
-                SELECT 
+# Everything a listing card needs. Shared by get_listings, search_listings and the
+# other listing queries so they all return the same row shape.
+LISTING_COLUMNS = """
+                    l.id AS listing_id, l.created_at AS listed_at,
                     p.id AS property_id, p.property_type, p.created_at,
                     f.rooms, f.bathrooms, f.size_sqm, f.floor, f.year_built, 
                     f.monthly_rent, f.total_floors, f.has_garden, f.has_parking, 
@@ -469,7 +618,9 @@ def get_listings(conn, limit, offset):
                     a_user.full_name AS agency_name,
                     a_user.phone_number AS agency_phone,
                     a_user.profile_picture AS agency_picture
+"""
 
+LISTING_FROM = """
                 FROM listing_property l
                 JOIN properties p ON l.property_id = p.id
                 JOIN features f ON l.property_id = f.property_id
@@ -479,22 +630,253 @@ def get_listings(conn, limit, offset):
                 LEFT JOIN users b_user ON b.user_id = b_user.id
                 LEFT JOIN agencies a ON b.agency_id = a.id
                 LEFT JOIN users a_user ON a.user_id = a_user.id
+"""
+
+LISTING_SELECT = "SELECT" + LISTING_COLUMNS + LISTING_FROM
+
+LISTINGS_SQL = LISTING_SELECT + """
                 WHERE l.listing_status = 'Active'
-                LIMIT %s OFFSET %s;
-            """, (limit, offset))
-            
+                AND (l.created_at, l.id) < (%s::timestamp, %s)
+                ORDER BY l.created_at DESC, l.id DESC
+                LIMIT %s;
+            """
+register("listings_page", LISTINGS_SQL)
+
+def _load_listings(conn, limit, page_cursor):
+    listed_at, listing_id = decode_cursor(page_cursor)
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            execute_prepared(cursor, "listings_page", (listed_at, listing_id, limit))
             listings = cursor.fetchall()
     return listings
 
+def get_listings(conn, limit, page_cursor=None):
+    # Read-through cache, any listing write clears it (see cache.LISTINGS)
+    return listings_cache.get_or_load((limit, page_cursor), lambda: _load_listings(conn, limit, page_cursor))
+
+# Sort orders for search_listings. Each one seeks on its own keyset, "first_page"
+# is the sentinel cursor that makes the seek condition match every row.
+LISTING_SORTS = {
+    "newest": {
+        "order_by": "l.created_at DESC, l.id DESC",
+        "seek": "(l.created_at, l.id) < (%s::timestamp, %s)",
+        "first_page": FIRST_PAGE,
+        "cursor_keys": ("listed_at", "listing_id"),
+    },
+    "price_asc": {
+        "order_by": "l.start_price ASC, l.id ASC",
+        "seek": "(l.start_price, l.id) > (%s, %s)",
+        "first_page": (-MAX_INT, 0),
+        "cursor_keys": ("start_price", "listing_id"),
+    },
+    "price_desc": {
+        "order_by": "l.start_price DESC, l.id DESC",
+        "seek": "(l.start_price, l.id) < (%s, %s)",
+        "first_page": (MAX_INT, MAX_INT),
+        "cursor_keys": ("start_price", "listing_id"),
+    },
+}
+
+LISTING_AMENITIES = ("has_pool", "has_garden", "has_balcony", "has_parking", "has_elevator", "has_garage")
+
+def search_listings(conn, filters):
+    """
+    Active listings matching the FilterSidebar filters.
+    Only the filters that are set end up in the WHERE clause, and every value is
+    passed as a query parameter.
+    """
+    sort = LISTING_SORTS[filters.sort]
+    conditions = ["l.listing_status = 'Active'", sort["seek"]]
+    values = list(decode_cursor(filters.cursor, sort["first_page"]))
+
+    if filters.listing_type is not None:
+        conditions.append("l.listing_type = %s")
+        values.append(filters.listing_type)
+    if filters.property_type is not None:
+        conditions.append("p.property_type = %s")
+        values.append(filters.property_type)
+    if filters.min_price is not None:
+        conditions.append("l.start_price >= %s")
+        values.append(filters.min_price)
+    if filters.max_price is not None:
+        conditions.append("l.start_price <= %s")
+        values.append(filters.max_price)
+    if filters.min_rooms is not None:
+        conditions.append("f.rooms >= %s")
+        values.append(filters.min_rooms)
+    if filters.min_bathrooms is not None:
+        conditions.append("f.bathrooms >= %s")
+        values.append(filters.min_bathrooms)
+    if filters.city is not None:
+        conditions.append("loc.city = %s")
+        values.append(filters.city)
+    if filters.energy_class is not None:
+        conditions.append("f.energy_class = %s")
+        values.append(filters.energy_class)
+    for amenity in LISTING_AMENITIES:
+        # Column names come from the fixed tuple above, never from the request
+        if getattr(filters, amenity) is not None:
+            conditions.append(f"f.{amenity} = %s")
+            values.append(getattr(filters, amenity))
+
+    values.append(filters.limit)
+
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(LISTING_SELECT + f"""
+                WHERE {' AND '.join(conditions)}
+                ORDER BY {sort["order_by"]}
+                LIMIT %s;
+            """, values)
+            listings = cursor.fetchall()
+    return listings
+
+# FULL-TEXT SEARCH
+def search_listings_text(conn, query, limit):
+    """
+    Active listings matching a free text query like "sea view balcony", best match first.
+    Matching and ranking only touch listing_property (GIN index on search_vector), the
+    joins and the highlighted snippets are only done for the `limit` best matches.
+    """
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(
+                f"""WITH q AS (
+                    SELECT websearch_to_tsquery('english', %s) AS query
+                ), matches AS (
+                    SELECT l.id, ts_rank_cd(l.search_vector, q.query) AS rank
+                    FROM listing_property l, q
+                    WHERE l.listing_status = 'Active'
+                    AND l.search_vector @@ q.query
+                    ORDER BY rank DESC, l.id DESC
+                    LIMIT %s
+                )
+                SELECT {LISTING_COLUMNS},
+                    m.rank,
+                    ts_headline('english', l.title, q.query, 'HighlightAll=true') AS title_highlight,
+                    ts_headline('english', l.description, q.query, 'MaxWords=30, MinWords=10, MaxFragments=2') AS snippet
+                {LISTING_FROM}
+                JOIN matches m ON m.id = l.id
+                CROSS JOIN q
+                ORDER BY m.rank DESC, l.id DESC;
+                """,
+                (query, limit)
+            )
+            listings = cursor.fetchall()
+    return listings
+
+# GEO SEARCH
+# location has a GiST index on point(longitude, latitude) (see create_tables), which
+# answers "inside this box" (<@) and "ordered by distance" (<->) queries. The box and
+# <-> work in plain degrees, so they are only used to narrow down candidates, the
+# exact great-circle distance comes from the distance_m() SQL function.
+# Longitudes wrap at +-180 but boxes don't, so an area crossing the antimeridian is
+# searched as two boxes, one on each side.
+EARTH_RADIUS_M = 6371008.8
+
+LOCATION_POINT = "point(loc.longitude::float8, loc.latitude::float8)"
+
+def _split_antimeridian(min_lon, min_lat, max_lon, max_lat):
+    """Boxes (min_lon, min_lat, max_lon, max_lat) within [-180, 180], min_lon > max_lon wraps."""
+    if min_lon <= max_lon:
+        return [(min_lon, min_lat, max_lon, max_lat)]
+    return [(min_lon, min_lat, 180.0, max_lat), (-180.0, min_lat, max_lon, max_lat)]
+
+def _bounding_boxes(lat, lon, radius_m):
+    """Boxes that together contain the whole circle, see _split_antimeridian."""
+    angle = radius_m / EARTH_RADIUS_M
+    dlat = math.degrees(angle)
+    min_lat, max_lat = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    sin_angle, cos_lat = math.sin(angle), math.cos(math.radians(lat))
+    # Around a pole (or a circle half the earth wide) every longitude is in range
+    if min_lat == -90.0 or max_lat == 90.0 or angle >= math.pi / 2 or sin_angle >= cos_lat:
+        return [(-180.0, min_lat, 180.0, max_lat)]
+    dlon = math.degrees(math.asin(sin_angle / cos_lat))
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180.0:
+        min_lon += 360.0
+    if max_lon > 180.0:
+        max_lon -= 360.0
+    return _split_antimeridian(min_lon, min_lat, max_lon, max_lat)
+
+def _in_boxes(boxes):
+    """SQL condition and parameters matching a location inside any of the boxes."""
+    condition = " OR ".join(f"{LOCATION_POINT} <@ box(point(%s, %s), point(%s, %s))" for _ in boxes)
+    return f"({condition})", [value for box in boxes for value in box]
+
+def get_listings_nearby(conn, lat, lon, radius_m, limit):
+    in_boxes, box_values = _in_boxes(_bounding_boxes(lat, lon, radius_m))
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(
+                f"""SELECT {LISTING_COLUMNS},
+                    distance_m(loc.latitude, loc.longitude, %s, %s) AS distance_m
+                {LISTING_FROM}
+                WHERE l.listing_status = 'Active'
+                AND {in_boxes}
+                AND distance_m(loc.latitude, loc.longitude, %s, %s) <= %s
+                ORDER BY distance_m, l.id
+                LIMIT %s;
+                """,
+                (lat, lon, *box_values, lat, lon, radius_m, limit)
+            )
+            listings = cursor.fetchall()
+    return listings
+
+def get_listings_in_box(conn, min_lat, min_lon, max_lat, max_lon, limit):
+    """Active listings inside the box, min_lon > max_lon means it crosses the antimeridian."""
+    in_boxes, box_values = _in_boxes(_split_antimeridian(min_lon, min_lat, max_lon, max_lat))
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(
+                f"""SELECT {LISTING_COLUMNS}
+                {LISTING_FROM}
+                WHERE l.listing_status = 'Active'
+                AND {in_boxes}
+                ORDER BY l.created_at DESC, l.id DESC
+                LIMIT %s;
+                """,
+                (*box_values, limit)
+            )
+            listings = cursor.fetchall()
+    return listings
+
+def get_nearest_listings(conn, lat, lon, k):
+    """
+    The k active listings closest to (lat, lon).
+    First an index-ordered (<->) scan finds k candidates, the furthest of them gives
+    a radius that is guaranteed to contain the real k nearest, which
+    get_listings_nearby then ranks by exact distance.
+    """
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(
+                f"""SELECT MAX(distance_m) AS radius_m FROM (
+                    SELECT distance_m(loc.latitude, loc.longitude, %s, %s) AS distance_m
+                    FROM location loc
+                    JOIN listing_property l ON l.property_id = loc.property_id
+                    WHERE l.listing_status = 'Active'
+                    ORDER BY {LOCATION_POINT} <-> point(%s, %s)
+                    LIMIT %s
+                ) candidates;
+                """,
+                (lat, lon, lon, lat, k)
+            )
+            radius_m = cursor.fetchone()["radius_m"]
+    if radius_m is None:
+        return []
+    # Small margin so float rounding never drops the furthest candidate
+    return get_listings_nearby(conn, lat, lon, radius_m + 1, k)
+
 def listing_property(conn, listing):
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
             cursor.execute(
                 """
                 INSERT INTO listing_property 
-                (property_id, property_owner_id, broker_id, title, description, start_price, start_date, end_date, listing_status, listing_type)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id, property_id, property_owner_id, broker_id, title, description, start_price, start_date, end_date, listing_status, created_at, listing_type;
+                (property_id, property_owner_id, broker_id, title, description, start_price, start_date, end_date, listing_status, listing_type, min_bid_increment)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id, property_id, property_owner_id, broker_id, title, description, start_price, start_date, end_date, listing_status, created_at, listing_type, min_bid_increment;
                 """,
                 (
                     listing.property_id,
@@ -506,10 +888,13 @@ def listing_property(conn, listing):
                     listing.start_date,
                     listing.end_date,
                     listing.listing_status,
-                    listing.listing_type
+                    listing.listing_type,
+                    listing.min_bid_increment
                 )
             )
             created_listing = cursor.fetchone()
+            publish_invalidation(cursor, LISTINGS)
+    invalidate(LISTINGS)
     return created_listing
 
 def unlist_property(conn, listing_id):
@@ -523,6 +908,10 @@ def unlist_property(conn, listing_id):
                 (listing_id,)
             )
             listing = cursor.fetchone()
+            if listing:
+                publish_invalidation(cursor, LISTINGS)
+    if listing:
+        invalidate(LISTINGS)
     return listing
 
 
@@ -530,68 +919,137 @@ def update_listing_status(conn, listing_id, update):
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
             cursor.execute(
-                """UPDATE listing_property
+                """UPDATE listing_property l
                 SET listing_status = %s
-                WHERE id = %s
-                RETURNING id, property_id, property_owner_id, broker_id, title, description, start_price, start_date, end_date, listing_status, created_at;
+                FROM listing_property previous
+                WHERE l.id = %s AND previous.id = l.id
+                RETURNING l.id, l.property_id, l.property_owner_id, l.broker_id, l.title, l.description, l.start_price,
+                l.start_date, l.end_date, l.listing_status, l.created_at, previous.listing_status AS previous_status;
                 """,
                 (update.listing_status, listing_id)
             )
             updated_listing = cursor.fetchone()
             if not updated_listing:
                 raise HTTPException(status_code=404, detail="Listing not found")
+            publish_invalidation(cursor, LISTINGS)
+    invalidate(LISTINGS)
     return updated_listing
 
+BIDS_FOR_PROPERTY_SQL = """SELECT 
+                id, user_id, property_id, bid_amount, created_at
+                FROM bids
+                WHERE property_id = %s
+                ORDER BY bid_amount DESC, id;
+                """
+
 def get_bids_for_property(conn, property_id):
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """SELECT 
-                id, user_id, property_id, bid_amount, created_at
-                FROM bids
-                WHERE property_id = %s;
-                """,
-                (property_id,)
-            )
+            cursor.execute(BIDS_FOR_PROPERTY_SQL, (property_id,))
             bids = cursor.fetchall()
     return bids
 
-def bid_on_property(conn, data):
+TOP_BID_SQL = """SELECT
+                id AS listing_id, property_id, start_price, min_bid_increment, end_date,
+                top_bid_amount, top_bidder_id, top_bid_at, bid_count,
+                COALESCE(top_bid_amount + min_bid_increment, start_price) AS min_next_bid,
+                end_date IS NOT NULL AND end_date <= LOCALTIMESTAMP AS bidding_closed
+                FROM listing_property
+                WHERE property_id = %s AND listing_status = 'Active'
+                ORDER BY id DESC
+                LIMIT 1;
+                """
+register("top_bid", TOP_BID_SQL)
+
+def get_top_bid(conn, property_id):
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-
-            cursor.execute(
-                """INSERT INTO bids (user_id, property_id, bid_amount) 
-                VALUES (%s, %s, %s)
+            execute_prepared(cursor, "top_bid", (property_id,))
+            top_bid = cursor.fetchone()
+    return top_bid
+
+# The conditional UPDATE is the whole check: it only matches the Active listing while
+# the bid beats the current top bid by min_bid_increment (or reaches start_price for
+# the first bid). Concurrent bids on the same listing queue on its row lock and the
+# WHERE is re-checked against the committed top bid, so a stale bid can never win.
+# The bid row is only inserted when the UPDATE matched.
+INSERT_BID_SQL = """WITH listing AS (
+                    UPDATE listing_property l
+                    SET top_bid_amount = %(bid_amount)s,
+                        top_bidder_id = %(user_id)s,
+                        top_bid_at = LOCALTIMESTAMP,
+                        bid_count = l.bid_count + 1
+                    WHERE l.id = (
+                        SELECT id FROM listing_property
+                        WHERE property_id = %(property_id)s AND listing_status = 'Active'
+                        ORDER BY id DESC
+                        LIMIT 1
+                    )
+                    AND l.listing_status = 'Active'
+                    AND (l.end_date IS NULL OR l.end_date > LOCALTIMESTAMP)
+                    AND %(bid_amount)s >= COALESCE(l.top_bid_amount + l.min_bid_increment, l.start_price)
+                    RETURNING l.id
+                )
+                INSERT INTO bids (user_id, property_id, bid_amount)
+                SELECT %(user_id)s, %(property_id)s, %(bid_amount)s FROM listing
                 RETURNING id, user_id, property_id, bid_amount, created_at;
-                """,
-                (data.user_id, data.property_id, data.bid_amount)
+                """
+register("insert_bid", INSERT_BID_SQL)
+
+def bid_rejection(top_bid):
+    """
+    The error for a bid that INSERT_BID_SQL didn't accept, based on the listing's
+    TOP_BID_SQL row read right after it (None when there is no Active listing).
+    """
+    if top_bid is None:
+        return HTTPException(status_code=404, detail="No active listing for this property")
+    if top_bid["bidding_closed"]:
+        return HTTPException(status_code=409, detail="Bidding on this listing has ended")
+    return HTTPException(
+        status_code=409,
+        detail={
+            "message": f"Bid must be at least {top_bid['min_next_bid']}",
+            "top_bid_amount": top_bid["top_bid_amount"],
+            "min_next_bid": top_bid["min_next_bid"],
+        },
+    )
+
+def bid_on_property(conn, data):
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            execute_prepared(
+                cursor, "insert_bid",
+                {"user_id": data.user_id, "property_id": data.property_id, "bid_amount": data.bid_amount}
             )
             bid = cursor.fetchone()
+            if not bid:
+                execute_prepared(cursor, "top_bid", (data.property_id,))
+                raise bid_rejection(cursor.fetchone())
     return bid
 
-def get_offers_for_property(conn, property_id):
-    with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """SELECT 
+OFFERS_FOR_PROPERTY_SQL = """SELECT 
                 id, user_id, property_id, offer_amount, message, status, created_at
                 FROM offers
                 WHERE property_id = %s;
-                """,
-                (property_id,)
-            )
+                """
+
+def get_offers_for_property(conn, property_id):
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(OFFERS_FOR_PROPERTY_SQL, (property_id,))
             offers = cursor.fetchall()
     return offers
 
+INSERT_OFFER_SQL = """INSERT INTO offers (user_id, property_id, offer_amount, message, status) 
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING id, user_id, property_id, offer_amount, message, status, created_at;
+                """
+
 def make_offer(conn, data):
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
             cursor.execute(
-                """INSERT INTO offers (user_id, property_id, offer_amount, message, status) 
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING id, user_id, property_id, offer_amount, message, status, created_at;
-                """,
+                INSERT_OFFER_SQL,
                 (data.user_id, data.property_id, data.offer_amount, data.message, data.status)
             )
             offer = cursor.fetchone()
@@ -612,6 +1070,60 @@ def get_favorite_properties(conn, user_id):
             favorites = cursor.fetchall()
     return favorites
 
+# The page of favorites is cut first (an index range scan on (user_id, created_at, id)),
+# then only those rows are joined with their property, latest listing and the last two
+# price_history rows (the last price change).
+FAVORITES_FEED_SQL = """
+            SELECT
+                fav.id, fav.property_id, fav.notes, fav.is_contacted, fav.created_at,
+                p.property_type, f.rooms, f.size_sqm, loc.city, loc.address,
+                (SELECT img.image_url FROM property_images img
+                    WHERE img.property_id = p.id
+                    ORDER BY img.image_order LIMIT 1) AS image_url,
+                l.listing_id, l.title, l.listing_status, l.listing_type,
+                COALESCE(lp.end_price, l.start_price) AS current_price,
+                lp.previous_price, lp.record_at AS price_changed_at
+            FROM (
+                SELECT id, property_id, notes, is_contacted, created_at
+                FROM favorites
+                WHERE user_id = %s
+                AND (created_at, id) < (%s::timestamp, %s)
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            ) fav
+            JOIN properties p ON p.id = fav.property_id
+            LEFT JOIN features f ON p.id = f.property_id
+            LEFT JOIN location loc ON p.id = loc.property_id
+            LEFT JOIN LATERAL (
+                SELECT id AS listing_id, title, listing_status, listing_type, start_price
+                FROM listing_property
+                WHERE property_id = p.id
+                ORDER BY created_at DESC, id DESC
+                LIMIT 1
+            ) l ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT ph.end_price, ph.record_at,
+                    (SELECT prev.end_price FROM price_history prev
+                        WHERE prev.property_id = ph.property_id
+                        AND (prev.record_at, prev.id) < (ph.record_at, ph.id)
+                        ORDER BY prev.record_at DESC, prev.id DESC
+                        LIMIT 1) AS previous_price
+                FROM price_history ph
+                WHERE ph.property_id = p.id
+                ORDER BY ph.record_at DESC, ph.id DESC
+                LIMIT 1
+            ) lp ON TRUE
+            ORDER BY fav.created_at DESC, fav.id DESC;
+            """
+
+def get_favorites_feed(conn, user_id, limit, page_cursor=None):
+    created_at, favorite_id = decode_cursor(page_cursor)
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(FAVORITES_FEED_SQL, (user_id, created_at, favorite_id, limit))
+            favorites = cursor.fetchall()
+    return favorites
+
 def add_favorite_property(conn, data):
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
@@ -639,17 +1151,49 @@ def unfavorite_property(conn, favorite_id):
             favorite = cursor.fetchone()
     return favorite
 
-def get_price_history(conn, property_id):
+def get_price_history(conn, property_id, start=None, end=None, bucket=None):
+    """
+    Price records of a property between start and end (exclusive) in time order, both
+    optional. With a bucket (day, week or month) it returns one row per bucket instead:
+    the first, last, lowest and highest price recorded in it. Both read a range of the
+    (property_id, record_at) index.
+    """
+    params = {
+        "property_id": property_id,
+        "start": start or "-infinity",
+        "end": end or "infinity",
+        "bucket": bucket,
+    }
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(
-                """SELECT 
-                id, property_id, end_price, record_at
-                FROM price_history
-                WHERE property_id = %s;
-                """,
-                (property_id,)
-            )
+            if bucket is None:
+                cursor.execute(
+                    """SELECT
+                    id, property_id, end_price, record_at
+                    FROM price_history
+                    WHERE property_id = %(property_id)s
+                    AND record_at >= %(start)s::timestamp AND record_at < %(end)s::timestamp
+                    ORDER BY record_at, id;
+                    """,
+                    params
+                )
+            else:
+                cursor.execute(
+                    """SELECT
+                    date_trunc(%(bucket)s, record_at) AS bucket,
+                    (array_agg(end_price ORDER BY record_at, id))[1] AS first_price,
+                    (array_agg(end_price ORDER BY record_at DESC, id DESC))[1] AS last_price,
+                    MIN(end_price) AS min_price,
+                    MAX(end_price) AS max_price,
+                    COUNT(*) AS records
+                    FROM price_history
+                    WHERE property_id = %(property_id)s
+                    AND record_at >= %(start)s::timestamp AND record_at < %(end)s::timestamp
+                    GROUP BY 1
+                    ORDER BY 1;
+                    """,
+                    params
+                )
             price_history = cursor.fetchall()
     return price_history
 
@@ -664,22 +1208,92 @@ def record_price_history(conn, data):
                 (data.property_id, data.end_price)
             )
             price_record = cursor.fetchone()
+            publish_invalidation(cursor, property_key(data.property_id), LISTINGS)
+    invalidate(property_key(data.property_id), LISTINGS)
     return price_record
 
-def get_notifications(conn, user_id):
+# Which favorites flag each kind of notification is for, and its title
+NOTIFICATION_KINDS = {
+    "price_change": ("notify_price_change", "Price changed"),
+    "status_change": ("notify_status_change", "Listing status changed"),
+}
+
+def fan_out_notifications(conn, kind, property_id, message):
+    """
+    Creates a `kind` notification for everyone who favorited the property with that
+    kind of notification turned on, in one INSERT ... SELECT however many followers
+    there are. The message is prefixed with the property's address and cut to fit
+    the column. Returns the number of notifications created.
+    """
+    flag, title = NOTIFICATION_KINDS[kind]
     with conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        with conn.cursor() as cursor:
             cursor.execute(
-                """SELECT 
-                id, user_id, property_id, favorite_id, title, message, is_read, created_at
-                FROM notifications
-                WHERE user_id = %s;
+                f"""INSERT INTO notifications (user_id, property_id, favorite_id, title, message, type)
+                SELECT f.user_id, f.property_id, f.id, %s,
+                LEFT(COALESCE(loc.address, 'A property you follow') || %s, 100), %s
+                FROM favorites f
+                LEFT JOIN location loc ON loc.property_id = f.property_id
+                WHERE f.property_id = %s AND f.{flag};
                 """,
-                (user_id,)
+                (title, message, kind, property_id)
             )
+            return cursor.rowcount
+
+NOTIFICATIONS_SQL = """SELECT 
+                id, user_id, property_id, favorite_id, title, message, type, is_read, created_at
+                FROM notifications
+                WHERE user_id = %s
+                AND (%s = FALSE OR NOT is_read)
+                AND (created_at, id) < (%s::timestamp, %s)
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s;
+                """
+
+def get_notifications(conn, user_id, limit, page_cursor=None, unread_only=False):
+    created_at, notification_id = decode_cursor(page_cursor)
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(NOTIFICATIONS_SQL, (user_id, unread_only, created_at, notification_id, limit))
             notifications = cursor.fetchall()
     return notifications
 
+def count_unread_notifications(conn, user_id):
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """SELECT COUNT(*) FROM notifications
+                WHERE user_id = %s AND NOT is_read;
+                """,
+                (user_id,)
+            )
+            return cursor.fetchone()[0]
+
+def mark_notifications_as_read(conn, user_id, notification_ids=None):
+    """Marks the given notifications of the user as read, or all of them when notification_ids is None."""
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """UPDATE notifications
+                SET is_read = TRUE
+                WHERE user_id = %s AND NOT is_read
+                AND (%s::int[] IS NULL OR id = ANY(%s::int[]));
+                """,
+                (user_id, notification_ids, notification_ids)
+            )
+            return cursor.rowcount
+
+def delete_notifications(conn, user_id, notification_ids):
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """DELETE FROM notifications
+                WHERE user_id = %s AND id = ANY(%s::int[]);
+                """,
+                (user_id, notification_ids)
+            )
+            return cursor.rowcount
+
 
 def mark_notification_as_read(conn, notification_id):
     with conn:
@@ -722,20 +1336,115 @@ def get_property_views(conn, property_id):
             views = cursor.fetchall()
     return views
 
-def record_property_view(conn, data):
+# Buckets the view stats can be grouped by, each backed by its own materialized view
+VIEW_STATS_BUCKETS = {
+    "hour": "property_view_stats_hourly",
+    "day": "property_view_stats_daily",
+}
+
+# Any constant works, it only has to be the same in every worker
+VIEW_STATS_REFRESH_LOCK = 7_001_001
+
+def _bucket_range(start, end, bucket):
+    """Widens [start, end) to whole buckets: start rounded down, end rounded up."""
+    def floor(value):
+        value = value.replace(minute=0, second=0, microsecond=0)
+        return value.replace(hour=0) if bucket == "day" else value
+    step = timedelta(days=1) if bucket == "day" else timedelta(hours=1)
+    end_floor = floor(end)
+    return floor(start), end_floor if end_floor == end else end_floor + step
+
+def get_property_view_stats(conn, property_id, start, end, bucket):
+    """
+    View counts for a property per hour or day. The range is widened to whole buckets
+    (the returned from / to), so everything comes from the rollups and trails the raw
+    table by at most one refresh interval. Unique viewers over the whole range can't
+    be added up from the buckets, they're the union of the buckets' user_ids.
+    """
+    start, end = _bucket_range(start, end, bucket)
+    rollup = VIEW_STATS_BUCKETS[bucket]
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            # One statement, so the series and the unique count see the same refresh
             cursor.execute(
-                """INSERT INTO property_views (user_id, property_id) 
-                VALUES (%s, %s)
-                RETURNING id, user_id, property_id;
+                f"""WITH buckets AS (
+                    SELECT bucket, views, unique_users, user_ids
+                    FROM {rollup}
+                    WHERE property_id = %s
+                    AND bucket >= %s AND bucket < %s
+                )
+                SELECT bucket, views, unique_users,
+                    (SELECT COUNT(DISTINCT user_id) FROM buckets, unnest(user_ids) AS user_id) AS range_unique_users
+                FROM buckets
+                ORDER BY bucket;
                 """,
-                (data.user_id, data.property_id)
+                (property_id, start, end)
             )
+            series = cursor.fetchall()
+    unique_users = series[0]["range_unique_users"] if series else 0
+    for row in series:
+        del row["range_unique_users"]
+    return {
+        "property_id": property_id,
+        "from": start,
+        "to": end,
+        "bucket": bucket,
+        "total_views": sum(row["views"] for row in series),
+        "unique_users": unique_users,
+        "series": series,
+    }
+
+def refresh_property_view_stats(conn):
+    """
+    Refreshes the view rollups. The advisory lock makes sure only one worker
+    refreshes at a time, the others skip. Returns False when it was skipped.
+    """
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s);", (VIEW_STATS_REFRESH_LOCK,))
+            if not cursor.fetchone()[0]:
+                return False
+            for rollup in VIEW_STATS_BUCKETS.values():
+                cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {rollup};")
+    return True
+
+INSERT_PROPERTY_VIEW_SQL = """INSERT INTO property_views (user_id, property_id) 
+                VALUES (%s, %s)
+                RETURNING id, user_id, property_id;
+                """
+
+def record_property_view(conn, data):
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(INSERT_PROPERTY_VIEW_SQL, (data.user_id, data.property_id))
             view_record = cursor.fetchone()
     return view_record
 
 
+def record_property_views_bulk(conn, views):
+    """
+    Inserts a batch of buffered views, (user_id, property_id, viewed_at) tuples, with one
+    statement. viewed_at is time zone aware, it's stored in the session's time zone like
+    CURRENT_TIMESTAMP. Views of properties or users that don't exist (anymore) are skipped instead
+    of failing the whole batch. Returns how many rows were inserted.
+    """
+    with conn:
+        with conn.cursor() as cursor:
+            execute_values(
+                cursor,
+                """INSERT INTO property_views (user_id, property_id, created_at)
+                SELECT v.user_id, v.property_id, v.created_at
+                FROM (VALUES %s) AS v(user_id, property_id, created_at)
+                WHERE EXISTS (SELECT 1 FROM properties p WHERE p.id = v.property_id)
+                AND (v.user_id IS NULL OR EXISTS (SELECT 1 FROM users u WHERE u.id = v.user_id));
+                """,
+                views,
+                template="(%s::int, %s::int, %s::timestamptz)",
+                page_size=len(views),
+            )
+            return cursor.rowcount
+
+
 def get_comparison_list_by_id(conn, user_id):
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
@@ -804,6 +1513,70 @@ def get_comparison_list_items(conn, comparison_list_id):
             items = cursor.fetchall()
     return items
 
+# Comparison matrix: every property of a list with its active listing and latest
+# recorded price, and the derived metrics computed by Postgres over the whole set.
+# price is the latest price_history price, or the active listing's start price when
+# the property has no recorded price. The city median is the median price per sqm of
+# the active listings in that city.
+COMPARISON_MATRIX_SQL = f"""
+            WITH items AS (
+                SELECT {PROPERTY_COLUMNS},
+                    al.listing_id, al.listing_type, al.listing_price,
+                    lp.end_price AS latest_price, lp.record_at AS latest_price_at,
+                    COALESCE(lp.end_price, al.listing_price) AS price
+                FROM comparison_list_items i
+                JOIN properties p ON p.id = i.property_id
+                JOIN features f ON p.id = f.property_id
+                JOIN location loc ON p.id = loc.property_id
+                LEFT JOIN LATERAL (
+                    SELECT l.id AS listing_id, l.listing_type, l.start_price AS listing_price
+                    FROM listing_property l
+                    WHERE l.property_id = p.id AND l.listing_status = 'Active'
+                    ORDER BY l.created_at DESC, l.id DESC
+                    LIMIT 1
+                ) al ON TRUE
+                LEFT JOIN LATERAL (
+                    SELECT ph.end_price, ph.record_at
+                    FROM price_history ph
+                    WHERE ph.property_id = p.id
+                    ORDER BY ph.record_at DESC, ph.id DESC
+                    LIMIT 1
+                ) lp ON TRUE
+                WHERE i.comparison_list_id = %s
+            ),
+            city_medians AS (
+                SELECT loc.city,
+                    percentile_cont(0.5) WITHIN GROUP (
+                        ORDER BY l.start_price::numeric / NULLIF(f.size_sqm, 0)
+                    ) AS city_median_price_per_sqm
+                FROM listing_property l
+                JOIN features f ON f.property_id = l.property_id
+                JOIN location loc ON loc.property_id = l.property_id
+                WHERE l.listing_status = 'Active'
+                AND loc.city IN (SELECT city FROM items)
+                GROUP BY loc.city
+            ),
+            metrics AS (
+                SELECT items.*,
+                    ROUND(items.price::numeric / NULLIF(items.size_sqm, 0), 2) AS price_per_sqm,
+                    ROUND(m.city_median_price_per_sqm::numeric, 2) AS city_median_price_per_sqm
+                FROM items
+                LEFT JOIN city_medians m ON m.city = items.city
+            )
+            SELECT *,
+                ROUND((price_per_sqm / NULLIF(city_median_price_per_sqm, 0) - 1) * 100, 1)
+                    AS price_vs_city_median_pct,
+                ROUND(monthly_rent * 12 * 100.0 / NULLIF(price, 0), 2) AS rent_yield_pct
+            FROM metrics
+            ORDER BY id;
+            """
+
+def get_comparison_matrix(conn, comparison_list_id):
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(COMPARISON_MATRIX_SQL, (comparison_list_id,))
+            return cursor.fetchall()
+
 def compare_properties(conn, data):
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cursor:
@@ -831,3 +1604,55 @@ def remove_from_comparison(conn, comparison_list_id, property_id):
             )
             comparison = cursor.fetchone()
     return comparison
+
+
+# Streaming exports. Each query reads the whole table (optionally for one property)
+# in primary key order, the rows are fetched in batches from a server-side cursor.
+EXPORT_BATCH_SIZE = 2000
+
+EXPORT_SQL = {
+    "listings": LISTING_SELECT + """
+                WHERE l.listing_status = 'Active'
+                ORDER BY l.id;
+                """,
+    "bids": """SELECT
+                id, user_id, property_id, bid_amount, created_at
+                FROM bids
+                WHERE %(property_id)s::int IS NULL OR property_id = %(property_id)s
+                ORDER BY id;
+                """,
+    "offers": """SELECT
+                id, user_id, property_id, offer_amount, message, status, created_at
+                FROM offers
+                WHERE %(property_id)s::int IS NULL OR property_id = %(property_id)s
+                ORDER BY id;
+                """,
+    "views": """SELECT
+                id, user_id, property_id, created_at
+                FROM property_views
+                WHERE %(property_id)s::int IS NULL OR property_id = %(property_id)s
+                ORDER BY id;
+                """,
+}
+
+def iter_export(conn, dataset, property_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yields (columns, rows) batches for one of the EXPORT_SQL datasets, rows are tuples.
+    The named cursor keeps the result on the server, so only batch_size rows are in
+    memory at a time however big the export is. The first batch may be empty, it's
+    always yielded so callers get the column names.
+    """
+    with conn:
+        with conn.cursor(name=f"export_{dataset}") as cursor:
+            cursor.execute(EXPORT_SQL[dataset], {"property_id": property_id})
+            rows = cursor.fetchmany(batch_size)
+            columns = [column.name for column in cursor.description]
+            yield columns, rows
+            while rows:
+                rows = cursor.fetchmany(batch_size)
+                if rows:
+                    yield columns, rows
+
+
+# Call counts, latency, rows and errors of every query function above, see metrics.py
+instrument_module(globals(), __name__)
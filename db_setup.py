@@ -1,15 +1,37 @@
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import psycopg2
 from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from psycopg2 import extensions
+
+from metrics import TimedConnection
+from prepared import PREPARED_STATEMENTS
 
 load_dotenv(override=True)
 
+POOL_MIN_SIZE = int(os.getenv("DATABASE_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", "10"))
+POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "5"))
+POOL_MAX_LIFETIME = float(os.getenv("DATABASE_POOL_MAX_LIFETIME", "1800"))
+# Connections idle for longer than this many seconds get a SELECT 1 before they are handed out
+POOL_CHECK_IDLE = float(os.getenv("DATABASE_POOL_CHECK_IDLE", "30"))
+
+# "sync" serves the API from psycopg2 + the threaded pool below, "async" serves the
+# hot endpoints from psycopg 3 + an asyncio pool (see async_db.py / async_routes.py)
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "sync")
+
+
 def get_connection():
     """
-    Function that returns a single connection
-    In reality, we might use a connection pool, since
-    this way we'll start a new connection each time
-    someone hits one of our endpoints, which isn't great for performance
+    Function that returns a single, unpooled connection.
+    Endpoints should not call this directly, they get a pooled connection
+    through the get_db dependency instead. This is still used by scripts
+    (like create_tables) and by the pool itself to open new connections.
     """
     return psycopg2.connect(
         dbname=os.getenv("DATABASE_NAME"),
@@ -17,244 +39,533 @@ def get_connection():
         password=os.getenv("DATABASE_PASSWORD"),
         host=os.getenv("DATABASE_HOST", "localhost"),
         port=os.getenv("DATABASE_PORT", "5432"),
+        # Times every statement for /metrics and the slow query log
+        connection_factory=TimedConnection,
     )
 
 
-def create_tables():
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the pool timeout."""
+
+
+class ConnectionPool:
+    """
+    A small thread-safe connection pool.
+
+    - Keeps between min_size and max_size connections open
+    - getconn() waits up to `timeout` seconds for a free connection, then raises PoolTimeout
+    - putconn() rolls back anything left open and throws away broken connections
+    - Connections older than max_lifetime seconds are closed instead of being reused
+    - getconn() never hands out a closed connection or one with a transaction still
+      open, and pings those idle for longer than check_idle seconds (the server or a
+      firewall may have dropped them meanwhile). Dead ones are replaced
+    """
+
+    def __init__(self, min_size, max_size, timeout, max_lifetime, check_idle=POOL_CHECK_IDLE,
+                 connect=get_connection):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle = check_idle
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._created_at = {}
+        self._idle_since = {}
+        self._size = 0
+        self._closed = False
+        self._counters = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "connections_created": 0,
+            "connections_closed": 0,
+            "resets": 0,
+            "checks": 0,
+            "broken": 0,
+        }
+        for _ in range(min_size):
+            with self._cond:
+                self._size += 1
+            conn = self._new_connection()
+            self._idle_since[id(conn)] = time.monotonic()
+            self._idle.append(conn)
+
+    def _new_connection(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+            self._counters["connections_created"] += 1
+        return conn
+
+    def _expired(self, conn):
+        created_at = self._created_at.get(id(conn), 0)
+        return time.monotonic() - created_at > self.max_lifetime
+
+    def _discard(self, conn):
+        # Must be called while holding self._cond
+        self._created_at.pop(id(conn), None)
+        self._idle_since.pop(id(conn), None)
+        self._size -= 1
+        self._counters["connections_closed"] += 1
+        self._cond.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _alive(self, conn):
+        # Outside the lock, a dead peer can take a while to notice
+        try:
+            with extensions.cursor(conn) as cursor:
+                cursor.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn, idle_for = self._checkout(deadline)
+            if conn is None:
+                return self._new_connection()
+            if idle_for < self.check_idle:
+                return conn
+            with self._cond:
+                self._counters["checks"] += 1
+            if self._alive(conn):
+                return conn
+            with self._cond:
+                self._counters["broken"] += 1
+                self._counters["checkouts"] -= 1
+                self._discard(conn)
+
+    def _checkout(self, deadline):
+        # An idle connection and how long it was idle, or (None, 0) once a slot for a
+        # new connection is reserved
+        with self._cond:
+            waited = False
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                while self._idle:
+                    conn = self._idle.pop()
+                    idle_for = time.monotonic() - self._idle_since.pop(id(conn), 0)
+                    if (conn.closed or self._expired(conn)
+                            or conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE):
+                        self._discard(conn)
+                        continue
+                    self._counters["checkouts"] += 1
+                    return conn, idle_for
+                if self._size < self.max_size:
+                    self._size += 1
+                    self._counters["checkouts"] += 1
+                    return None, 0
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise PoolTimeout(f"No database connection available within {self.timeout} seconds")
+                if not waited:
+                    self._counters["waits"] += 1
+                    waited = True
+                self._cond.wait(remaining)
+
+    def putconn(self, conn):
+        healthy = not conn.closed
+        if healthy and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            # The request left a transaction open (or failed half-way), reset it
+            try:
+                conn.rollback()
+                with self._cond:
+                    self._counters["resets"] += 1
+            except Exception:
+                healthy = False
+        with self._cond:
+            if not healthy or self._closed or self._expired(conn):
+                self._discard(conn)
+                return
+            self._idle_since[id(conn)] = time.monotonic()
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                **self._counters,
+            }
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop())
+            self._cond.notify_all()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process wide connection pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_TIMEOUT, POOL_MAX_LIFETIME)
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def get_db():
     """
-    A function to create the necessary tables for the project. 
+    FastAPI dependency that checks out a pooled connection for the duration
+    of a request and always hands it back, even if the endpoint raises.
     """
-    cursor = None
-    connection = None
+    pool = get_pool()
+    try:
+        conn = pool.getconn()
+    except PoolTimeout as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
     try:
-        connection = get_connection()
-        cursor = connection.cursor()
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS users (
-        id SERIAL PRIMARY KEY,
-        full_name VARCHAR(100) NOT NULL,
-        email VARCHAR(100) UNIQUE NOT NULL, 
-        phone_number VARCHAR(20) UNIQUE NOT NULL,
-        password VARCHAR(100) NOT NULL,
-        role VARCHAR(100) NOT NULL,
-        profile_picture VARCHAR(100),
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS properties (
-        id SERIAL PRIMARY KEY,
-        property_type VARCHAR(100) NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-        
-        cursor.execute("""CREATE TABLE IF NOT EXISTS features (
-        property_id INT PRIMARY KEY REFERENCES properties(id) ON DELETE CASCADE,
-        rooms INT NOT NULL,
-        bathrooms INT NOT NULL,
-        size_sqm INT NOT NULL,
-        floor INT NOT NULL,
-        year_built INT NOT NULL,
-        year_renovated INT,
-        monthly_rent INT NOT NULL,
-        total_floors INT NOT NULL,
-        has_garden BOOLEAN NOT NULL,
-        garden_size_sqm INT,
-        has_elevator BOOLEAN NOT NULL,
-        has_garage BOOLEAN NOT NULL,
-        has_parking BOOLEAN NOT NULL,
-        has_pool BOOLEAN NOT NULL,
-        has_balcony BOOLEAN NOT NULL,
-        energy_class VARCHAR(100) NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS location (
-        property_id INT PRIMARY KEY REFERENCES properties(id) ON DELETE CASCADE,
-        address VARCHAR(100) NOT NULL,
-        city VARCHAR(100) NOT NULL,
-        zip_code VARCHAR(100) NOT NULL,
-        county VARCHAR(100) NOT NULL,
-        state VARCHAR(100),
-        country VARCHAR(100) NOT NULL,
-        latitude DECIMAL (10, 8) NOT NULL,
-        longitude DECIMAL (10, 8) NOT NULL,
-        map_url VARCHAR(100),
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS property_images (
-        id SERIAL PRIMARY KEY,
-        property_id INT REFERENCES properties(id) ON DELETE CASCADE,
-        image_url VARCHAR(100) NOT NULL,
-        image_order INT NOT NULL
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS property_videos (
-        id SERIAL PRIMARY KEY,
-        property_id INT REFERENCES properties(id) ON DELETE CASCADE,
-        video_url VARCHAR(100) NOT NULL,
-        video_order INT NOT NULL
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS agencies (
-        id SERIAL PRIMARY KEY,
-        user_id INT REFERENCES users(id) ON DELETE RESTRICT,
-        organization_number VARCHAR(100) UNIQUE NOT NULL,
-        history TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS brokers (
-        user_id INT PRIMARY KEY REFERENCES users(id) ON DELETE RESTRICT,
-        agency_id INT REFERENCES agencies(id),
-        license_number VARCHAR(100) NOT NULL,
-        years_of_experience INT NOT NULL,
-        bio TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-        
-        cursor.execute("""CREATE TABLE IF NOT EXISTS property_owner(
-        user_id INT REFERENCES users(id) ON DELETE RESTRICT,
-        property_id INT REFERENCES properties(id) ON DELETE CASCADE,
-        registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        PRIMARY KEY (user_id, property_id)
-        )""")
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS listing_property (
-        id SERIAL PRIMARY KEY,
-        property_id INT REFERENCES properties(id) ON DELETE CASCADE,
-        property_owner_id INT REFERENCES users(id),
-        broker_id INT REFERENCES brokers(user_id),
-        title VARCHAR(100) NOT NULL,
-        description TEXT NOT NULL,
-        start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        end_date TIMESTAMP,
-        listing_status VARCHAR(100) DEFAULT 'Active' NOT NULL,
-        listing_type VARCHAR(100) NOT NULL,
-        start_price INT NOT NULL,
-        end_price INT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        CHECK (
-        (property_owner_id IS NOT NULL AND broker_id IS NULL)
-        OR
-        (property_owner_id IS NULL AND broker_id IS NOT NULL)
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+@contextmanager
+def pooled_connection():
+    """
+    Checks out a pooled connection outside of a request, e.g. in background
+    threads: `with pooled_connection() as conn: ...`
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+_async_pool = None
+
+
+async def open_async_pool():
+    """
+    Opens the psycopg 3 asyncio pool used by the async backend.
+    psycopg is imported here so the sync backend doesn't need it installed.
+    """
+    global _async_pool
+    from psycopg.conninfo import make_conninfo
+    from psycopg.rows import dict_row
+    from psycopg_pool import AsyncConnectionPool
+
+    if _async_pool is None:
+        conninfo = make_conninfo(
+            dbname=os.getenv("DATABASE_NAME"),
+            user=os.getenv("DATABASE_USER"),
+            password=os.getenv("DATABASE_PASSWORD"),
+            host=os.getenv("DATABASE_HOST", "localhost"),
+            port=os.getenv("DATABASE_PORT", "5432"),
+        )
+        _async_pool = AsyncConnectionPool(
+            conninfo,
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            timeout=POOL_TIMEOUT,
+            max_lifetime=POOL_MAX_LIFETIME,
+            # psycopg 3 prepares a query once it ran prepare_threshold times on a connection
+            # (5 by default), PREPARED_STATEMENTS=0 turns that off like for the sync backend
+            kwargs={
+                "row_factory": dict_row,
+                "autocommit": True,
+                **({} if PREPARED_STATEMENTS else {"prepare_threshold": None}),
+            },
+            open=False,
         )
-        );
-        """)
-        
-        cursor.execute("""
-        CREATE UNIQUE INDEX IF NOT EXISTS one_active_listing_per_broker_property
-        ON listing_property(property_id, broker_id)
-        WHERE broker_id IS NOT NULL
-        AND listing_status = 'Active';
-        """)
-        
-        cursor.execute("""
-        CREATE UNIQUE INDEX IF NOT EXISTS one_active_listing_per_owner
-        ON listing_property(property_owner_id)
-        WHERE property_owner_id IS NOT NULL
-        AND listing_status = 'Active';
-        """)
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS property_brokers (
-        property_id INT REFERENCES properties(id) ON DELETE CASCADE,
-        broker_id INT REFERENCES brokers(user_id) ON DELETE CASCADE,
-        PRIMARY KEY (property_id, broker_id)
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS property_views(
-        id SERIAL PRIMARY KEY,
-        property_id INT REFERENCES properties(id) ON DELETE CASCADE,
-        user_id INT REFERENCES users(id),
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP        
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS interested_buyers(
-        user_id INT REFERENCES users(id) ON DELETE RESTRICT,
-        property_id INT REFERENCES properties(id) ON DELETE CASCADE,
-        is_contacted BOOLEAN NOT NULL,
-        registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        PRIMARY KEY (user_id, property_id)
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS bids(
-        id SERIAL PRIMARY KEY,
-        property_id INT REFERENCES properties(id) ON DELETE CASCADE,
-        user_id INT REFERENCES users(id) ON DELETE SET NULL,
-        bid_amount INT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS offers(
-        id SERIAL PRIMARY KEY,
-        property_id INT REFERENCES properties(id) ON DELETE CASCADE,
-        user_id INT REFERENCES users(id) ON DELETE SET NULL,
-        offer_amount INT NOT NULL,
-        message VARCHAR(100),
-        status VARCHAR(100) NOT NULL DEFAULT 'Pending',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS price_history(
-        id SERIAL PRIMARY KEY,
-        property_id INT REFERENCES properties(id) ON DELETE CASCADE,
-        end_price INT NOT NULL,
-        record_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS favorites(
-        id SERIAL PRIMARY KEY,
-        property_id INT REFERENCES properties(id) ON DELETE CASCADE,
-        user_id INT REFERENCES users(id) ON DELETE CASCADE,
-        notes VARCHAR(100),
-        is_contacted BOOLEAN NOT NULL,
-        notify_price_change BOOLEAN NOT NULL,
-        notify_status_change BOOLEAN NOT NULL,
-        notify_new_message BOOLEAN NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-        
-        cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_favorites_user_id 
-        ON favorites(user_id);
-        """)
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS notifications(
-        id SERIAL PRIMARY KEY,
-        user_id INT REFERENCES users(id) ON DELETE CASCADE,
-        property_id INT REFERENCES properties(id) ON DELETE CASCADE,
-        favorite_id INT REFERENCES favorites(id) ON DELETE CASCADE,
-        title VARCHAR(50) NOT NULL,
-        message VARCHAR(100) NOT NULL,
-        is_read BOOLEAN NOT NULL DEFAULT FALSE,
-        type VARCHAR(50) NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS comparison_lists(
-        id SERIAL PRIMARY KEY,
-        user_id INT REFERENCES users(id) ON DELETE CASCADE,
-        name VARCHAR(100) NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-
-        cursor.execute("""CREATE TABLE IF NOT EXISTS comparison_list_items(
-        comparison_list_id INT REFERENCES comparison_lists(id) ON DELETE CASCADE,
-        property_id INT REFERENCES properties(id) ON DELETE CASCADE,
-        PRIMARY KEY (comparison_list_id, property_id)
-        )""")
-
-
-
-        connection.commit()
-    except Exception as e:
-        print(f"An error occurred: {e}")
+        await _async_pool.open()
+    return _async_pool
+
+
+async def close_async_pool():
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
+
+def get_async_pool():
+    return _async_pool
+
+
+async def get_async_db():
+    """
+    Async counterpart of get_db, yields a psycopg 3 AsyncConnection.
+    Connections are in autocommit mode so single reads don't pay for a
+    BEGIN/COMMIT round trip, writes open their own transaction in async_db.py.
+    """
+    from psycopg_pool import PoolTimeout as AsyncPoolTimeout
+
+    pool = await open_async_pool()
+    try:
+        conn = await pool.getconn()
+    except AsyncPoolTimeout as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    try:
+        yield conn
     finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
+        await pool.putconn(conn)
+
+
+def create_baseline_schema(cursor):
+    """
+    Migration 1 (see migrations.py): the tables as they were before versioned
+    migrations, frozen. Every statement is idempotent, so it also runs cleanly on
+    databases that were set up with the old create_tables. Later schema changes
+    are migrations of their own.
+    """
+    cursor.execute("""CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    full_name VARCHAR(100) NOT NULL,
+    email VARCHAR(100) UNIQUE NOT NULL, 
+    phone_number VARCHAR(20) UNIQUE NOT NULL,
+    password VARCHAR(100) NOT NULL,
+    role VARCHAR(100) NOT NULL,
+    profile_picture VARCHAR(100),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS properties (
+    id SERIAL PRIMARY KEY,
+    property_type VARCHAR(100) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+    
+    cursor.execute("""CREATE TABLE IF NOT EXISTS features (
+    property_id INT PRIMARY KEY REFERENCES properties(id) ON DELETE CASCADE,
+    rooms INT NOT NULL,
+    bathrooms INT NOT NULL,
+    size_sqm INT NOT NULL,
+    floor INT NOT NULL,
+    year_built INT NOT NULL,
+    year_renovated INT,
+    monthly_rent INT NOT NULL,
+    total_floors INT NOT NULL,
+    has_garden BOOLEAN NOT NULL,
+    garden_size_sqm INT,
+    has_elevator BOOLEAN NOT NULL,
+    has_garage BOOLEAN NOT NULL,
+    has_parking BOOLEAN NOT NULL,
+    has_pool BOOLEAN NOT NULL,
+    has_balcony BOOLEAN NOT NULL,
+    energy_class VARCHAR(100) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS location (
+    property_id INT PRIMARY KEY REFERENCES properties(id) ON DELETE CASCADE,
+    address VARCHAR(100) NOT NULL,
+    city VARCHAR(100) NOT NULL,
+    zip_code VARCHAR(100) NOT NULL,
+    county VARCHAR(100) NOT NULL,
+    state VARCHAR(100),
+    country VARCHAR(100) NOT NULL,
+    latitude DECIMAL (10, 8) NOT NULL,
+    longitude DECIMAL (10, 8) NOT NULL,
+    map_url VARCHAR(100),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS property_images (
+    id SERIAL PRIMARY KEY,
+    property_id INT REFERENCES properties(id) ON DELETE CASCADE,
+    image_url VARCHAR(100) NOT NULL,
+    image_order INT NOT NULL
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS property_videos (
+    id SERIAL PRIMARY KEY,
+    property_id INT REFERENCES properties(id) ON DELETE CASCADE,
+    video_url VARCHAR(100) NOT NULL,
+    video_order INT NOT NULL
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS agencies (
+    id SERIAL PRIMARY KEY,
+    user_id INT REFERENCES users(id) ON DELETE RESTRICT,
+    organization_number VARCHAR(100) UNIQUE NOT NULL,
+    history TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS brokers (
+    user_id INT PRIMARY KEY REFERENCES users(id) ON DELETE RESTRICT,
+    agency_id INT REFERENCES agencies(id),
+    license_number VARCHAR(100) NOT NULL,
+    years_of_experience INT NOT NULL,
+    bio TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+    
+    cursor.execute("""CREATE TABLE IF NOT EXISTS property_owner(
+    user_id INT REFERENCES users(id) ON DELETE RESTRICT,
+    property_id INT REFERENCES properties(id) ON DELETE CASCADE,
+    registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, property_id)
+    )""")
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS listing_property (
+    id SERIAL PRIMARY KEY,
+    property_id INT REFERENCES properties(id) ON DELETE CASCADE,
+    property_owner_id INT REFERENCES users(id),
+    broker_id INT REFERENCES brokers(user_id),
+    title VARCHAR(100) NOT NULL,
+    description TEXT NOT NULL,
+    start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    end_date TIMESTAMP,
+    listing_status VARCHAR(100) DEFAULT 'Active' NOT NULL,
+    listing_type VARCHAR(100) NOT NULL,
+    start_price INT NOT NULL,
+    end_price INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CHECK (
+    (property_owner_id IS NOT NULL AND broker_id IS NULL)
+    OR
+    (property_owner_id IS NULL AND broker_id IS NOT NULL)
+    )
+    );
+    """)
+    
+    cursor.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS one_active_listing_per_broker_property
+    ON listing_property(property_id, broker_id)
+    WHERE broker_id IS NOT NULL
+    AND listing_status = 'Active';
+    """)
+    
+    cursor.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS one_active_listing_per_owner
+    ON listing_property(property_owner_id)
+    WHERE property_owner_id IS NOT NULL
+    AND listing_status = 'Active';
+    """)
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS property_brokers (
+    property_id INT REFERENCES properties(id) ON DELETE CASCADE,
+    broker_id INT REFERENCES brokers(user_id) ON DELETE CASCADE,
+    PRIMARY KEY (property_id, broker_id)
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS property_views(
+    id SERIAL PRIMARY KEY,
+    property_id INT REFERENCES properties(id) ON DELETE CASCADE,
+    user_id INT REFERENCES users(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP        
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS interested_buyers(
+    user_id INT REFERENCES users(id) ON DELETE RESTRICT,
+    property_id INT REFERENCES properties(id) ON DELETE CASCADE,
+    is_contacted BOOLEAN NOT NULL,
+    registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, property_id)
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS bids(
+    id SERIAL PRIMARY KEY,
+    property_id INT REFERENCES properties(id) ON DELETE CASCADE,
+    user_id INT REFERENCES users(id) ON DELETE SET NULL,
+    bid_amount INT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS offers(
+    id SERIAL PRIMARY KEY,
+    property_id INT REFERENCES properties(id) ON DELETE CASCADE,
+    user_id INT REFERENCES users(id) ON DELETE SET NULL,
+    offer_amount INT NOT NULL,
+    message VARCHAR(100),
+    status VARCHAR(100) NOT NULL DEFAULT 'Pending',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS price_history(
+    id SERIAL PRIMARY KEY,
+    property_id INT REFERENCES properties(id) ON DELETE CASCADE,
+    end_price INT NOT NULL,
+    record_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS favorites(
+    id SERIAL PRIMARY KEY,
+    property_id INT REFERENCES properties(id) ON DELETE CASCADE,
+    user_id INT REFERENCES users(id) ON DELETE CASCADE,
+    notes VARCHAR(100),
+    is_contacted BOOLEAN NOT NULL,
+    notify_price_change BOOLEAN NOT NULL,
+    notify_status_change BOOLEAN NOT NULL,
+    notify_new_message BOOLEAN NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+    
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_favorites_user_id 
+    ON favorites(user_id);
+    """)
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS notifications(
+    id SERIAL PRIMARY KEY,
+    user_id INT REFERENCES users(id) ON DELETE CASCADE,
+    property_id INT REFERENCES properties(id) ON DELETE CASCADE,
+    favorite_id INT REFERENCES favorites(id) ON DELETE CASCADE,
+    title VARCHAR(50) NOT NULL,
+    message VARCHAR(100) NOT NULL,
+    is_read BOOLEAN NOT NULL DEFAULT FALSE,
+    type VARCHAR(50) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS comparison_lists(
+    id SERIAL PRIMARY KEY,
+    user_id INT REFERENCES users(id) ON DELETE CASCADE,
+    name VARCHAR(100) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    cursor.execute("""CREATE TABLE IF NOT EXISTS comparison_list_items(
+    comparison_list_id INT REFERENCES comparison_lists(id) ON DELETE CASCADE,
+    property_id INT REFERENCES properties(id) ON DELETE CASCADE,
+    PRIMARY KEY (comparison_list_id, property_id)
+    )""")
+
+
+def create_tables():
+    """
+    A function to create the necessary tables for the project, by applying
+    all pending migrations.
+    """
+    from migrations import migrate
+    migrate()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,83 @@
+import csv
+import io
+import itertools
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+
+from db import iter_export
+from db_setup import PoolTimeout, pooled_connection
+
+"""
+Streaming NDJSON / CSV exports of listings, bids, offers and views.
+
+    GET /export/bids/?format=csv&property_id=12
+
+- Rows come from a server-side cursor in batches (db.iter_export) and are written out
+  as they arrive, so memory stays flat however many rows there are
+- The pooled connection is checked out inside the generator, not through get_db, so
+  its lifetime is exactly the stream's: it's held until the last row is written and
+  released when the generator finishes or is closed
+- The stream is run up to its first chunk before the response starts, so a pool
+  timeout (503) or a failing query (500) is still a proper error status instead of
+  a 200 download that is cut short
+- If the client goes away the generator is closed, the transaction is rolled back
+  and the connection goes back to the pool
+"""
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def _ndjson_chunks(batches):
+    for columns, rows in batches:
+        if rows:
+            yield "".join(json.dumps(dict(zip(columns, row)), default=_json_default) + "\n" for row in rows)
+
+
+def _csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_written = False
+    for columns, rows in batches:
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def stream_export(dataset, file_format, property_id=None):
+    with pooled_connection() as conn:
+        batches = iter_export(conn, dataset, property_id)
+        chunks = _csv_chunks(batches) if file_format == "csv" else _ndjson_chunks(batches)
+        yield from chunks
+
+
+def export_response(dataset, file_format, property_id=None):
+    filename = dataset if property_id is None else f"{dataset}_{property_id}"
+    chunks = stream_export(dataset, file_format, property_id)
+    try:
+        first = next(chunks, None)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    return StreamingResponse(
+        itertools.chain([] if first is None else [first], chunks),
+        media_type=MEDIA_TYPES[file_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{file_format}"'},
+    )
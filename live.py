@@ -0,0 +1,204 @@
+import asyncio
+import json
+import logging
+import os
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from pg_listener import get_listener
+
+"""
+Live push of new bids, offers and notifications as Server-Sent Events.
+
+- Triggers on bids / offers NOTIFY the live_events channel on every insert. The
+  notifications trigger runs once per statement and sends notification_batch events
+  of up to 150 recipients, so a fan-out to thousands of followers is a handful of
+  NOTIFYs (migrations 12 and 15). Here batches are turned back into one notification
+  event per subscribed recipient
+- Each worker LISTENs once, on the shared pg_listener connection, and fans the events
+  out to its own subscribers: bids and offers go to the property's subscribers,
+  notifications to the user's
+- Every subscriber has a bounded queue. A client that doesn't keep up and lets its
+  queue fill is disconnected, so one slow client can't make the worker buffer events
+  without limit. Clients reconnect and refetch through the REST endpoints
+- Events sent while the listener was reconnecting are lost, subscribers get a
+  "resync" event so they know to refetch
+"""
+
+logger = logging.getLogger(__name__)
+
+LIVE_CHANNEL = "live_events"
+
+# Events buffered per client before it counts as too slow and gets disconnected
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "100"))
+# Seconds between keep-alive comments on an idle stream
+LIVE_HEARTBEAT = float(os.getenv("LIVE_HEARTBEAT", "15"))
+LIVE_MAX_CONNECTIONS = int(os.getenv("LIVE_MAX_CONNECTIONS", "1000"))
+
+# Which subscribers an event is for
+EVENT_TOPICS = {
+    "bid": ("property", "property_id"),
+    "offer": ("property", "property_id"),
+    "notification": ("user", "user_id"),
+}
+
+# Queued to tell a stream it has been closed
+_CLOSED = object()
+
+
+class Subscriber:
+    def __init__(self, topic):
+        self.topic = topic
+        self.queue = asyncio.Queue(maxsize=LIVE_QUEUE_SIZE)
+        self.closed = False
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        # Make room for the close marker, whatever was still queued isn't sent anymore
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSED)
+
+
+class LiveHub:
+    def __init__(self, max_connections=LIVE_MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self._loop = None
+        self._subscribers = {}
+        self._started = False
+        self._counters = {
+            "connections_total": 0,
+            "rejected_connections": 0,
+            "events_received": 0,
+            "events_delivered": 0,
+            "slow_consumer_disconnects": 0,
+        }
+
+    def start(self, loop):
+        """Called from the app's lifespan, loop is the event loop the streams run on."""
+        self._loop = loop
+        if self._started:
+            return
+        self._started = True
+        listener = get_listener()
+        listener.subscribe(LIVE_CHANNEL, self._on_notify)
+        listener.on_reconnect(self._on_reconnect)
+        listener.start()
+
+    def stop(self):
+        for subscribers in list(self._subscribers.values()):
+            for subscriber in list(subscribers):
+                subscriber.close()
+
+    @property
+    def connections(self):
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def subscribe(self, kind, key):
+        if self.connections >= self.max_connections:
+            self._counters["rejected_connections"] += 1
+            raise HTTPException(status_code=503, detail="Too many live connections")
+        subscriber = Subscriber((kind, key))
+        self._subscribers.setdefault(subscriber.topic, set()).add(subscriber)
+        self._counters["connections_total"] += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.closed = True
+        subscribers = self._subscribers.get(subscriber.topic)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.topic]
+
+    # Listener thread -> event loop
+    def _on_notify(self, payload):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._publish, json.loads(payload))
+
+    def _on_reconnect(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._broadcast, {"type": "resync", "data": {}})
+
+    def _publish(self, event):
+        self._counters["events_received"] += 1
+        if event["type"] == "notification_batch":
+            self._publish_notification_batch(event["data"])
+            return
+        kind, field = EVENT_TOPICS[event["type"]]
+        key = event["data"].get(field)
+        for subscriber in list(self._subscribers.get((kind, key), ())):
+            self._deliver(subscriber, event)
+
+    def _publish_notification_batch(self, data):
+        recipients = data.pop("recipients")
+        for notification_id, user_id, favorite_id in recipients:
+            subscribers = self._subscribers.get(("user", user_id))
+            if not subscribers:
+                continue
+            event = {"type": "notification", "data": {
+                **data, "id": notification_id, "user_id": user_id, "favorite_id": favorite_id, "is_read": False,
+            }}
+            for subscriber in list(subscribers):
+                self._deliver(subscriber, event)
+
+    def _broadcast(self, event):
+        for subscribers in list(self._subscribers.values()):
+            for subscriber in list(subscribers):
+                self._deliver(subscriber, event)
+
+    def _deliver(self, subscriber, event):
+        if subscriber.closed:
+            return
+        try:
+            subscriber.queue.put_nowait(event)
+            self._counters["events_delivered"] += 1
+        except asyncio.QueueFull:
+            self._counters["slow_consumer_disconnects"] += 1
+            subscriber.close()
+            self.unsubscribe(subscriber)
+
+    async def stream(self, subscriber):
+        """SSE body for one subscriber, ends when the client disconnects or is dropped."""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), LIVE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event is _CLOSED:
+                    return
+                yield f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        by_kind = {}
+        for (kind, _key), subscribers in self._subscribers.items():
+            by_kind[kind] = by_kind.get(kind, 0) + len(subscribers)
+        return {
+            "connections": self.connections,
+            "connections_by_kind": by_kind,
+            "topics": len(self._subscribers),
+            "max_connections": self.max_connections,
+            "queue_size": LIVE_QUEUE_SIZE,
+            **self._counters,
+        }
+
+
+live_hub = LiveHub()
+
+
+def event_stream_response(kind, key):
+    subscriber = live_hub.subscribe(kind, key)
+    return StreamingResponse(
+        live_hub.stream(subscriber),
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,314 @@
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+
+from psycopg2 import extensions
+
+"""
+In-process metrics in the Prometheus text format, served on GET /metrics.
+
+- Every query function in db.py and async_db.py (public functions taking `conn` first)
+  is wrapped by instrument_module(): call count, latency histogram, rows returned
+  and errors, labelled by module and function
+- RequestMetricsMiddleware records the latency of every request per route template,
+  method and status, measured until the response headers are sent (so long-lived
+  streams like /live/* and /export/* don't skew it)
+- Connections opened by db_setup.get_connection use TimedConnection: every statement
+  is timed and those slower than SLOW_QUERY_MS are logged on the "slow_query" logger
+  with the SQL and the shape (not the values) of its parameters. SLOW_QUERY_EXPLAIN=1
+  adds the plan of slow SELECTs. It is a plain EXPLAIN, without ANALYZE, so the query
+  is not run again: a SELECT can have side effects too (pg_notify, nextval, advisory
+  locks) and it would run inside the caller's transaction.
+  SLOW_QUERY_EXPLAIN_ANALYZE=1 makes it an EXPLAIN (ANALYZE, BUFFERS), which does run
+  the query again, in a savepoint that is rolled back afterwards. That undoes its
+  writes and notifications, but not nextval() or session advisory locks, so only turn
+  it on while investigating
+
+Metrics are per worker process, like the caches.
+"""
+
+logger = logging.getLogger("slow_query")
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# 0 turns the slow query log off
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "0") == "1"
+SLOW_QUERY_EXPLAIN_ANALYZE = os.getenv("SLOW_QUERY_EXPLAIN_ANALYZE", "0") == "1"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [count per bucket..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, values in self._values.items():
+                for bound, count in zip(self.buckets, values):
+                    samples.append((f"{self.name}_bucket", key + (("le", repr(float(bound))),), count))
+                samples.append((f"{self.name}_bucket", key + (("le", "+Inf"),), values[-1]))
+                samples.append((f"{self.name}_sum", key, values[-2]))
+                samples.append((f"{self.name}_count", key, values[-1]))
+        return samples
+
+
+def _format_labels(metric, key):
+    pairs = []
+    for i, value in enumerate(key):
+        name, value = value if isinstance(value, tuple) else (metric.labelnames[i], value)
+        escaped = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, value in metric.samples():
+            lines.append(f"{name}{_format_labels(metric, key)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+DB_CALLS = Counter("db_query_calls_total", "Calls of db query functions", ("module", "function"))
+DB_ERRORS = Counter("db_query_errors_total", "db query functions that raised", ("module", "function", "error"))
+DB_ROWS = Counter("db_query_rows_total", "Rows returned by db query functions", ("module", "function"))
+DB_LATENCY = Histogram("db_query_duration_seconds", "Latency of db query functions", ("module", "function"))
+DB_STATEMENTS = Histogram("db_statement_duration_seconds", "Latency of single SQL statements")
+SLOW_QUERIES = Counter("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS")
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Request latency until the response starts", ("method", "route", "status"))
+
+
+# db.py / async_db.py functions
+def _row_count(result):
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    if isinstance(result, dict):
+        return 1
+    return None
+
+
+def _observe_call(module, function, started, result=None, error=None):
+    DB_CALLS.inc(module=module, function=function)
+    DB_LATENCY.observe(time.perf_counter() - started, module=module, function=function)
+    if error is not None:
+        DB_ERRORS.inc(module=module, function=function, error=type(error).__name__)
+        return
+    rows = _row_count(result)
+    if rows:
+        DB_ROWS.inc(rows, module=module, function=function)
+
+
+def instrument(func, module):
+    name = func.__name__
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                _observe_call(module, name, started, error=e)
+                raise
+            _observe_call(module, name, started, result)
+            return result
+    elif inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                yield from func(*args, **kwargs)
+            except Exception as e:
+                _observe_call(module, name, started, error=e)
+                raise
+            _observe_call(module, name, started)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                _observe_call(module, name, started, error=e)
+                raise
+            _observe_call(module, name, started, result)
+            return result
+    return wrapper
+
+
+def instrument_module(namespace, module):
+    """
+    Wraps the query functions of a module in place, call it at the very end of the module:
+    instrument_module(globals(), __name__). Query functions are the public functions
+    defined in the module whose first parameter is `conn`.
+    """
+    if not METRICS_ENABLED:
+        return
+    for name, func in list(namespace.items()):
+        if name.startswith("_") or not inspect.isfunction(func) or func.__module__ != module:
+            continue
+        parameters = list(inspect.signature(func).parameters)
+        if parameters and parameters[0] == "conn":
+            namespace[name] = instrument(func, module)
+
+
+# Statement timing and the slow query log
+def _param_shape(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: _param_shape_value(value) for key, value in params.items()}
+    return [_param_shape_value(value) for value in params]
+
+
+def _param_shape_value(value):
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def _explain(conn, sql, params):
+    # In a savepoint (a transaction of its own on an autocommit connection) that is
+    # always rolled back: a failing EXPLAIN doesn't abort the caller's transaction and
+    # whatever ANALYZE changed is undone
+    options = "(ANALYZE, BUFFERS) " if SLOW_QUERY_EXPLAIN_ANALYZE else ""
+    if conn.autocommit:
+        begin, rollback = "BEGIN;", "ROLLBACK;"
+    else:
+        begin, rollback = "SAVEPOINT slow_query_explain;", "ROLLBACK TO SAVEPOINT slow_query_explain;"
+    # A plain cursor, so the EXPLAIN isn't timed (and logged) itself
+    with extensions.cursor(conn) as explain:
+        explain.execute(begin)
+        try:
+            explain.execute(f"EXPLAIN {options}{sql}", params)
+            plan = "\n" + "\n".join(row[0] for row in explain.fetchall())
+        except Exception as e:
+            plan = f"\n(EXPLAIN failed: {e})"
+        explain.execute(rollback)
+        if not conn.autocommit:
+            explain.execute("RELEASE SAVEPOINT slow_query_explain;")
+    return plan
+
+
+def _log_slow_query(cursor, query, params, elapsed):
+    SLOW_QUERIES.inc()
+    sql = query.decode() if isinstance(query, bytes) else str(query)
+    sql = " ".join(sql.split())
+    plan = ""
+    if SLOW_QUERY_EXPLAIN and cursor.name is None and sql.upper().startswith("SELECT"):
+        plan = _explain(cursor.connection, sql, params)
+    logger.warning("Slow query (%.1f ms): %s params=%s%s", elapsed * 1000, sql, _param_shape(params), plan)
+
+
+class TimedCursorMixin:
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        result = super().execute(query, vars)
+        elapsed = time.perf_counter() - started
+        DB_STATEMENTS.observe(elapsed)
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            _log_slow_query(self, query, vars, elapsed)
+        return result
+
+
+@functools.lru_cache(maxsize=None)
+def _timed_cursor_class(cursor_class):
+    return type(f"Timed{cursor_class.__name__}", (TimedCursorMixin, cursor_class), {})
+
+
+class TimedConnection(extensions.connection):
+    """psycopg2 connection whose cursors, whatever their cursor_factory, time their statements."""
+
+    def cursor(self, *args, **kwargs):
+        cursor_class = kwargs.get("cursor_factory") or self.cursor_factory or extensions.cursor
+        kwargs["cursor_factory"] = _timed_cursor_class(cursor_class)
+        return super().cursor(*args, **kwargs)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware recording request latency per route template (not per URL)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status):
+            nonlocal recorded
+            recorded = True
+            route = scope.get("route")
+            HTTP_LATENCY.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=route.path if route is not None else "unmatched",
+                status=status,
+            )
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        except Exception:
+            if not recorded:
+                record(500)
+            raise
@@ -0,0 +1,655 @@
+import argparse
+from collections import namedtuple
+
+from db_setup import create_baseline_schema, get_connection
+
+"""
+Versioned schema migrations.
+
+    python migrations.py           # apply everything that is pending
+    python migrations.py --list    # show which versions are applied
+
+- Applied versions are recorded in the schema_version table, each migration runs once
+- Migrations are applied in version order. Add new ones at the end of MIGRATIONS,
+  never edit one that has already shipped
+- transactional=True migrations run in a single transaction together with their
+  schema_version row, so they either apply completely or not at all
+- transactional=False migrations run in autocommit mode. That's what CREATE INDEX
+  CONCURRENTLY needs: it builds the index without blocking writes to the table, but
+  can't run inside a transaction. Use create_index_concurrently() for those, it also
+  cleans up the invalid index a failed concurrent build leaves behind
+- A transactional=False migration that fails halfway runs again from the start, so
+  every statement in it has to be idempotent. Backfill existing rows with
+  update_in_batches() (one commit per batch) and add constraints with
+  add_constraint_not_valid(), so writes aren't locked out for a whole table scan
+- Errors are raised, not printed: a failed migration stops the run and isn't recorded
+- A session advisory lock makes concurrent runs (several deploying workers) wait
+  for each other instead of applying the same migration twice
+"""
+
+Migration = namedtuple("Migration", ["version", "name", "apply", "transactional"])
+
+# Any constant works, it only has to be the same for every process running migrations
+MIGRATION_LOCK = 7_001_002
+
+# Rows per committed batch when a migration backfills a column
+BACKFILL_BATCH_SIZE = 1000
+
+# Recipients per notification_batch live event, [id, user_id, favorite_id] each
+LIVE_BATCH_RECIPIENTS = 150
+
+
+def create_index_concurrently(cursor, name, definition):
+    """
+    CREATE INDEX CONCURRENTLY name ON definition, without locking out writes.
+    Must run in autocommit mode (a transactional=False migration).
+    """
+    cursor.execute(
+        """SELECT i.indisvalid FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND pg_table_is_visible(c.oid);
+        """,
+        (name,)
+    )
+    row = cursor.fetchone()
+    if row is not None and not row[0]:
+        # Left behind by an interrupted concurrent build, IF NOT EXISTS would keep it as is
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+    cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition};")
+
+
+def foreign_key_indexes(cursor):
+    # property_views.property_id and notifications.user_id lead the (property_id, created_at)
+    # and (user_id, created_at, id) indexes of migrations 10 and 13
+    create_index_concurrently(cursor, "idx_bids_property_id_bid_amount", "bids(property_id, bid_amount DESC, id)")
+    create_index_concurrently(cursor, "idx_offers_property_id", "offers(property_id)")
+    create_index_concurrently(cursor, "idx_price_history_property_id_record_at", "price_history(property_id, record_at)")
+    create_index_concurrently(cursor, "idx_listing_property_property_id", "listing_property(property_id)")
+
+
+def favorites_feed_index(cursor):
+    # Keyset pages of the favorites feed, (user_id) alone is a prefix of it
+    create_index_concurrently(cursor, "idx_favorites_user_id_created_at_id", "favorites(user_id, created_at, id)")
+    cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_favorites_user_id;")
+
+
+def market_stats_tables(cursor):
+    # Price statistics per city / zip code / property type, see analytics.py.
+    # '' in zip_code or property_type is the rollup over all of them.
+    cursor.execute("""CREATE TABLE IF NOT EXISTS market_stats(
+    city VARCHAR(100) NOT NULL,
+    zip_code VARCHAR(100) NOT NULL,
+    property_type VARCHAR(100) NOT NULL,
+    listings INT NOT NULL,
+    median_price INT,
+    avg_price_per_sqm NUMERIC(12, 2),
+    min_price_per_sqm NUMERIC(12, 2),
+    p10_price_per_sqm NUMERIC(12, 2),
+    p25_price_per_sqm NUMERIC(12, 2),
+    median_price_per_sqm NUMERIC(12, 2),
+    p75_price_per_sqm NUMERIC(12, 2),
+    p90_price_per_sqm NUMERIC(12, 2),
+    max_price_per_sqm NUMERIC(12, 2),
+    price_changes_30d INT NOT NULL,
+    median_price_change_30d_pct NUMERIC(8, 2),
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (city, zip_code, property_type)
+    )""")
+
+    # Cities whose statistics are out of date, filled by the triggers below
+    cursor.execute("""CREATE TABLE IF NOT EXISTS market_stats_dirty(
+    city VARCHAR(100) PRIMARY KEY,
+    marked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION mark_market_stats_dirty() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO market_stats_dirty (city)
+        SELECT city FROM location WHERE property_id = NEW.property_id
+        ON CONFLICT (city) DO NOTHING;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cursor.execute("""
+    DROP TRIGGER IF EXISTS price_history_market_stats ON price_history;
+    CREATE TRIGGER price_history_market_stats
+    AFTER INSERT ON price_history
+    FOR EACH ROW EXECUTE FUNCTION mark_market_stats_dirty();
+    """)
+    cursor.execute("""
+    DROP TRIGGER IF EXISTS listing_property_market_stats ON listing_property;
+    CREATE TRIGGER listing_property_market_stats
+    AFTER INSERT OR UPDATE OF listing_status, start_price ON listing_property
+    FOR EACH ROW EXECUTE FUNCTION mark_market_stats_dirty();
+    """)
+
+    # Everything is computed on the first refresh
+    cursor.execute("""
+    INSERT INTO market_stats_dirty (city)
+    SELECT DISTINCT city FROM location
+    ON CONFLICT (city) DO NOTHING;
+    """)
+
+
+def update_in_batches(cursor, table, sql, batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Runs an UPDATE (sql, with %(first_id)s and %(last_id)s bounds) over consecutive
+    id ranges of `table`. In a transactional=False migration every batch commits on
+    its own, so the rows are only locked for one batch at a time.
+    """
+    last_id = 0
+    while True:
+        cursor.execute(
+            f"SELECT MAX(id) FROM (SELECT id FROM {table} WHERE id > %s ORDER BY id LIMIT %s) batch;",
+            (last_id, batch_size)
+        )
+        upper = cursor.fetchone()[0]
+        if upper is None:
+            return
+        cursor.execute(sql, {"first_id": last_id, "last_id": upper})
+        last_id = upper
+
+
+def add_constraint_not_valid(cursor, table, name, definition):
+    """
+    Adds a constraint without checking the existing rows (a short lock), then validates
+    them with VALIDATE CONSTRAINT, which doesn't block writes.
+    """
+    cursor.execute("SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND conname = %s;", (table, name))
+    if cursor.fetchone() is None:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition} NOT VALID;")
+    cursor.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name};")
+
+
+# Migrations 5 to 13 are the schema changes that used to be part of the baseline.
+# They only need the baseline tables, so they run after 2 to 4 on a new database, and
+# every statement is idempotent for databases that got them with an older migration 1.
+def keyset_pagination_indexes(cursor):
+    create_index_concurrently(cursor, "idx_users_created_at_id", "users(created_at, id)")
+    create_index_concurrently(cursor, "idx_properties_created_at_id", "properties(created_at, id)")
+    # Active listings, newest first
+    create_index_concurrently(
+        cursor, "idx_listing_property_active_created_at_id",
+        "listing_property(created_at, id) WHERE listing_status = 'Active'")
+
+
+def property_media_indexes(cursor):
+    # Lets get_properties / get_property_by_id read each property's media in order straight from the index
+    create_index_concurrently(cursor, "idx_property_images_property_id_order", "property_images(property_id, image_order)")
+    create_index_concurrently(cursor, "idx_property_videos_property_id_order", "property_videos(property_id, video_order)")
+
+
+def listing_search_indexes(cursor):
+    # Listing search (see db.search_listings): price range / price sort, optionally per listing type
+    create_index_concurrently(cursor, "idx_properties_property_type", "properties(property_type)")
+    create_index_concurrently(cursor, "idx_features_rooms_bathrooms", "features(rooms, bathrooms)")
+    create_index_concurrently(cursor, "idx_location_city", "location(city)")
+    create_index_concurrently(
+        cursor, "idx_listing_property_active_price",
+        "listing_property(start_price, id) WHERE listing_status = 'Active'")
+    create_index_concurrently(
+        cursor, "idx_listing_property_active_type_price",
+        "listing_property(listing_type, start_price, id) WHERE listing_status = 'Active'")
+    create_index_concurrently(
+        cursor, "idx_listing_property_active_type_created_at",
+        "listing_property(listing_type, created_at, id) WHERE listing_status = 'Active'")
+
+
+def geo_search(cursor):
+    # Great-circle (haversine) distance in meters between two coordinates
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION distance_m(lat1 float8, lon1 float8, lat2 float8, lon2 float8)
+    RETURNS float8
+    LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+    AS $$
+        SELECT 2 * 6371008.8 * asin(sqrt(
+            power(sin(radians(lat2 - lat1) / 2), 2)
+            + cos(radians(lat1)) * cos(radians(lat2)) * power(sin(radians(lon2 - lon1) / 2), 2)
+        ))
+    $$;
+    """)
+    # Geo search (see db.get_listings_nearby): a GiST index on the coordinates as a
+    # built-in point answers bounding box (<@) and nearest-first (<->) queries
+    # without needing the cube/earthdistance extensions
+    create_index_concurrently(cursor, "idx_location_point", "location USING gist (point(longitude::float8, latitude::float8))")
+
+
+def listing_full_text_search(cursor):
+    # Full-text search (see db.search_listings_text). search_vector is kept up to date
+    # by triggers: title weighs most, then the description, then city and address
+    # from location, so it has to be refreshed when either table changes.
+    cursor.execute("ALTER TABLE listing_property ADD COLUMN IF NOT EXISTS search_vector tsvector;")
+
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION listing_search_vector(title TEXT, description TEXT, listing_property_id INT)
+    RETURNS tsvector
+    LANGUAGE sql STABLE
+    AS $$
+        SELECT setweight(to_tsvector('english', coalesce(title, '')), 'A')
+            || setweight(to_tsvector('english', coalesce(description, '')), 'B')
+            || setweight(to_tsvector('english', coalesce(
+                (SELECT loc.city || ' ' || loc.address FROM location loc WHERE loc.property_id = listing_property_id),
+                '')), 'C')
+    $$;
+    """)
+
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION listing_property_search_vector_trigger()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+        NEW.search_vector := listing_search_vector(NEW.title, NEW.description, NEW.property_id);
+        RETURN NEW;
+    END
+    $$;
+    """)
+
+    cursor.execute("""
+    DROP TRIGGER IF EXISTS listing_property_search_vector ON listing_property;
+    CREATE TRIGGER listing_property_search_vector
+    BEFORE INSERT OR UPDATE OF title, description, property_id ON listing_property
+    FOR EACH ROW EXECUTE FUNCTION listing_property_search_vector_trigger();
+    """)
+
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION location_search_vector_trigger()
+    RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+    BEGIN
+        UPDATE listing_property
+        SET search_vector = listing_search_vector(title, description, property_id)
+        WHERE property_id = NEW.property_id;
+        RETURN NULL;
+    END
+    $$;
+    """)
+
+    cursor.execute("""
+    DROP TRIGGER IF EXISTS location_search_vector ON location;
+    CREATE TRIGGER location_search_vector
+    AFTER INSERT OR UPDATE OF city, address ON location
+    FOR EACH ROW EXECUTE FUNCTION location_search_vector_trigger();
+    """)
+
+    # Listings created before the column existed, new ones are covered by the trigger
+    update_in_batches(cursor, "listing_property", """
+    UPDATE listing_property
+    SET search_vector = listing_search_vector(title, description, property_id)
+    WHERE id > %(first_id)s AND id <= %(last_id)s
+    AND search_vector IS NULL;
+    """)
+
+    create_index_concurrently(cursor, "idx_listing_property_search_vector", "listing_property USING gin (search_vector)")
+
+
+def property_view_rollups(cursor):
+    # Covers view stats over any date range (user_id included for unique viewer counts)
+    create_index_concurrently(
+        cursor, "idx_property_views_property_id_created_at",
+        "property_views(property_id, created_at) INCLUDE (user_id)")
+
+    # Hourly and daily view rollups per property, refreshed on a schedule by
+    # db.refresh_property_view_stats. The unique indexes are needed for
+    # REFRESH MATERIALIZED VIEW CONCURRENTLY, which doesn't block readers.
+    # Building a view only reads property_views, it doesn't block writes to it.
+    for bucket, rollup in (("hour", "property_view_stats_hourly"), ("day", "property_view_stats_daily")):
+        cursor.execute(f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {rollup} AS
+        SELECT property_id,
+            date_trunc('{bucket}', created_at) AS bucket,
+            COUNT(*) AS views,
+            COUNT(DISTINCT user_id) AS unique_users
+        FROM property_views
+        GROUP BY property_id, date_trunc('{bucket}', created_at);
+        """)
+        cursor.execute(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_{rollup}_property_id_bucket
+        ON {rollup}(property_id, bucket);
+        """)
+
+
+def top_bid_columns(cursor):
+    # Current top bid per listing, kept up to date by db.bid_on_property. Nullable
+    # columns and constant defaults only change the catalog, the constraints are
+    # validated separately so the table isn't locked while the rows are checked.
+    cursor.execute("""
+    ALTER TABLE listing_property
+    ADD COLUMN IF NOT EXISTS min_bid_increment INT NOT NULL DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS top_bid_amount INT,
+    ADD COLUMN IF NOT EXISTS top_bidder_id INT,
+    ADD COLUMN IF NOT EXISTS top_bid_at TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS bid_count INT NOT NULL DEFAULT 0;
+    """)
+    add_constraint_not_valid(
+        cursor, "listing_property", "listing_property_min_bid_increment_check",
+        "CHECK (min_bid_increment > 0)")
+    add_constraint_not_valid(
+        cursor, "listing_property", "listing_property_top_bidder_id_fkey",
+        "FOREIGN KEY (top_bidder_id) REFERENCES users(id) ON DELETE SET NULL")
+
+    # Bids placed before the top bid columns existed
+    update_in_batches(cursor, "listing_property", """
+    UPDATE listing_property l
+    SET top_bid_amount = b.bid_amount, top_bidder_id = b.user_id,
+        top_bid_at = b.created_at, bid_count = b.bid_count
+    FROM (
+        SELECT DISTINCT ON (property_id)
+        property_id, bid_amount, user_id, created_at,
+        COUNT(*) OVER (PARTITION BY property_id) AS bid_count
+        FROM bids
+        WHERE property_id IN (
+            SELECT property_id FROM listing_property
+            WHERE id > %(first_id)s AND id <= %(last_id)s
+        )
+        ORDER BY property_id, bid_amount DESC, id
+    ) b
+    WHERE l.property_id = b.property_id
+    AND l.id > %(first_id)s AND l.id <= %(last_id)s
+    AND l.listing_status = 'Active'
+    AND l.top_bid_amount IS NULL;
+    """)
+
+
+def live_event_triggers(cursor):
+    # Push new bids, offers and notifications to the live (SSE) streams, see live.py.
+    # pg_notify inside the trigger is only delivered if the insert commits.
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION notify_live_event() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('live_events', json_build_object(
+            'type', CASE TG_TABLE_NAME WHEN 'bids' THEN 'bid' WHEN 'offers' THEN 'offer' ELSE 'notification' END,
+            'data', row_to_json(NEW)
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    for table in ("bids", "offers", "notifications"):
+        cursor.execute(f"""
+        DROP TRIGGER IF EXISTS {table}_live_event ON {table};
+        CREATE TRIGGER {table}_live_event
+        AFTER INSERT ON {table}
+        FOR EACH ROW EXECUTE FUNCTION notify_live_event();
+        """)
+
+
+def notification_indexes(cursor):
+    # Followers of a property, for the notification fan-out
+    create_index_concurrently(cursor, "idx_favorites_property_id", "favorites(property_id)")
+    # Inbox pages, newest first, and the unread badge (only unread rows are indexed)
+    create_index_concurrently(
+        cursor, "idx_notifications_user_id_created_at_id", "notifications(user_id, created_at, id)")
+    create_index_concurrently(
+        cursor, "idx_notifications_user_id_unread", "notifications(user_id, created_at, id) WHERE NOT is_read")
+
+
+def recompute_market_stats(cursor):
+    # price_changes_30d used to count listings with a price 30 days ago
+    cursor.execute("""
+    INSERT INTO market_stats_dirty (city)
+    SELECT DISTINCT city FROM market_stats
+    ON CONFLICT (city) DO NOTHING;
+    """)
+
+
+def batched_notification_events(cursor):
+    # The fan-out inserts one notification per follower in a single statement. A
+    # statement level trigger sends them as a few notification_batch events (the same
+    # notification, LIVE_BATCH_RECIPIENTS recipients each, so a payload stays well under
+    # the 8000 byte NOTIFY limit) instead of one NOTIFY per row. live.py expands them.
+    cursor.execute(f"""
+    CREATE OR REPLACE FUNCTION notify_live_notifications() RETURNS trigger AS $$
+    DECLARE
+        batch RECORD;
+    BEGIN
+        FOR batch IN
+            SELECT property_id, title, message, type, MAX(created_at) AS created_at,
+                json_agg(json_build_array(id, user_id, favorite_id) ORDER BY id) AS recipients
+            FROM (
+                SELECT *, (row_number() OVER (PARTITION BY property_id, title, message, type ORDER BY id) - 1)
+                    / {LIVE_BATCH_RECIPIENTS} AS chunk
+                FROM new_rows
+            ) rows
+            GROUP BY property_id, title, message, type, chunk
+        LOOP
+            PERFORM pg_notify('live_events', json_build_object(
+                'type', 'notification_batch',
+                'data', json_build_object(
+                    'property_id', batch.property_id, 'title', batch.title, 'message', batch.message,
+                    'type', batch.type, 'created_at', batch.created_at, 'recipients', batch.recipients
+                )
+            )::text);
+        END LOOP;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cursor.execute("""
+    DROP TRIGGER IF EXISTS notifications_live_event ON notifications;
+    CREATE TRIGGER notifications_live_event
+    AFTER INSERT ON notifications
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_live_notifications();
+    """)
+
+
+def wider_longitude(cursor):
+    # DECIMAL(10, 8) stops at +-99.99999999, too small for longitudes (up to +-180).
+    # More precision with the same scale doesn't rewrite the table, but the ALTER would
+    # rebuild idx_location_point under its exclusive lock. So the index is dropped and
+    # built again concurrently, the ALTER itself only locks location for a moment.
+    # Geo searches fall back to scanning location until the index is back.
+    cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_location_point;")
+    cursor.execute("ALTER TABLE location ALTER COLUMN longitude TYPE DECIMAL(11, 8);")
+    create_index_concurrently(cursor, "idx_location_point", "location USING gist (point(longitude::float8, latitude::float8))")
+
+
+def property_view_rollup_viewers(cursor):
+    # The distinct viewers of every bucket, so unique viewers over a whole range are
+    # counted from the same rollup (and the same refresh) as the views instead of the
+    # raw table. A materialized view can't get a column added: the new one is built
+    # next to the old one, which keeps serving reads, then swapped in by a short
+    # transaction. Views recorded in between show up on the next refresh as usual.
+    for bucket, rollup in (("hour", "property_view_stats_hourly"), ("day", "property_view_stats_daily")):
+        cursor.execute(
+            "SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = 'user_ids';",
+            (rollup,)
+        )
+        if cursor.fetchone() is not None:
+            continue
+        cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {rollup}_new;")
+        cursor.execute(f"""
+        CREATE MATERIALIZED VIEW {rollup}_new AS
+        SELECT property_id,
+            date_trunc('{bucket}', created_at) AS bucket,
+            COUNT(*) AS views,
+            COUNT(DISTINCT user_id) AS unique_users,
+            COALESCE(array_agg(DISTINCT user_id) FILTER (WHERE user_id IS NOT NULL), '{{}}') AS user_ids
+        FROM property_views
+        GROUP BY property_id, date_trunc('{bucket}', created_at);
+        """)
+        cursor.execute(f"CREATE UNIQUE INDEX idx_{rollup}_new_property_id_bucket ON {rollup}_new(property_id, bucket);")
+        cursor.execute(f"""
+        BEGIN;
+        DROP MATERIALIZED VIEW {rollup};
+        ALTER MATERIALIZED VIEW {rollup}_new RENAME TO {rollup};
+        ALTER INDEX idx_{rollup}_new_property_id_bucket RENAME TO idx_{rollup}_property_id_bucket;
+        COMMIT;
+        """)
+
+
+def market_stats_delete_triggers(cursor):
+    # Migration 4 only marked cities dirty on inserts and listing changes. Deleted
+    # listings (unlist_property) and prices, a property moving city, a new size or
+    # property type change the statistics too. A deleted property cascades to its location, whose
+    # trigger marks the city: the other rows can't look it up anymore by then.
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION mark_market_stats_dirty() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO market_stats_dirty (city)
+        SELECT city FROM location
+        WHERE property_id = CASE WHEN TG_OP = 'DELETE' THEN OLD.property_id ELSE NEW.property_id END
+        ON CONFLICT (city) DO NOTHING;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION mark_market_stats_dirty_location() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            INSERT INTO market_stats_dirty (city) VALUES (OLD.city) ON CONFLICT (city) DO NOTHING;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO market_stats_dirty (city) VALUES (NEW.city) ON CONFLICT (city) DO NOTHING;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION mark_market_stats_dirty_property() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO market_stats_dirty (city)
+        SELECT city FROM location WHERE property_id = NEW.id
+        ON CONFLICT (city) DO NOTHING;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cursor.execute("""
+    DROP TRIGGER IF EXISTS price_history_market_stats ON price_history;
+    CREATE TRIGGER price_history_market_stats
+    AFTER INSERT OR DELETE ON price_history
+    FOR EACH ROW EXECUTE FUNCTION mark_market_stats_dirty();
+
+    DROP TRIGGER IF EXISTS listing_property_market_stats ON listing_property;
+    CREATE TRIGGER listing_property_market_stats
+    AFTER INSERT OR DELETE OR UPDATE OF listing_status, start_price ON listing_property
+    FOR EACH ROW EXECUTE FUNCTION mark_market_stats_dirty();
+
+    DROP TRIGGER IF EXISTS features_market_stats ON features;
+    CREATE TRIGGER features_market_stats
+    AFTER INSERT OR DELETE OR UPDATE OF size_sqm ON features
+    FOR EACH ROW EXECUTE FUNCTION mark_market_stats_dirty();
+
+    DROP TRIGGER IF EXISTS properties_market_stats ON properties;
+    CREATE TRIGGER properties_market_stats
+    AFTER UPDATE OF property_type ON properties
+    FOR EACH ROW EXECUTE FUNCTION mark_market_stats_dirty_property();
+
+    DROP TRIGGER IF EXISTS location_market_stats ON location;
+    CREATE TRIGGER location_market_stats
+    AFTER INSERT OR DELETE OR UPDATE OF city, zip_code ON location
+    FOR EACH ROW EXECUTE FUNCTION mark_market_stats_dirty_location();
+    """)
+
+
+MIGRATIONS = [
+    Migration(1, "baseline schema", create_baseline_schema, transactional=True),
+    Migration(2, "foreign key indexes", foreign_key_indexes, transactional=False),
+    Migration(3, "favorites feed index", favorites_feed_index, transactional=False),
+    Migration(4, "market stats tables", market_stats_tables, transactional=True),
+    Migration(5, "keyset pagination indexes", keyset_pagination_indexes, transactional=False),
+    Migration(6, "property media indexes", property_media_indexes, transactional=False),
+    Migration(7, "listing search indexes", listing_search_indexes, transactional=False),
+    Migration(8, "geo search", geo_search, transactional=False),
+    Migration(9, "listing full-text search", listing_full_text_search, transactional=False),
+    Migration(10, "property view rollups", property_view_rollups, transactional=False),
+    Migration(11, "top bid columns", top_bid_columns, transactional=False),
+    Migration(12, "live event triggers", live_event_triggers, transactional=True),
+    Migration(13, "notification indexes", notification_indexes, transactional=False),
+    Migration(14, "recompute market stats", recompute_market_stats, transactional=True),
+    Migration(15, "batched notification events", batched_notification_events, transactional=True),
+    Migration(16, "wider longitude", wider_longitude, transactional=False),
+    Migration(17, "property view rollup viewers", property_view_rollup_viewers, transactional=False),
+    Migration(18, "market stats delete triggers", market_stats_delete_triggers, transactional=True),
+]
+
+
+def _ensure_version_table(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""CREATE TABLE IF NOT EXISTS schema_version(
+        version INT PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
+
+
+def applied_versions(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT version FROM schema_version;")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _record(cursor, migration):
+    cursor.execute(
+        "INSERT INTO schema_version (version, name) VALUES (%s, %s);",
+        (migration.version, migration.name)
+    )
+
+
+def migrate(migrations=MIGRATIONS, connect=get_connection):
+    """Applies the pending migrations in order. Returns the versions that were applied."""
+    applied = []
+    conn = connect()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK,))
+        try:
+            _ensure_version_table(conn)
+            done = applied_versions(conn)
+            for migration in sorted(migrations, key=lambda m: m.version):
+                if migration.version in done:
+                    continue
+                print(f"Applying migration {migration.version}: {migration.name}")
+                if migration.transactional:
+                    conn.autocommit = False
+                    with conn:
+                        with conn.cursor() as cursor:
+                            migration.apply(cursor)
+                            _record(cursor, migration)
+                    conn.autocommit = True
+                else:
+                    with conn.cursor() as cursor:
+                        migration.apply(cursor)
+                        _record(cursor, migration)
+                applied.append(migration.version)
+        finally:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK,))
+    finally:
+        conn.close()
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply database migrations")
+    parser.add_argument("--list", action="store_true", help="show the migrations and whether they are applied")
+    args = parser.parse_args()
+
+    if args.list:
+        conn = get_connection()
+        try:
+            conn.autocommit = True
+            _ensure_version_table(conn)
+            done = applied_versions(conn)
+        finally:
+            conn.close()
+        for migration in MIGRATIONS:
+            state = "applied" if migration.version in done else "pending"
+            print(f"{migration.version:>4}  {state:<8} {migration.name}")
+        return
+
+    applied = migrate()
+    print(f"Applied {len(applied)} migrations." if applied else "Database is up to date.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import logging
+import os
+import queue
+import threading
+
+from db import fan_out_notifications
+from db_setup import pooled_connection
+
+"""
+Background fan-out of favorite notifications on price and status changes.
+
+POST /properties/price_history/ and PUT /property/edit_listing/{listing_id} only
+queue a job and return. A worker thread runs each job as a single INSERT ... SELECT
+over the property's followers (db.fan_out_notifications), so a property with
+50,000 followers costs the broker's request nothing.
+
+Like the view buffer the queue is in memory: jobs still queued when the process
+dies are lost, and when NOTIFICATION_FANOUT_MAX_QUEUE jobs are waiting new ones
+are dropped (and counted). Queued jobs are run on shutdown.
+"""
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_FANOUT_MAX_QUEUE = int(os.getenv("NOTIFICATION_FANOUT_MAX_QUEUE", "10000"))
+
+
+class NotificationFanout:
+    def __init__(self, max_queue):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.counters = {
+            "queued": 0,
+            "dropped": 0,
+            "jobs": 0,
+            "failed": 0,
+            "notifications_created": 0,
+        }
+
+    def submit(self, kind, property_id, message):
+        """Queues a fan-out. Returns False if the queue was full and the job was dropped."""
+        try:
+            self._queue.put_nowait((kind, property_id, message))
+        except queue.Full:
+            with self._lock:
+                self.counters["dropped"] += 1
+            logger.warning("Notification fan-out queue is full, dropped %s for property %s", kind, property_id)
+            return False
+        with self._lock:
+            self.counters["queued"] += 1
+        return True
+
+    def _run_job(self, job):
+        kind, property_id, message = job
+        try:
+            with pooled_connection() as conn:
+                created = fan_out_notifications(conn, kind, property_id, message)
+        except Exception:
+            logger.exception("Fanning out %s notifications for property %s failed", kind, property_id)
+            with self._lock:
+                self.counters["failed"] += 1
+            return
+        with self._lock:
+            self.counters["jobs"] += 1
+            self.counters["notifications_created"] += created
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            self._run_job(job)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="notification-fanout", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Runs the jobs that are still queued, then stops the worker."""
+        if self._thread is None:
+            return
+        try:
+            # Waits for room if the queue is full, the worker keeps draining it
+            self._queue.put(None, timeout=30)
+        except queue.Full:
+            logger.warning("Notification fan-out didn't drain, %s jobs are lost", self._queue.qsize())
+        self._thread.join(timeout=30)
+        self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {"pending": self._queue.qsize(), **self.counters}
+
+
+notification_fanout = NotificationFanout(NOTIFICATION_FANOUT_MAX_QUEUE)
@@ -0,0 +1,64 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+"""
+Helpers for keyset (cursor) pagination.
+
+Instead of LIMIT/OFFSET, list queries seek past the last row of the previous page:
+
+    WHERE (created_at, id) < (%s::timestamp, %s) ORDER BY created_at DESC, id DESC LIMIT %s
+
+so every page is an index range scan no matter how deep it is. The client only ever
+sees an opaque cursor string (base64 encoded JSON of the sort key values of the last row).
+The first page seeks from a sentinel ('infinity', max int) so the same SQL serves all pages.
+A decoded cursor must have the types of that sentinel (an ISO timestamp where it has a
+string, an integer where it has an integer), anything else is a 400, not a database error.
+"""
+
+MAX_INT = 2147483647
+FIRST_PAGE = ("infinity", MAX_INT)
+
+
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, default=FIRST_PAGE):
+    """Turns a cursor string back into its sort key values, or returns `default` when there is none."""
+    if not cursor:
+        return default
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if (not isinstance(values, list) or len(values) != len(default)
+            or not all(_valid_value(value, like) for value, like in zip(values, default))):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return tuple(values)
+
+
+def _valid_value(value, like):
+    # bool is an int too, but never a sort key
+    if isinstance(like, int):
+        return isinstance(value, int) and not isinstance(value, bool) and -MAX_INT - 1 <= value <= MAX_INT
+    if not isinstance(value, str):
+        return False
+    if value == "infinity":
+        return True
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def next_cursor(rows, limit, keys=("created_at", "id")):
+    """Cursor for the page after `rows`, or None when this was the last page."""
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor([last[key] for key in keys])
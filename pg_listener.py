@@ -0,0 +1,116 @@
+import logging
+import select
+import threading
+
+from db_setup import get_connection
+
+"""
+One background thread per worker that LISTENs on Postgres channels and calls
+the registered callbacks for every NOTIFY.
+
+It uses its own dedicated (unpooled) connection, since a LISTENing connection has
+to stay open. If the connection drops it reconnects, re-LISTENs and calls the
+on_reconnect callbacks, because notifications sent while disconnected are lost.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class PgListener:
+    def __init__(self, connect=get_connection, poll_interval=1.0):
+        self._connect = connect
+        self._poll_interval = poll_interval
+        self._callbacks = {}
+        self._reconnect_callbacks = []
+        self._lock = threading.Lock()
+        self._pending_channels = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, channel, callback):
+        """callback(payload) is called from the listener thread for every NOTIFY on channel."""
+        with self._lock:
+            self._callbacks.setdefault(channel, []).append(callback)
+            self._pending_channels.add(channel)
+
+    def on_reconnect(self, callback):
+        with self._lock:
+            self._reconnect_callbacks.append(callback)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="pg-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _dispatch(self, channel, payload):
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception("NOTIFY callback for channel %s failed", channel)
+
+    def _listen_pending(self, conn):
+        with self._lock:
+            channels, self._pending_channels = self._pending_channels, set()
+        with conn.cursor() as cursor:
+            for channel in channels:
+                # Channel names are identifiers, they come from our own code and not from requests
+                cursor.execute(f'LISTEN "{channel}";')
+
+    def _run(self):
+        backoff = 1
+        first_connect = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                with self._lock:
+                    self._pending_channels = set(self._callbacks)
+                    reconnect_callbacks = list(self._reconnect_callbacks)
+                self._listen_pending(conn)
+                if not first_connect:
+                    for callback in reconnect_callbacks:
+                        callback()
+                first_connect = False
+                backoff = 1
+                while not self._stop.is_set():
+                    if self._pending_channels:
+                        self._listen_pending(conn)
+                    if select.select([conn], [], [], self._poll_interval) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._dispatch(notify.channel, notify.payload)
+            except Exception:
+                logger.exception("Postgres listener failed, reconnecting in %s seconds", backoff)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+_listener = PgListener()
+
+
+def get_listener():
+    return _listener
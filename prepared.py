@@ -0,0 +1,143 @@
+import os
+import re
+import threading
+import weakref
+
+from psycopg2 import errors, extensions
+
+"""
+Server-side prepared statements for the hot queries in db.py.
+
+    register("user_by_id", USER_SQL)
+    ...
+    execute(cursor, "user_by_id", (user_id,))
+
+- register() turns the psycopg2 style SQL (%s or %(name)s placeholders) into a
+  PREPARE name AS ... with $1, $2, ... and keeps it in the registry
+- execute() prepares the statement the first time it runs on a connection and after
+  that only sends EXECUTE name (params), so Postgres skips parsing and planning. Which
+  statements a connection has prepared is tracked per connection object, so a new
+  connection (after a reconnect, or a connection the pool replaced) prepares again
+- PREPARED_STATEMENTS=0 runs the original SQL instead, to compare in benchmarks
+- Prepared statements outlive transactions (a rollback doesn't drop them), they only
+  go away with the session or a DISCARD ALL / DEALLOCATE, see execute() for that case
+- The async backend doesn't use this: psycopg 3 prepares repeated queries by itself
+  (see db_setup.open_async_pool)
+"""
+
+PREPARED_STATEMENTS = os.getenv("PREPARED_STATEMENTS", "1") == "1"
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+# name -> (PREPARE sql, original sql, parameter names or number of positional parameters)
+_registry = {}
+# connection -> names prepared on it
+_prepared = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+_counters = {"prepares": 0, "executions": 0, "retries": 0}
+
+
+def _to_prepare(name, sql):
+    names = []
+    positional = 0
+
+    def replace(match):
+        nonlocal positional
+        if match.group(0) == "%%":
+            return "%"
+        if match.group(1) is None:
+            positional += 1
+            return f"${positional}"
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return f"${names.index(match.group(1)) + 1}"
+
+    body = _PLACEHOLDER.sub(replace, sql)
+    if names and positional:
+        raise ValueError(f"{name}: mixes %s and %(name)s placeholders")
+    return f"PREPARE {name} AS {body.strip()}", names or positional
+
+
+def register(name, sql):
+    """Adds a statement to the registry, under a name that is unique per statement."""
+    prepare_sql, parameters = _to_prepare(name, sql)
+    _registry[name] = (prepare_sql, sql, parameters)
+
+
+def _execute(cursor, name, params):
+    if params:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))});", params)
+    else:
+        cursor.execute(f"EXECUTE {name};")
+
+
+def _prepare(cursor, prepared, name):
+    conn = cursor.connection
+    first_in_transaction = conn.info.transaction_status == extensions.TRANSACTION_STATUS_IDLE
+    try:
+        cursor.execute(_registry[name][0])
+    except errors.DuplicatePreparedStatement:
+        # Still on the server, only the tracking lost it. Fine as soon as the failed
+        # transaction is out of the way
+        prepared.add(name)
+        if not first_in_transaction:
+            raise
+        conn.rollback()
+        return
+    prepared.add(name)
+    with _lock:
+        _counters["prepares"] += 1
+
+
+def _sync_prepared(conn, prepared):
+    # Keeps only the names the session still has
+    with extensions.cursor(conn) as cursor:
+        cursor.execute("SELECT name FROM pg_prepared_statements;")
+        prepared.intersection_update(row[0] for row in cursor.fetchall())
+
+
+def execute(cursor, name, params=()):
+    """
+    Runs the registered statement `name`. When the session lost its prepared statements
+    (DISCARD ALL, e.g. from a connection pooler) and this was the first statement of
+    the transaction, the transaction is rolled back and the statement prepared and run
+    again, and the other names are checked against pg_prepared_statements. Later in a
+    transaction the earlier statements can't be replayed, so the error is raised (a 500
+    for the request) and only this statement is prepared again the next time it runs.
+    """
+    _prepare_sql, sql, parameters = _registry[name]
+    if not PREPARED_STATEMENTS:
+        cursor.execute(sql, params)
+        return
+    conn = cursor.connection
+    with _lock:
+        prepared = _prepared.setdefault(conn, set())
+    first_in_transaction = conn.info.transaction_status == extensions.TRANSACTION_STATUS_IDLE
+    if name not in prepared:
+        _prepare(cursor, prepared, name)
+    if isinstance(parameters, list):
+        params = [params[parameter] for parameter in parameters]
+    try:
+        _execute(cursor, name, params)
+    except errors.InvalidSqlStatementName:
+        prepared.discard(name)
+        if not first_in_transaction:
+            raise
+        conn.rollback()
+        # A DEALLOCATE drops one statement, a DISCARD ALL all of them
+        _sync_prepared(conn, prepared)
+        _prepare(cursor, prepared, name)
+        _execute(cursor, name, params)
+        with _lock:
+            _counters["retries"] += 1
+    with _lock:
+        _counters["executions"] += 1
+
+
+def stats():
+    with _lock:
+        return {
+            "enabled": PREPARED_STATEMENTS,
+            "statements": sorted(_registry),
+            **_counters,
+        }
@@ -0,0 +1,43 @@
+import logging
+import threading
+
+from db_setup import pooled_connection
+
+"""
+Minimal periodic jobs for things like refreshing rollups.
+
+    start_periodic("refresh view stats", 300, refresh_property_view_stats)
+
+runs the function every `interval` seconds in a daemon thread, passing it a pooled
+connection. Errors are logged and the job simply runs again next time.
+stop_periodic() is called on shutdown.
+"""
+
+logger = logging.getLogger(__name__)
+
+_jobs = []
+
+
+def _run(name, interval, func, stop):
+    while not stop.wait(interval):
+        try:
+            with pooled_connection() as conn:
+                func(conn)
+        except Exception:
+            logger.exception("Periodic job %r failed", name)
+
+
+def start_periodic(name, interval, func):
+    if interval <= 0:
+        return
+    stop = threading.Event()
+    thread = threading.Thread(target=_run, args=(name, interval, func, stop), name=name, daemon=True)
+    thread.start()
+    _jobs.append((thread, stop))
+
+
+def stop_periodic():
+    while _jobs:
+        thread, stop = _jobs.pop()
+        stop.set()
+        thread.join(timeout=5)
@@ -2,8 +2,9 @@
 # Pydantic schemas are used to validate data that you receive, or to make sure that whatever data
 # you send back to the client follows a certain structure
 from calendar import c
+from typing import Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class UserCreate(BaseModel):
@@ -105,6 +106,26 @@ class ListingCreate(BaseModel):
     end_date: str 
     listing_status: str
     listing_type: str
+    min_bid_increment: int = Field(1, ge=1)
+
+class ListingSearch(BaseModel):
+    listing_type: str | None = None
+    property_type: str | None = None
+    min_price: int | None = None
+    max_price: int | None = None
+    min_rooms: int | None = None
+    min_bathrooms: int | None = None
+    city: str | None = None
+    energy_class: str | None = None
+    has_pool: bool | None = None
+    has_garden: bool | None = None
+    has_balcony: bool | None = None
+    has_parking: bool | None = None
+    has_elevator: bool | None = None
+    has_garage: bool | None = None
+    sort: Literal["newest", "price_asc", "price_desc"] = "newest"
+    limit: int = Field(20, ge=1, le=100)
+    cursor: str | None = None
 
 class UpdateStatus(BaseModel):
     listing_status: str
@@ -134,6 +155,9 @@ class CreatePriceHistory(BaseModel):
     property_id : int
     end_price : int
 
+class NotificationIds(BaseModel):
+    notification_ids: list[int] | None = Field(None, max_length=1000)
+
 class RecordView(BaseModel):
     user_id : int
     property_id : int
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import psycopg2
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_setup import get_connection  # noqa: E402
+
+"""
+These tests need a Postgres database, configured like the app (.env / DATABASE_*).
+They are skipped when it can't be reached.
+"""
+
+
+@pytest.fixture
+def conn():
+    try:
+        conn = get_connection()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"no database: {e}")
+    yield conn
+    conn.close()
@@ -0,0 +1,53 @@
+import logging
+
+import pytest
+
+import metrics
+
+# A SELECT with a side effect: ANALYZE runs the insert, plain EXPLAIN doesn't
+INSERTING_SELECT = "WITH added AS (INSERT INTO explain_test VALUES (1) RETURNING n) SELECT n FROM added"
+
+
+@pytest.fixture
+def slow_queries(monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "SLOW_QUERY_MS", 1e-6)
+    monkeypatch.setattr(metrics, "SLOW_QUERY_EXPLAIN", True)
+    caplog.set_level(logging.WARNING, logger="slow_query")
+    return caplog
+
+
+def rows(cursor):
+    cursor.execute("SELECT COUNT(*) FROM explain_test;")
+    return cursor.fetchone()[0]
+
+
+def test_slow_select_is_explained_without_running_it_again(conn, slow_queries):
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+    assert "Result" in slow_queries.text
+    assert "actual time" not in slow_queries.text
+
+
+@pytest.mark.parametrize("analyze", [False, True])
+def test_explain_leaves_the_transaction_unchanged(conn, monkeypatch, analyze):
+    monkeypatch.setattr(metrics, "SLOW_QUERY_EXPLAIN_ANALYZE", analyze)
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE explain_test (n int);")
+            plan = metrics._explain(conn, INSERTING_SELECT, None)
+            assert ("actual time" in plan) == analyze
+            assert ("Execution Time" in plan) == analyze
+            assert rows(cursor) == 0
+            # A failing EXPLAIN doesn't abort the transaction either
+            assert "EXPLAIN failed" in metrics._explain(conn, "SELECT * FROM no_such_table", None)
+            assert rows(cursor) == 0
+
+
+def test_explain_analyze_on_autocommit_connection(conn, monkeypatch):
+    monkeypatch.setattr(metrics, "SLOW_QUERY_EXPLAIN_ANALYZE", True)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE TEMP TABLE explain_test (n int);")
+        assert "actual time" in metrics._explain(conn, INSERTING_SELECT, None)
+        assert rows(cursor) == 0
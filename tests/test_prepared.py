@@ -0,0 +1,76 @@
+import pytest
+from psycopg2 import errors
+
+import prepared
+
+pytestmark = pytest.mark.skipif(not prepared.PREPARED_STATEMENTS, reason="PREPARED_STATEMENTS=0")
+
+prepared.register("test_one", "SELECT %s::int + 1;")
+prepared.register("test_two", "SELECT %s::int + 2;")
+
+
+def run(conn, name, value):
+    with conn:
+        with conn.cursor() as cursor:
+            prepared.execute(cursor, name, (value,))
+            return cursor.fetchone()[0]
+
+
+def deallocate(conn, name):
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DEALLOCATE {name};")
+
+
+def test_prepares_once_per_connection(conn):
+    before = prepared.stats()["prepares"]
+    assert run(conn, "test_one", 1) == 2
+    assert run(conn, "test_one", 2) == 3
+    assert prepared.stats()["prepares"] == before + 1
+
+
+def test_retries_when_one_statement_was_deallocated(conn):
+    run(conn, "test_one", 1)
+    run(conn, "test_two", 1)
+    deallocate(conn, "test_one")
+    retries = prepared.stats()["retries"]
+
+    assert run(conn, "test_one", 1) == 2
+    assert prepared.stats()["retries"] == retries + 1
+    # The other statement is still prepared and must not be prepared again
+    assert run(conn, "test_two", 1) == 3
+
+
+def test_retries_after_discard_all(conn):
+    run(conn, "test_one", 1)
+    run(conn, "test_two", 1)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("DISCARD ALL;")
+    conn.autocommit = False
+
+    assert run(conn, "test_one", 1) == 2
+    assert run(conn, "test_two", 1) == 3
+
+
+def test_raises_later_in_a_transaction_and_recovers(conn):
+    run(conn, "test_one", 1)
+    run(conn, "test_two", 1)
+    deallocate(conn, "test_two")
+
+    with pytest.raises(errors.InvalidSqlStatementName):
+        with conn:
+            with conn.cursor() as cursor:
+                prepared.execute(cursor, "test_one", (1,))
+                prepared.execute(cursor, "test_two", (1,))
+
+    assert run(conn, "test_one", 1) == 2
+    assert run(conn, "test_two", 1) == 3
+
+
+def test_statement_prepared_but_not_tracked(conn):
+    run(conn, "test_one", 1)
+    prepared._prepared[conn].discard("test_one")
+
+    assert run(conn, "test_one", 1) == 2
+    assert run(conn, "test_one", 2) == 3
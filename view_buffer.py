@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from db import record_property_views_bulk
+from db_setup import pooled_connection
+
+"""
+Write-behind buffering for property views (POST /property/view/).
+
+With VIEW_BUFFER_ENABLED=1 a view is only appended to an in-memory queue and the
+request returns right away. A background thread writes the queue to property_views
+with one multi-row INSERT per batch, whenever VIEW_BUFFER_BATCH_SIZE views are
+waiting or every VIEW_BUFFER_FLUSH_INTERVAL seconds, and once more on shutdown.
+
+Views are stamped when they are queued, in UTC (an aware datetime). The INSERT turns
+that into the database's local time, like the CURRENT_TIMESTAMP default of directly
+inserted views, so both land in the same rollup buckets whatever the time zone of
+the app server.
+
+The trade-off: if the process dies, the views of the last few seconds are lost.
+The queue holds at most VIEW_BUFFER_MAX_SIZE views, when it's full new views
+are dropped (and counted) rather than letting memory grow.
+"""
+
+logger = logging.getLogger(__name__)
+
+VIEW_BUFFER_ENABLED = os.getenv("VIEW_BUFFER_ENABLED", "0") == "1"
+VIEW_BUFFER_MAX_SIZE = int(os.getenv("VIEW_BUFFER_MAX_SIZE", "100000"))
+VIEW_BUFFER_BATCH_SIZE = int(os.getenv("VIEW_BUFFER_BATCH_SIZE", "1000"))
+VIEW_BUFFER_FLUSH_INTERVAL = float(os.getenv("VIEW_BUFFER_FLUSH_INTERVAL", "2"))
+
+
+class ViewBuffer:
+    def __init__(self, max_size, batch_size, flush_interval, write=None):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._write = write or self._write_batch
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.counters = {
+            "buffered": 0,
+            "dropped": 0,
+            "flushed": 0,
+            "rejected": 0,
+            "failed": 0,
+            "flushes": 0,
+        }
+
+    def add(self, user_id, property_id):
+        """Queues a view. Returns False if the buffer was full and the view was dropped."""
+        with self._lock:
+            if len(self._queue) >= self.max_size:
+                self.counters["dropped"] += 1
+                return False
+            self._queue.append((user_id, property_id, datetime.now(timezone.utc)))
+            self.counters["buffered"] += 1
+            full_batch = len(self._queue) >= self.batch_size
+        if full_batch:
+            self._wakeup.set()
+        return True
+
+    @staticmethod
+    def _write_batch(batch):
+        with pooled_connection() as conn:
+            return record_property_views_bulk(conn, batch)
+
+    def flush(self):
+        """Writes everything that is queued right now, in batches. Returns the number of rows inserted."""
+        inserted = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    if not self._queue:
+                        break
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                try:
+                    written = self._write(batch)
+                except Exception:
+                    logger.exception("Flushing %s buffered views failed", len(batch))
+                    self._requeue(batch)
+                    break
+                inserted += written
+                with self._lock:
+                    self.counters["flushes"] += 1
+                    self.counters["flushed"] += written
+                    self.counters["rejected"] += len(batch) - written
+        return inserted
+
+    def _requeue(self, batch):
+        # Put the batch back in front for the next attempt, as far as there is room
+        with self._lock:
+            room = max(0, self.max_size - len(self._queue))
+            kept = batch[:room]
+            self._queue.extendleft(reversed(kept))
+            self.counters["failed"] += len(batch) - len(kept)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="view-buffer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the flush thread and writes whatever is still queued."""
+        if self._thread is not None:
+            self._stop.set()
+            self._wakeup.set()
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": VIEW_BUFFER_ENABLED,
+                "queued": len(self._queue),
+                "max_size": self.max_size,
+                "batch_size": self.batch_size,
+                "flush_interval": self.flush_interval,
+                **self.counters,
+            }
+
+
+view_buffer = ViewBuffer(VIEW_BUFFER_MAX_SIZE, VIEW_BUFFER_BATCH_SIZE, VIEW_BUFFER_FLUSH_INTERVAL)